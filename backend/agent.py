@@ -1,13 +1,62 @@
-from dataclasses import dataclass
+import asyncio
+import os
+import threading
+import time
+from collections.abc import AsyncIterable, Callable
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from decimal import Decimal
+from functools import partial
+from typing import Any, Literal
 
 import logfire
 from google.oauth2 import service_account
-from pydantic_ai import Agent, ModelRetry, RunContext, ToolOutput
+from opentelemetry import trace
+from pydantic import TypeAdapter
+from pydantic_ai import Agent, AgentRunResult, ModelRetry, RunContext, ToolOutput
+from pydantic_ai.messages import (
+    AgentStreamEvent,
+    ModelResponse,
+    ModelResponsePart,
+    PartDeltaEvent,
+    PartStartEvent,
+    TextPart,
+    ThinkingPart,
+    ToolCallPart,
+)
+from pydantic_ai.models import Model
+from pydantic_ai.models.anthropic import AnthropicModelSettings
 from pydantic_ai.models.google import GoogleModel
 from pydantic_ai.providers.google import GoogleProvider
+from pydantic_ai.tools import ToolDefinition
+from pydantic_ai.usage import RunUsage
+
+from backend.book import get_opening_book
+from backend.c4model import C4Model, C4ModelSettings, c4_model_settings
+from backend.game import FIRST_PLAYER, AIModel, Column, GameState, Position, column_bit, get_player_icon
+from backend.hedge import get_hedge_model, hedge, latencies, latency_histogram
+from backend.limiter import get_model_limiters, provider_name
+from backend.move_cache import move_cache
+from backend.solver import solve, winning_cells
+
+# `solver` plays `local:c4` in-process, `c4ai` sends each move to the c4ai service via `C4Model`
+local_engine = os.getenv('C4_LOCAL_ENGINE') or 'solver'
+# models whose moves come from the opening book while the position is in it, `*` for every model
+book_models = set((os.getenv('C4_BOOK_MODELS') or 'local:c4').split(','))
+
+# how the position is described to models: `moves` lists every move as a `player,column` line, `compact` is a single
+# string of the columns played, `board` is the rendered grid
+type PromptEncoding = Literal['moves', 'compact', 'board']
+prompt_encoding: PromptEncoding = TypeAdapter[PromptEncoding](PromptEncoding).validate_python(
+    os.getenv('C4_PROMPT_ENCODING') or 'moves'
+)
 
-from backend.c4model import C4Model
-from backend.game import FIRST_PLAYER, Column, GameState, get_player_icon
+tactical_counter = logfire.metric_counter(
+    'c4.agent.tactical_moves', unit='1', description='Moves chosen by the tactical pre-pass instead of a model'
+)
+retries_counter = logfire.metric_counter(
+    'c4.agent.retries', unit='1', description='Extra model requests made by agent runs, e.g. after invalid moves'
+)
 
 
 @dataclass
@@ -22,10 +71,83 @@ class AIMove:
     column: Column
 
 
+@dataclass
+class MoveCosts:
+    """Usage and cost of the agent runs made for moves while set in `move_costs`."""
+
+    usage: RunUsage = field(default_factory=RunUsage)
+    cost: Decimal = Decimal(0)
+    unpriced_requests: int = 0
+    """Requests to models `genai-prices` doesn't know the price of, so missing from `cost`."""
+
+    def add(self, result: AgentRunResult[AIMove]) -> None:
+        self.usage.incr(result.usage())
+        for message in result.new_messages():
+            if isinstance(message, ModelResponse):
+                try:
+                    self.cost += message.cost().total_price
+                except (LookupError, AssertionError):
+                    self.unpriced_requests += 1
+
+
+# set to collect the usage and cost of moves generated in the current context, e.g. by a tournament
+move_costs: ContextVar[MoveCosts | None] = ContextVar('move_costs', default=None)
+
+
+@dataclass(kw_only=True)
+class ReasoningEvent:
+    """Part of a move as the model streams it: text to add to its thinking or reasoning, or the column it chose."""
+
+    model: AIModel
+    thinking: str = ''
+    reasoning: str = ''
+    column: Column | None = None
+    """Set once, as soon as the column has been parsed from the `move` call and is a legal move."""
+
+
+# arguments of a `move` call which is still being streamed, the last string may be incomplete
+parse_partial_args = partial(
+    TypeAdapter[dict[str, Any]](dict[str, Any]).validate_json, experimental_allow_partial='trailing-strings'
+)
+# set to receive the reasoning of moves generated by models in the current context as it's streamed
+move_reasoning: ContextVar[Callable[[ReasoningEvent], None] | None] = ContextVar('move_reasoning', default=None)
+
+
+def offer_legal_columns(ctx: RunContext[Connect4Deps], tool_defs: list[ToolDefinition]) -> list[ToolDefinition]:
+    """Restrict `column` in the `move` tool schema to the columns which aren't full."""
+    legal = list(ctx.deps.game_state.position.legal_columns())
+    prepared: list[ToolDefinition] = []
+    for tool_def in tool_defs:
+        schema = tool_def.parameters_json_schema
+        properties = {**schema['properties'], 'column': {**schema['properties']['column'], 'enum': legal}}
+        prepared.append(replace(tool_def, parameters_json_schema={**schema, 'properties': properties}))
+    return prepared
+
+
+FIRST_PLAYER_ICON = get_player_icon(FIRST_PLAYER)
+# identical for every move of every game, so providers can cache it, see `build_move_prompt` for the rest
+CONNECT4_INSTRUCTIONS = f"""\
+You are an expert Connect Four strategist, {FIRST_PLAYER_ICON} is the first player.
+
+Apply these principles to choose the optimal move for the next turn:
+
+- Control the center columns to maximize future connections.
+- Take any immediate win, or block the opponent's immediate win.
+- Set up double‑threat "forks" (two winning lines at once) whenever possible.
+- Plan vertical, horizontal, and diagonal wins; track odd/even‑row parity
+    (first player prefers odd‑row wins, second player even‑row wins).
+- Never play a move that lets the opponent win on their next turn.
+
+Analyze the board and use the `move` tool to respond with the column number (1‑7) of your best move.
+If you are a thinking model, don't think for too long — we want to play fast!
+"""
+
 connect4_agent = Agent[Connect4Deps, AIMove](
     deps_type=Connect4Deps,
+    system_prompt=CONNECT4_INSTRUCTIONS,
     retries=7,  # can try all columns lol
     output_type=ToolOutput(type_=AIMove, name='move'),
+    prepare_output_tools=offer_legal_columns,
 )
 
 
@@ -39,58 +161,200 @@ def validate_move(ctx: RunContext[Connect4Deps], move: AIMove) -> AIMove:
     return move
 
 
-@connect4_agent.system_prompt
-def build_connect4_instructions(ctx: RunContext[Connect4Deps]) -> str:
-    player = ctx.deps.game_state.get_next_player()
-
+def build_move_prompt(game_state: GameState, encoding: PromptEncoding = 'moves') -> str:
+    """The user prompt for a move, all the per-position data goes here so the system prompt never changes."""
+    player = game_state.get_next_player()
     player_icon = get_player_icon(player)
     opponent_icon = get_player_icon('pink' if player == 'orange' else 'orange')
-    first_player_icon = get_player_icon(FIRST_PLAYER)
-    moves = '\n'.join(f'{get_player_icon(m.player)},{m.column}' for m in ctx.deps.game_state.moves)
+    header = f'You are playing as **{player_icon}** (opponent is **{opponent_icon}**), choose your next move.'
 
-    return f"""\
-You are an expert Connect Four strategist playing as **{player_icon}**
-(opponent is **{opponent_icon}**; {first_player_icon} is the first player).
+    if encoding == 'compact':
+        columns = ''.join(str(m.column) for m in game_state.moves) or 'none'
+        return f'{header}\n\ncolumns played so far, in order, starting with {FIRST_PLAYER_ICON}: {columns}\n'
+    elif encoding == 'board':
+        board = game_state.render_board()
+        return f'{header}\n\nboard (column numbers, then rows top to bottom, `.` is empty):\n\n```\n{board}\n```\n'
+    else:
+        moves = '\n'.join(f'{get_player_icon(m.player)},{m.column}' for m in game_state.moves)
+        return f'{header}\n\nmoves (as player,column pairs):\n\n```\n{moves}\n```\n'
 
-Apply these principles to choose the optimal move for the next turn:
 
-- Control the center columns to maximize future connections.
-- Take any immediate win, or block the opponent's immediate win.
-- Set up double‑threat "forks" (two winning lines at once) whenever possible.
-- Plan vertical, horizontal, and diagonal wins; track odd/even‑row parity
-    (first player prefers odd‑row wins, second player even‑row wins).
-- Never play a move that lets the opponent win on their next turn.
+async def generate_next_move(game_state: GameState) -> Column:
+    model_name = game_state.get_next_ai()
+    assert model_name is not None, 'Pink AI is not set'
 
-Analyze the board and use the `move` tool to respond with the column number (1‑7) of your best move.
-If you are a thinking model, don't think for too long — we want to play fast!
+    with logfire.span('generate next move with {model}', model=model_name, ply=len(game_state.moves)) as span:
+        if (model_name in book_models or '*' in book_models) and (column := lookup_book_move(game_state)):
+            span.set_attribute('move_source', 'book')
+            return column
 
-moves (as player,column pairs):
+        if tactical := tactical_move(game_state.position):
+            column, reason = tactical
+            span.set_attributes({'move_source': 'tactical', 'tactical_reason': reason})
+            tactical_counter.add(1, {'model': model_name, 'reason': reason})
+            return column
 
-```
-{moves}
-```
-"""
+        if (column := await move_cache.get(model_name, game_state.position)) is not None:
+            span.set_attribute('move_source', 'cache')
+            return column
 
+        if backup_model := get_hedge_model(game_state, model_name):
+            (column, source), winner = await hedge(
+                model_name,
+                partial(generate_model_move, game_state, model_name),
+                backup_model,
+                partial(generate_model_move, game_state, backup_model),
+            )
+            span.set_attributes({'move_source': source, 'hedge_winner': winner, 'hedge_model': backup_model})
+            if winner == 'backup':
+                # the move wasn't chosen by `model_name`, so shouldn't be cached as its move
+                return column
+        else:
+            start = time.perf_counter()
+            column, source = await generate_model_move(game_state, model_name)
+            seconds = time.perf_counter() - start
+            latencies.record(model_name, seconds)
+            latency_histogram.record(seconds, {'model': model_name, 'hedged': False})
+            span.set_attribute('move_source', source)
 
-async def generate_next_move(game_state: GameState) -> Column:
-    player = game_state.get_next_player()
-    if player == 'orange':
-        model = game_state.orange_ai
-    else:
-        assert game_state.pink_ai is not None, 'Pink AI is not set'
-        model = game_state.pink_ai
+        await move_cache.set(model_name, game_state.position, column)
+        return column
+
+
+async def generate_model_move(game_state: GameState, model_name: AIModel) -> tuple[Column, str]:
+    """Generate a move with the solver for `local:c4`, otherwise the agent, returns the column and move source."""
+    if model_name == 'local:c4' and local_engine == 'solver':
+        return await generate_solver_move(game_state), 'solver'
 
-    if model.startswith('google-vertex:'):
+    result = await run_agent(game_state, model_name)
+    usage = result.usage()
+    trace.get_current_span().set_attributes({'input_tokens': usage.input_tokens, 'output_tokens': usage.output_tokens})
+    if usage.requests > 1:
+        retries_counter.add(usage.requests - 1, {'model': model_name})
+    if (costs := move_costs.get()) is not None:
+        costs.add(result)
+    return result.output.column, 'agent'
+
+
+async def run_agent(
+    game_state: GameState, model_name: AIModel, encoding: PromptEncoding | None = None
+) -> AgentRunResult[AIMove]:
+    model: Model | str = model_name
+    settings: AnthropicModelSettings | C4ModelSettings = {}
+    if model_name.startswith('google-vertex:'):
         credentials = service_account.Credentials.from_service_account_file(  # pyright: ignore[reportUnknownMemberType]
             'path/to/service-account.json',
             scopes=['https://www.googleapis.com/auth/cloud-platform'],
         )
-        model = GoogleModel(model[len('google-vertex:') :], provider=GoogleProvider(credentials=credentials))
-    elif model == 'local:c4':
+        model = GoogleModel(model_name[len('google-vertex:') :], provider=GoogleProvider(credentials=credentials))
+    elif model_name == 'local:c4':
         model = C4Model()
+        settings = c4_model_settings(game_state)
+
+    if provider_name(model_name) == 'anthropic':
+        # anthropic only caches prompts with explicit breakpoints, the other providers cache prefixes automatically
+        settings = {'anthropic_cache_tool_definitions': True, 'anthropic_cache_instructions': True}
+
+    # `C4Model` doesn't stream, and has no reasoning to stream anyway
+    listener = None if isinstance(model, C4Model) else move_reasoning.get()
 
     logfire.info('playing', board=game_state.render_board())
-    result = await connect4_agent.run(
-        'Please generate the next move', deps=Connect4Deps(game_state=game_state), model=model
-    )
-    return result.output.column
+    model_limiter, provider_limiter = get_model_limiters(model_name)
+    async with model_limiter.acquire(), provider_limiter.acquire():
+        return await connect4_agent.run(
+            # `C4Model` gets the position from its settings, so doesn't need it rendered into a prompt
+            'Please generate the next move'
+            if isinstance(model, C4Model)
+            else build_move_prompt(game_state, encoding or prompt_encoding),
+            deps=Connect4Deps(game_state=game_state),
+            model=model,
+            model_settings=settings,
+            event_stream_handler=partial(stream_reasoning, model_name, listener) if listener else None,
+        )
+
+
+async def stream_reasoning(
+    model_name: AIModel,
+    listener: Callable[[ReasoningEvent], None],
+    ctx: RunContext[Connect4Deps],
+    events: AsyncIterable[AgentStreamEvent],
+) -> None:
+    """Pass the thinking and `move` reasoning of each streamed model response to `listener` as it arrives.
+
+    The column is passed on as soon as it's been parsed and is legal, the same check as `validate_move`, so it can
+    be shown before the run finishes.
+    """
+    parts: dict[int, ModelResponsePart] = {}
+    # length of the text of each part already passed on
+    sent: dict[int, int] = {}
+    chosen: set[int] = set()
+    legal = ctx.deps.game_state.position.legal_columns()
+    async for event in events:
+        if isinstance(event, PartStartEvent):
+            part = parts[event.index] = event.part
+            sent[event.index] = 0
+        elif isinstance(event, PartDeltaEvent) and event.index in parts:
+            part = parts[event.index] = event.delta.apply(parts[event.index])
+        else:
+            continue
+
+        if isinstance(part, ThinkingPart | TextPart):
+            # text before the `move` call is the model thinking aloud
+            if text := part.content[sent[event.index] :]:
+                sent[event.index] = len(part.content)
+                listener(ReasoningEvent(model=model_name, thinking=text))
+        elif isinstance(part, ToolCallPart) and part.tool_name == 'move':
+            try:
+                args = part.args if isinstance(part.args, dict) else parse_partial_args(part.args or '{}')
+            except ValueError:
+                continue
+            reasoning = args.get('reasoning')
+            if isinstance(reasoning, str) and (text := reasoning[sent[event.index] :]):
+                sent[event.index] = len(reasoning)
+                listener(ReasoningEvent(model=model_name, reasoning=text))
+            # columns are a single digit, so a parsed column is complete even though the args are partial
+            column = args.get('column')
+            if column in legal and event.index not in chosen:
+                chosen.add(event.index)
+                listener(ReasoningEvent(model=model_name, column=column))
+
+
+def tactical_move(position: Position) -> tuple[Column, str] | None:
+    """A move which doesn't need a model, and why: the only legal column, a win, or the only block of a loss."""
+    legal = position.legal_columns()
+    if len(legal) == 1:
+        return legal[0], 'only-move'
+
+    player = position.n_moves % 2
+    mask = position.masks[0] | position.masks[1]
+    playable = {c: column_bit(c, position.heights[c - 1]) for c in legal}
+    wins = winning_cells(position.masks[player], mask)
+    if win := next((c for c, bit in playable.items() if bit & wins), None):
+        return win, 'win'
+
+    threats = winning_cells(position.masks[1 - player], mask)
+    # with two or more threats the game is lost whatever we play, so leave it to the model
+    blocks = [c for c, bit in playable.items() if bit & threats]
+    if len(blocks) == 1:
+        return blocks[0], 'block'
+
+
+def lookup_book_move(game_state: GameState) -> Column | None:
+    if book := get_opening_book():
+        return book.lookup(game_state.position)
+
+
+async def generate_solver_move(game_state: GameState) -> Column:
+    with logfire.span('local solver move', board=game_state.render_board()) as span:
+        # cancelling this task, e.g. when `hedge` or speculation discards the move, can't stop the thread, so the
+        # search is told to stop rather than using CPU and the GIL for the rest of its budget
+        cancel = threading.Event()
+        try:
+            # copy the position so the search never sees a move applied while it's running in the thread
+            result = await asyncio.to_thread(solve, game_state.position.copy(), cancel=cancel)
+        finally:
+            cancel.set()
+        span.set_attributes(
+            {'column': result.column, 'score': result.score, 'depth': result.depth, 'nodes': result.nodes}
+        )
+        return result.column
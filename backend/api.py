@@ -1,14 +1,21 @@
+import asyncio
+import time
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import aclosing, suppress
 from typing import Annotated
 
 import httpx
 import logfire
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import PlainTextResponse
-from pydantic import UUID4, BaseModel, Field
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import UUID4, BaseModel, Field, TypeAdapter, ValidationError
+from starlette.websockets import WebSocketState
 
-from .agent import generate_next_move
+from .agent import ReasoningEvent, generate_next_move, move_reasoning
 from .db import DB
-from .game import AIModel, Column, GameState, model_labels
+from .game import AIModel, Column, GameState, GameStatus, Move, Player, model_labels
+from .runner import game_runner_enabled
+from .speculation import speculator
 
 api_router = APIRouter()
 
@@ -41,18 +48,62 @@ class StartGame(BaseModel, validate_by_name=True):
 
 @api_router.get('/games/start')
 async def start_game(
-    db: Annotated[DB, Depends(DB.get_dep)], orange_ai: AIModel, pink_ai: AIModel | None = None
+    db: Annotated[DB, Depends(DB.get_dep)],
+    orange_ai: AIModel,
+    pink_ai: AIModel | None = None,
+    hedge_ai: AIModel | None = None,
 ) -> StartGame:
-    game_id = await db.create_game(orange_ai, pink_ai)
+    game_id = await db.create_game(orange_ai, pink_ai, hedge_ai)
     return StartGame(game_id=game_id)
 
 
-@api_router.get('/games/{game_id:uuid}/state')
-async def get_game_state(db: Annotated[DB, Depends(DB.get_dep)], game_id: UUID4) -> GameState:
-    if game_state := await db.get_game(game_id):
-        return game_state
-    else:
+class GameDelta(BaseModel):
+    """The moves played after `since`, returned instead of the whole game by `/games/{id}/state?since=<ply>`."""
+
+    since: int
+    status: GameStatus
+    moves: list[Move]
+
+
+def game_etag(game_id: UUID4, ply: int, status: GameStatus, since: int | None) -> str:
+    """A game only changes by adding moves, which may change its status, so this identifies its state.
+
+    A delta is a different representation of the same state, so `since` is part of the tag, otherwise a cache which
+    ignores the query string could revalidate a full response with a delta's tag.
+    """
+    representation = '' if since is None else f'-since-{since}'
+    return f'"{game_id.hex}-{ply}-{status}{representation}"'
+
+
+@api_router.get('/games/{game_id:uuid}/state', response_model=GameState | GameDelta)
+async def get_game_state(
+    db: Annotated[DB, Depends(DB.get_dep)],
+    game_id: UUID4,
+    response: Response,
+    since: Annotated[int | None, Query(ge=0, description='only return moves after this ply')] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> GameState | GameDelta | Response:
+    """The game, or with `since` only the moves after that ply.
+
+    Responses have an ETag, `If-None-Match` gets a 304 without loading the game's moves if it hasn't changed.
+    """
+    # `no-cache` means browsers revalidate with `If-None-Match` on every poll, rather than reusing a stale state
+    headers = {'Cache-Control': 'no-cache'}
+    if if_none_match:
+        version = await db.get_game_version(game_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail='game not found')
+        etag = game_etag(game_id, *version, since)
+        if etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(',')) or if_none_match == '*':
+            return Response(status_code=304, headers={**headers, 'ETag': etag})
+
+    game_state = await db.get_game(game_id)
+    if game_state is None:
         raise HTTPException(status_code=404, detail='game not found')
+    response.headers.update({**headers, 'ETag': game_etag(game_id, len(game_state.moves), game_state.status, since)})
+    if since is None:
+        return game_state
+    return GameDelta(since=since, status=game_state.status, moves=game_state.moves[since:])
 
 
 @api_router.post('/games/{game_id}/move')
@@ -60,7 +111,7 @@ async def game_move(db: Annotated[DB, Depends(DB.get_dep)], game_id: UUID4, colu
     """
     Either:
         Takes a move from a human player, applies it, then makes an AI move
-        or, in ai-vs-ai mode, generates a move for the AI player only
+        or, in ai-vs-ai mode, generates a move for the AI player only, unless the game runner is playing the game
 
     Always returns the updated game state.
     """
@@ -76,22 +127,293 @@ async def game_move(db: Annotated[DB, Depends(DB.get_dep)], game_id: UUID4, colu
     if column == 7 and len(game_state.moves) == 2:
         raise ValueError("You can't use column 7 on the second move!")
 
+    speculated = None
     if column is not None:
         await db.handle_move(game_id, game_state, column)
+        speculated = speculator.take(game_id, len(game_state.moves) - 1, column)
 
     logfire.info('Game status: {game_state.status}', game_id=game_id, game_state=game_state)
-    if game_state.status == 'playing':
-        ai_column = await generate_next_move(game_state)
-        # check there's been no more moves before applying this move
-        new_move_count = await db.get_move_count(game_id)
-        if new_move_count == len(game_state.moves):
-            await db.handle_move(game_id, game_state, ai_column)
+    if game_state.status == 'playing' and not (game_state.pink_ai and game_runner_enabled):
+        ai_column = await speculator.reply(speculated, game_state)
+        # fails with a 409 if there's been another move while we were generating this one
+        await db.handle_move(game_id, game_state, ai_column)
+        # only speculates in human-vs-ai games, while the human thinks about their next move
+        speculator.speculate(game_id, game_state)
 
     if game_state.status != 'playing':
         logfire.info('Final game status: {game_state.status}', game_id=game_id, game_state=game_state)
     return game_state
 
 
+class MoveEvent(BaseModel):
+    ply: int
+    player: Player
+    column: Column
+    status: GameStatus
+
+
+class EventError(BaseModel):
+    """Sent as an `error` event when a move can't be generated, the details are only logged."""
+
+    error: str
+
+
+# comment lines sent while waiting for a slow model, so proxies don't drop the idle connection
+KEEPALIVE_INTERVAL = 15
+# how often to check for new moves when they're made by the game runner
+EVENTS_POLL_INTERVAL = 0.5
+
+
+@api_router.get('/games/{game_id}/events')
+async def game_events(
+    db: Annotated[DB, Depends(DB.get_dep)],
+    game_id: UUID4,
+    last_event_id: Annotated[int, Header(ge=0)] = 0,
+) -> Response:
+    """
+    Plays an ai-vs-ai game server side, or follows it if it's played by the game runner, streaming each move as a
+    server-sent event.
+
+    While a model generates a move, its reasoning is streamed as `reasoning` events, see `stream_next_move`.
+
+    The event id is the ply of the move, so a client that reconnects with `Last-Event-ID` only receives the moves
+    it hasn't seen, a finished game with nothing left to send returns 204 which stops `EventSource` reconnecting.
+    """
+    game_state = await db.get_game(game_id)
+    if not game_state:
+        raise HTTPException(status_code=404, detail='game not found')
+    elif game_state.pink_ai is None:
+        raise HTTPException(status_code=400, detail='events are only available for ai-vs-ai games')
+    elif game_state.status != 'playing' and last_event_id >= len(game_state.moves):
+        return Response(status_code=204)
+
+    return StreamingResponse(
+        play_game_events(db, game_id, game_state, last_event_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+async def play_game_events(db: DB, game_id: UUID4, game_state: GameState, sent: int) -> AsyncIterator[str]:
+    while True:
+        for ply, move in enumerate(game_state.moves[sent:], start=sent + 1):
+            # only the last move knows the final status, earlier moves were made while the game was playing
+            status = game_state.status if ply == len(game_state.moves) else 'playing'
+            event = MoveEvent(ply=ply, player=move.player, column=move.column, status=status)
+            yield f'id: {ply}\ndata: {event.model_dump_json()}\n\n'
+        sent = len(game_state.moves)
+        if game_state.status != 'playing':
+            return
+
+        if game_runner_enabled:
+            game_state = await wait_for_move(db, game_id, sent)
+            if len(game_state.moves) == sent:
+                yield ': keepalive\n\n'
+            continue
+
+        column: Column | None = None
+        try:
+            async with aclosing(stream_next_move(game_state)) as stream:
+                async for item in stream:
+                    if item is None:
+                        yield ': keepalive\n\n'
+                    elif isinstance(item, ReasoningEvent):
+                        # no id, so reconnecting resumes from the last move rather than part way through its reasoning
+                        yield f'event: reasoning\ndata: {dump_reasoning(item)}\n\n'
+                    else:
+                        column = item
+        except Exception:
+            logfire.exception('Error generating move for {game_id=}', game_id=game_id)
+            error = EventError(error='failed to generate move')
+            yield f'event: error\ndata: {error.model_dump_json()}\n\n'
+            return
+        assert column is not None, '`stream_next_move` always ends with the column'
+
+        try:
+            await db.handle_move(game_id, game_state, column)
+        except HTTPException as e:
+            if e.status_code != 409:
+                raise
+            # another client moved first, reload and send whatever we've missed
+            reloaded = await db.get_game(game_id)
+            assert reloaded is not None, 'game deleted while playing'
+            game_state = reloaded
+
+
+reasoning_event_schema = TypeAdapter(ReasoningEvent)
+
+
+def dump_reasoning(event: ReasoningEvent) -> str:
+    """JSON of a `ReasoningEvent`, only including the fields which are set."""
+    return reasoning_event_schema.dump_json(event, exclude_defaults=True).decode()
+
+
+async def stream_next_move(game_state: GameState) -> AsyncGenerator[ReasoningEvent | Column | None]:
+    """
+    Generate the next move, yielding the model's reasoning as it's streamed, `None` after `KEEPALIVE_INTERVAL`
+    without any, and finally the column.
+    """
+    events = asyncio.Queue[ReasoningEvent | None]()
+    # the task copies the context, so the listener only applies to this move
+    token = move_reasoning.set(events.put_nowait)
+    try:
+        task = asyncio.create_task(generate_next_move(game_state))
+    finally:
+        move_reasoning.reset(token)
+    task.add_done_callback(lambda _: events.put_nowait(None))
+
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), KEEPALIVE_INTERVAL)
+            except TimeoutError:
+                yield None
+                continue
+            if event is None:
+                yield task.result()
+                return
+            yield event
+    finally:
+        task.cancel()
+
+
+async def wait_for_move(db: DB, game_id: UUID4, n_moves: int) -> GameState:
+    """Poll until the game has more than `n_moves` moves, returns the latest state after `KEEPALIVE_INTERVAL`."""
+    deadline = time.monotonic() + KEEPALIVE_INTERVAL
+    while True:
+        await asyncio.sleep(EVENTS_POLL_INTERVAL)
+        game_state = await db.get_game(game_id)
+        assert game_state is not None, 'game deleted while playing'
+        if len(game_state.moves) > n_moves or time.monotonic() > deadline:
+            return game_state
+
+
+class PlayerMove(BaseModel):
+    """A human move, sent by the client over `/games/{id}/ws`."""
+
+    column: Column
+
+
+class SessionError(BaseModel):
+    """Sent over `/games/{id}/ws` when a move is rejected, the session carries on."""
+
+    error: str
+
+
+# close codes for `/games/{id}/ws`, in the range for applications and mirroring the equivalent HTTP status
+WS_NOT_HUMAN_VS_AI = 4400
+WS_GAME_NOT_FOUND = 4404
+WS_GAME_CHANGED = 4409
+
+
+@api_router.websocket('/games/{game_id}/ws')
+async def game_websocket(websocket: WebSocket, game_id: UUID4) -> None:
+    """
+    Plays a human-vs-ai game over a WebSocket, the game is loaded once and kept in memory while the client is
+    connected, rather than reloaded for every move as by `/games/{id}/move`.
+
+    The client sends `{"column": <1-7>}`, the human's move is sent back as a `MoveEvent` as soon as it's validated,
+    then the AI's reasoning as `ReasoningEvent`s while it's generated, then the AI's move. Moves are stored in order
+    in the background, so neither waits for the database. A rejected move gets a `SessionError`, if the game is
+    changed by another client the connection is closed with `WS_GAME_CHANGED`.
+    """
+    # accepted before loading the game, so the client sees the close code if it can't be played
+    await websocket.accept()
+    db: DB = websocket.app.state.db
+    game_state = await db.get_game(game_id)
+    if not game_state:
+        await websocket.close(WS_GAME_NOT_FOUND, 'game not found')
+        return
+    elif game_state.pink_ai is not None:
+        await websocket.close(WS_NOT_HUMAN_VS_AI, 'only human-vs-ai games can be played over a WebSocket')
+        return
+
+    writes = asyncio.Queue[GameState | None]()
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(store_moves(db, game_id, writes))
+            tg.create_task(play_session(websocket, game_id, game_state, writes))
+    except* HTTPException:
+        # only raised by `store_moves`, with a 409 when another client moved first, the session can't continue
+        logfire.warn('Game {game_id=} changed during WebSocket session', game_id=game_id)
+        if websocket.application_state == WebSocketState.CONNECTED:
+            with suppress(WebSocketDisconnect):
+                await websocket.close(WS_GAME_CHANGED, 'game has changed since it was loaded')
+
+
+async def play_session(
+    websocket: WebSocket, game_id: UUID4, game_state: GameState, writes: asyncio.Queue[GameState | None]
+) -> None:
+    """Play moves on the in-memory `game_state`, queueing a copy after each move for `store_moves`."""
+
+    async def send_move(move: Move) -> None:
+        event = MoveEvent(ply=len(game_state.moves), player=move.player, column=move.column, status=game_state.status)
+        await websocket.send_text(event.model_dump_json())
+
+    # the AI's reply to the human's last move, if it was generated while the human was thinking
+    speculated: asyncio.Task[Column] | None = None
+    speculator.speculate(game_id, game_state)
+    try:
+        while True:
+            # the human plays pink, so it's the AI's turn here unless the AI failed to move in an earlier request
+            if game_state.status == 'playing' and game_state.get_next_player() == 'orange':
+                column: Column | None = None
+                if speculated is not None:
+                    column = await speculator.result(speculated)
+                    speculated = None
+                try:
+                    if column is None:
+                        async with aclosing(stream_next_move(game_state)) as stream:
+                            async for item in stream:
+                                if isinstance(item, ReasoningEvent):
+                                    await websocket.send_text(dump_reasoning(item))
+                                elif item is not None:
+                                    column = item
+                except WebSocketDisconnect:
+                    raise
+                except Exception:
+                    logfire.exception('Error generating move for {game_id=}', game_id=game_id)
+                    await websocket.close(1011, 'failed to generate move')
+                    return
+                assert column is not None, '`stream_next_move` always ends with the column'
+                ai_move = game_state.handle_move(column)
+                writes.put_nowait(game_state.clone())
+                await send_move(ai_move)
+                speculator.speculate(game_id, game_state)
+
+            try:
+                column = PlayerMove.model_validate_json(await websocket.receive_text()).column
+            except ValidationError as e:
+                error = f'invalid move: {e.errors()[0]["msg"]}'
+            else:
+                if game_state.status != 'playing':
+                    error = 'game is over'
+                elif not game_state.position.can_play(column):
+                    error = f'Column {column} is full'
+                else:
+                    if column == 7 and len(game_state.moves) == 2:
+                        # the same deliberate error as `game_move`, closing like its 500, so both transports show it
+                        await websocket.close(1011, 'internal server error')
+                        raise ValueError("You can't use column 7 on the second move!")
+                    human_move = game_state.handle_move(column)
+                    writes.put_nowait(game_state.clone())
+                    speculated = speculator.take(game_id, len(game_state.moves) - 1, column)
+                    await send_move(human_move)
+                    continue
+            await websocket.send_text(SessionError(error=error).model_dump_json())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # moves already played are still stored after the client disconnects
+        writes.put_nowait(None)
+
+
+async def store_moves(db: DB, game_id: UUID4, writes: asyncio.Queue[GameState | None]) -> None:
+    """Store the last move of each game state from `writes` in order, until `None`."""
+    while (game_state := await writes.get()) is not None:
+        await db.store_last_move(game_id, game_state)
+
+
 # Proxy to Logfire for client traces from the browser
 @api_router.post('/client-traces')
 async def client_traces(request: Request):
@@ -0,0 +1,160 @@
+"""Opening book of precomputed solver moves, read through `mmap` so workers share one copy via the page cache.
+
+File layout:
+
+* 16 byte little endian header: `b'C4BK'`, format version (u32), number of entries (u64)
+* the canonical key (see `Position.canonical_key`) of each position as a little endian u64, sorted
+* the best column for each position as u8, in the same order
+
+The shipped book deliberately covers only the first 4 plies: 719 positions in 6KB, solved at 800ms each. 8 plies
+would be 129,498 positions, about 1.2MB, and take some 29 CPU hours to solve at the same budget, while from the
+fifth ply on the solver reaches a useful depth within a move's budget anyway. Generate the book with:
+
+    uv run python -m backend.book --plies 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from pathlib import Path
+
+import logfire
+
+from backend.game import N_COLUMNS, Column, Position, mirror_column
+from backend.solver import SearchBudget, solve
+
+__all__ = 'OpeningBook', 'get_opening_book'
+
+_MAGIC = b'C4BK'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIQ')
+
+default_book_path = Path(__file__).parent / 'opening_book.bin'
+
+lookups_counter = logfire.metric_counter('c4.book.lookups', unit='1', description='Opening book lookups')
+hits_counter = logfire.metric_counter('c4.book.hits', unit='1', description='Opening book lookups that found a move')
+
+
+class OpeningBook:
+    def __init__(self, path: Path):
+        with path.open('rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f'{path} is not a version {_VERSION} opening book')
+        keys_end = _HEADER.size + count * 8
+        view = memoryview(self._mmap)
+        # casts are views onto the mapped file, nothing is copied onto the heap
+        self._keys: Sequence[int] = view[_HEADER.size : keys_end].cast('Q')
+        if sys.byteorder == 'big':
+            # keys are stored little endian, so big endian hosts need their own swapped copy
+            keys = array('Q', self._keys)
+            keys.byteswap()
+            self._keys = keys
+        self._columns = view[keys_end : keys_end + count]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def lookup(self, position: Position) -> Column | None:
+        """Best column for `position`, or `None` if it's not in the book."""
+        key, mirrored = position.canonical_key()
+        index = bisect_left(self._keys, key)
+        lookups_counter.add(1)
+        if index == len(self._keys) or self._keys[index] != key:
+            return None
+        hits_counter.add(1)
+        column = self._columns[index]
+        return mirror_column(column) if mirrored else column
+
+
+@cache
+def get_opening_book() -> OpeningBook | None:
+    """The book at `C4_BOOK_PATH`, loaded once per process, `None` if there's no book."""
+    path = Path(os.getenv('C4_BOOK_PATH') or default_book_path)
+    if not path.exists():
+        logfire.warn('no opening book at {path}', path=str(path))
+        return None
+    book = OpeningBook(path)
+    logfire.info('loaded opening book {path} with {entries} entries', path=str(path), entries=len(book))
+    return book
+
+
+def write_book(path: Path, entries: dict[int, Column]) -> None:
+    keys = sorted(entries)
+    with path.open('wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(keys)))
+        key_array = array('Q', keys)
+        if sys.byteorder == 'big':
+            key_array.byteswap()
+        key_array.tofile(f)
+        f.write(bytes(entries[k] for k in keys))
+
+
+def book_positions(max_plies: int) -> Iterator[tuple[int, Sequence[Column]]]:
+    """Every position up to `max_plies` where the game is still going, once per canonical key.
+
+    Yields the canonical key and the moves that reach the position.
+    """
+    seen: set[int] = set()
+    frontier: list[tuple[Column, ...]] = [()]
+    for _ in range(max_plies + 1):
+        next_frontier: list[tuple[Column, ...]] = []
+        for moves in frontier:
+            position = Position.from_columns(moves)
+            key, _ = position.canonical_key()
+            if key in seen:
+                continue
+            seen.add(key)
+            yield key, moves
+            for column in range(1, N_COLUMNS + 1):
+                if position.can_play(column) and not position.copy().play(column):
+                    next_frontier.append((*moves, column))
+        frontier = next_frontier
+
+
+def _solve_canonical(moves: Sequence[Column], budget: SearchBudget) -> Column:
+    """Solve a position and return the move in the orientation of the position's canonical key."""
+    position = Position.from_columns(moves)
+    _, mirrored = position.canonical_key()
+    column = solve(position, budget).column
+    return mirror_column(column) if mirrored else column
+
+
+def generate(path: Path, max_plies: int, budget: SearchBudget, workers: int | None) -> None:
+    positions = list(book_positions(max_plies))
+    print(f'solving {len(positions)} positions up to {max_plies} plies...', flush=True)
+    start = time.perf_counter()
+    entries: dict[int, Column] = {}
+    with ProcessPoolExecutor(workers) as executor:
+        moves = [m for _, m in positions]
+        columns = executor.map(_solve_canonical, moves, [budget] * len(moves), chunksize=16)
+        for index, ((key, _), column) in enumerate(zip(positions, columns), start=1):
+            entries[key] = column
+            if index % 500 == 0:
+                print(f'  {index}/{len(positions)} {time.perf_counter() - start:.0f}s', flush=True)
+    write_book(path, entries)
+    print(f'wrote {len(entries)} entries to {path} in {time.perf_counter() - start:.0f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the opening book.')
+    parser.add_argument('--plies', type=int, default=4, help='deepest position in the book, in plies')
+    parser.add_argument('--budget-ms', type=int, default=800, help='solver time budget per position')
+    parser.add_argument('--workers', type=int, default=None, help='solver processes, defaults to the CPU count')
+    parser.add_argument('--output', type=Path, default=default_book_path)
+    args = parser.parse_args()
+    budget = SearchBudget(max_seconds=args.budget_ms / 1000, max_nodes=10**9)
+    generate(args.output, args.plies, budget, args.workers)
+    # sanity check the book we just wrote reads back
+    assert OpeningBook(args.output).lookup(Position()) is not None
@@ -1,72 +1,171 @@
-"""Custom model to call the c4ai service"""
+"""Custom model to call the c4ai service
 
+The position is passed to `C4Model` in `C4ModelSettings`, see `c4_model_settings`, rather than rendered into the
+prompt and parsed back out. Requests use a dedicated keep-alive connection pool, with `C4AI_BATCH` set concurrent
+requests are coalesced into one request to c4ai's `/batch` endpoint.
+"""
+
+from __future__ import annotations
+
+import asyncio
 import os
-import random
-import re
-from typing import Literal
+from collections import Counter
+from functools import cache
+from typing import Literal, TypedDict, cast
 
+import httpx
 import logfire
-from pydantic import BaseModel, TypeAdapter, model_validator
-from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, SystemPromptPart, ToolCallPart
-from pydantic_ai.models import Model, ModelRequestParameters, cached_async_http_client
+from pydantic import BaseModel, TypeAdapter
+from pydantic_ai.exceptions import UserError
+from pydantic_ai.messages import ModelMessage, ModelResponse, ToolCallPart
+from pydantic_ai.models import Model, ModelRequestParameters
 from pydantic_ai.settings import ModelSettings
 
-from backend.game import Column
+from backend.game import COLUMN_PREFERENCE, Column, GameState, get_player_icon
+
+__all__ = ('C4Model', 'C4ModelSettings', 'C4AIBatcher', 'c4_model_settings', 'get_c4ai_client')
 
-__all__ = ('C4Model',)
+ROWS = 6
 
 
-class Move(BaseModel):
+class Move(TypedDict):
     column: Column
     player: Literal['X', 'O']
 
-    @model_validator(mode='before')
-    @classmethod
-    def validate_column(cls, value: str | dict[str, str | int]) -> dict[str, str | int]:
-        if isinstance(value, str):
-            player, column = value.strip().split(',', 1)
-            return {'column': column, 'player': player}
-        else:
-            return value
+
+class C4ModelSettings(ModelSettings, total=False):
+    c4_moves: list[Move]
+    """The moves played so far, in the format c4ai expects."""
+
+
+def c4_model_settings(game_state: GameState) -> C4ModelSettings:
+    """Settings passing the position in `game_state` to `C4Model`."""
+    return {'c4_moves': [Move(column=m.column, player=get_player_icon(m.player)) for m in game_state.moves]}
 
 
 class C4Move(BaseModel):
     column: int
 
 
+class C4Columns(BaseModel):
+    columns: list[int]
+
+
 moves_schema = TypeAdapter(list[Move])
+batch_schema = TypeAdapter(list[list[Move]])
 c4ai_url = os.getenv('C4AI_URL') or 'http://localhost:9000'
+c4ai_batch = bool(os.getenv('C4AI_BATCH'))
+
+
+@cache
+def get_c4ai_client() -> httpx.AsyncClient:
+    """Client for c4ai, reusing connections between moves rather than sharing a pool with the model providers."""
+    return httpx.AsyncClient(
+        base_url=c4ai_url,
+        limits=httpx.Limits(
+            max_connections=int(os.getenv('C4AI_MAX_CONNECTIONS') or 50),
+            max_keepalive_connections=int(os.getenv('C4AI_MAX_KEEPALIVE') or 20),
+            keepalive_expiry=float(os.getenv('C4AI_KEEPALIVE_EXPIRY') or 30),
+        ),
+        timeout=httpx.Timeout(
+            float(os.getenv('C4AI_TIMEOUT') or 10), connect=float(os.getenv('C4AI_CONNECT_TIMEOUT') or 2)
+        ),
+    )
+
+
+class C4AIBatcher:
+    """Coalesces concurrent move requests into batches for c4ai's `/batch` endpoint.
+
+    The first request waits up to `window` seconds for others to join its batch, a full batch is sent straight away.
+    """
+
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self._pending: list[tuple[list[Move], asyncio.Future[int]]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def get_column(self, moves: list[Move]) -> int:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((moves, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            # hold a reference until the batch is sent, the event loop only keeps weak references to tasks
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[list[Move], asyncio.Future[int]]]) -> None:
+        try:
+            with logfire.span('c4ai batch of {size}', size=len(batch)):
+                columns = await request_columns([moves for moves, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), column in zip(batch, columns, strict=True):
+                if not future.done():
+                    future.set_result(column)
 
 
-class C4Model(Model):
-    def __init__(self):
-        self.client = cached_async_http_client()
+async def request_column(moves: list[Move]) -> int:
+    r = await get_c4ai_client().post(
+        '/', content=moves_schema.dump_json(moves), headers={'Content-Type': 'application/json'}
+    )
+    r.raise_for_status()
+    return C4Move.model_validate_json(r.content).column
+
+
+async def request_columns(positions: list[list[Move]]) -> list[int]:
+    """Next move for each position, in one request, e.g. for many concurrent games or eval cases."""
+    r = await get_c4ai_client().post(
+        '/batch', content=batch_schema.dump_json(positions), headers={'Content-Type': 'application/json'}
+    )
+    r.raise_for_status()
+    return C4Columns.model_validate_json(r.content).columns
 
+
+batcher = C4AIBatcher(
+    window=float(os.getenv('C4AI_BATCH_WINDOW_MS') or 5) / 1000,
+    max_size=int(os.getenv('C4AI_BATCH_SIZE') or 32),
+)
+
+
+class C4Model(Model):
     async def request(
         self,
         messages: list[ModelMessage],
         model_settings: ModelSettings | None,
         model_request_parameters: ModelRequestParameters,
     ) -> ModelResponse:
-        logfire.info('C4Model message count {count_messages}', count_messages=len(messages), messages=messages)
-        request = messages[0]
-        assert isinstance(request, ModelRequest), 'Expected ModelRequest'
-        system_prompt = '\n'.join(p.content for p in request.parts if isinstance(p, SystemPromptPart))
-        logfire.info(f'{system_prompt=}')
-        moves_match = re.search('^```(.+)```$', system_prompt, flags=re.DOTALL | re.MULTILINE)
-        assert moves_match is not None, 'Expected moves data'
-        moves = moves_schema.validate_python(moves_match.group(1).strip().splitlines())
-        r = await self.client.post(
-            c4ai_url, content=moves_schema.dump_json(moves), headers={'Content-Type': 'application/json'}
-        )
-        r.raise_for_status()
-        move = C4Move.model_validate_json(r.content)
-        # we should never reply with the same column twice
+        moves = cast(C4ModelSettings, model_settings or {}).get('c4_moves')
+        if moves is None:
+            raise UserError('C4Model needs the position in `model_settings`, see `c4_model_settings`')
+        logfire.info('C4Model message count {count_messages}', count_messages=len(messages), moves=len(moves))
+        column = await batcher.get_column(moves) if c4ai_batch else await request_column(moves)
+        # c4ai shouldn't suggest a full column, or one already rejected in this run, but if it does play the first
+        # legal column in order of preference, rather than spending a retry on another bad column
+        full = {c for c, count in Counter(m['column'] for m in moves).items() if count >= ROWS}
         used_columns = self._used_columns(messages)
-        while move.column in used_columns:
-            logfire.info('column {move.column} already used', used_columns=used_columns, move=move)
-            move.column = random.randint(1, 7)
-        return ModelResponse(parts=[ToolCallPart(tool_name='move', args=move.model_dump())])
+        if column in full or column in used_columns:
+            fallback = next((c for c in COLUMN_PREFERENCE if c not in full and c not in used_columns), column)
+            logfire.info(
+                'column {column} not playable, playing {fallback}', column=column, fallback=fallback, full=full
+            )
+            column = fallback
+        return ModelResponse(parts=[ToolCallPart(tool_name='move', args=C4Move(column=column).model_dump())])
 
     @staticmethod
     def _used_columns(messages: list[ModelMessage]) -> set[int]:
@@ -75,7 +174,7 @@ class C4Model(Model):
             if isinstance(message, ModelResponse):
                 for part in message.parts:
                     if isinstance(part, ToolCallPart) and part.tool_name == 'move':
-                        columns.add(part.args['column'])  # type: ignore
+                        columns.add(part.args_as_dict()['column'])
         return columns
 
     @property
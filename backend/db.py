@@ -1,101 +1,269 @@
 from __future__ import annotations
 
 import os
-from collections.abc import AsyncIterator
-from contextlib import AsyncExitStack, asynccontextmanager
-from dataclasses import dataclass
-from pathlib import Path
+import time
+from collections.abc import AsyncIterator, Callable, Iterable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from functools import partial
 from typing import TYPE_CHECKING
 from uuid import UUID
 
 import asyncpg
 import fastapi
 import logfire
+from fastapi import HTTPException
+from opentelemetry.metrics import CallbackOptions, Observation
 
-from .game import Column, GameState, Move
+from .game import AIModel, Column, GameState, GameStatus, Move, moves_from_columns
+from .game_cache import GameCache
+from .migrate import migrate
 
 # hack to get around asyncpg's poor typing support
 if TYPE_CHECKING:
     DbConn = asyncpg.Connection[asyncpg.Record]
+    PoolConn = asyncpg.pool.PoolConnectionProxy[asyncpg.Record]
     Pool = asyncpg.Pool[asyncpg.Record]
 else:
     DbConn = asyncpg.Connection
+    PoolConn = asyncpg.pool.PoolConnectionProxy
     Pool = asyncpg.Pool
 
 
+# hot queries, kept as constants so each connection's statement cache prepares them once and reuses them
+GET_GAME = 'select pink_ai, orange_ai, hedge_ai, status, move_columns from games where id=$1'
+GET_GAME_VERSION = 'select cardinality(move_columns), status from games where id=$1'
+# the moves after the first $2, to bring a cached game state up to date
+GET_GAME_MOVES_SINCE = 'select status, move_columns[$2 + 1:] from games where id=$1'
+APPEND_MOVE = """
+with game as (
+    update games set status=$3, move_columns=move_columns || $4::smallint
+    where id=$1 and cardinality(move_columns)=$2 and status='playing'
+    returning id
+)
+insert into moves (game_id, player, column_index)
+select id, $5, $4 from game
+returning id
+"""
+
+acquire_histogram = logfire.metric_histogram(
+    'db.pool.acquire', unit='ms', description='Time spent waiting to acquire a connection from the pool'
+)
+waiters_counter = logfire.metric_up_down_counter(
+    'db.pool.waiters', unit='1', description='Tasks waiting to acquire a connection from the pool'
+)
+in_use_counter = logfire.metric_up_down_counter(
+    'db.pool.in_use', unit='1', description='Connections currently acquired from the pool'
+)
+
+
 @dataclass
 class DB:
     _pool: Pool
+    _games: GameCache = field(default_factory=lambda: GameCache(int(os.getenv('C4_GAME_CACHE_SIZE') or 10_000)))
 
     @asynccontextmanager
     @staticmethod
     async def connect() -> AsyncIterator[DB]:
         dsn = os.getenv('DATABASE_URL') or 'postgresql://postgres@localhost:5432'
         with logfire.span('db connect', dsn=dsn):
-            pool = await asyncpg.create_pool(dsn)
-            schema_path = Path(__file__).parent / 'schema.sql'
+            pool = await asyncpg.create_pool(
+                dsn,
+                min_size=int(os.getenv('DATABASE_POOL_MIN_SIZE') or 2),
+                max_size=int(os.getenv('DATABASE_POOL_MAX_SIZE') or 20),
+                statement_cache_size=int(os.getenv('DATABASE_STATEMENT_CACHE_SIZE') or 100),
+                max_inactive_connection_lifetime=float(os.getenv('DATABASE_MAX_INACTIVE_LIFETIME') or 300),
+                command_timeout=float(os.getenv('DATABASE_COMMAND_TIMEOUT') or 30),
+            )
             async with pool.acquire() as conn:
-                await conn.execute(schema_path.read_text())
+                await migrate(conn)
 
+        logfire.metric_gauge_callback(
+            'db.pool.size', [partial(_observe, pool.get_size)], unit='1', description='Open connections in the pool'
+        )
+        logfire.metric_gauge_callback(
+            'db.pool.idle', [partial(_observe, pool.get_idle_size)], unit='1', description='Idle connections'
+        )
         try:
             yield DB(pool)
         finally:
             with logfire.span('db close', dsn=dsn):
                 await pool.close()
 
+    @asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[PoolConn]:
+        """Acquire a connection, recording pool saturation metrics."""
+        waiters_counter.add(1)
+        start = time.perf_counter()
+        try:
+            conn = await self._pool.acquire()
+        finally:
+            waiters_counter.add(-1)
+            acquire_histogram.record((time.perf_counter() - start) * 1000)
+        in_use_counter.add(1)
+        try:
+            yield conn
+        finally:
+            in_use_counter.add(-1)
+            await self._pool.release(conn)
+
     @staticmethod
     async def get_dep(request: fastapi.Request) -> DB:
         return request.app.state.db
 
-    async def create_game(self, orange_ai: str, pink_ai: str | None = None) -> UUID:
-        # TODO use pool
-        return await self._pool.fetchval(
-            'insert into games (orange_ai, pink_ai) values ($1, $2) returning id;', orange_ai, pink_ai
-        )
+    async def create_game(
+        self, orange_ai: AIModel, pink_ai: AIModel | None = None, hedge_ai: AIModel | None = None
+    ) -> UUID:
+        async with self._acquire() as conn:
+            game_id: UUID = await conn.fetchval(
+                'insert into games (orange_ai, pink_ai, hedge_ai) values ($1, $2, $3) returning id;',
+                orange_ai,
+                pink_ai,
+                hedge_ai,
+            )
+        self._games.set(game_id, GameState(pink_ai=pink_ai, orange_ai=orange_ai, hedge_ai=hedge_ai))
+        return game_id
 
     @logfire.instrument
     async def get_game(self, game_id: UUID) -> GameState | None:
-        row = await self._pool.fetchrow(
-            """
-            select
-                pink_ai,
-                orange_ai,
-                status,
-                coalesce(
-                array_agg(json_build_object('player', player, 'column', column_index))
-                filter (where moves.id is not null),
-                '{}'
-                ) as moves
-            from games
-            left join moves on games.id = moves.game_id
-            where games.id=$1
-            group by pink_ai, orange_ai, status
-            """,
-            game_id,
-        )
+        if cached := self._games.get(game_id):
+            return await self._refresh(game_id, cached)
+
+        async with self._acquire() as conn:
+            row = await conn.fetchrow(GET_GAME, game_id)
         if not row:
             return None
 
-        pink_ai, orange_ai, status, moves = row
-        return GameState(
+        pink_ai, orange_ai, hedge_ai, status, move_columns = row
+        game_state = GameState(
             pink_ai=pink_ai,
             orange_ai=orange_ai,
+            hedge_ai=hedge_ai,
             status=status,
-            moves=[Move.model_validate_json(m) for m in moves],
+            moves=moves_from_columns(move_columns),
         )
+        self._games.set(game_id, game_state)
+        return game_state
 
-    async def get_move_count(self, game_id: UUID) -> int:
-        return await self._pool.fetchval('select count(*) from moves where game_id=$1', game_id)
+    async def _refresh(self, game_id: UUID, cached: GameState) -> GameState | None:
+        """Play any moves stored since `cached` was cached, e.g. by another process, on it."""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow(GET_GAME_MOVES_SINCE, game_id, len(cached.moves))
+        if not row:
+            self._games.evict(game_id, 'deleted')
+            return None
+        status, new_columns = row
+        if new_columns:
+            for column in new_columns:
+                cached.handle_move(column)
+            cached.status = status
+            self._games.set(game_id, cached)
+        return cached
+
+    async def get_game_version(self, game_id: UUID) -> tuple[int, GameStatus] | None:
+        """The number of moves and status of a game, enough to tell if it's changed without loading its moves."""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow(GET_GAME_VERSION, game_id)
+        return (row[0], row[1]) if row else None
 
-    async def handle_move(self, game_id: UUID, game_state: GameState, column: Column):
+    async def handle_move(self, game_id: UUID, game_state: GameState, column: Column) -> Move:
+        """Apply a move to `game_state` and store it, in a single statement.
+
+        A move in a game which `game_state` shows is already over fails with a 400 before anything is stored. The
+        move is only stored if the game still has the number of moves `game_state` had, and is still being played,
+        otherwise another request got there first and this fails with a 409.
+        """
         new_move = game_state.handle_move(column)
-        async with AsyncExitStack() as stack:
-            conn = await stack.enter_async_context(self._pool.acquire())
-            await stack.enter_async_context(conn.transaction())
-            await conn.execute('update games set status=$1 where id=$2', game_state.status, game_id)
+        await self.store_last_move(game_id, game_state)
+        return new_move
+
+    async def store_last_move(self, game_id: UUID, game_state: GameState) -> None:
+        """Store the last move of `game_state`, which has already been played on it.
+
+        Fails with a 409 like `handle_move` if the stored game doesn't have the moves before it.
+        """
+        ply = len(game_state.moves) - 1
+        last_move = game_state.moves[ply]
+        async with self._acquire() as conn:
+            row = await conn.fetchrow(APPEND_MOVE, game_id, ply, game_state.status, last_move.column, last_move.player)
+        if row is None:
+            self._games.evict(game_id, 'conflict')
+            raise HTTPException(status_code=409, detail='game has changed since it was loaded')
+        self._games.set(game_id, game_state)
+
+    async def claim_games(self, worker_id: str, limit: int, lease: float, max_age: float) -> list[UUID]:
+        """Claim up to `limit` unclaimed or orphaned ai-vs-ai games for `worker_id`, oldest first.
+
+        `skip locked` means concurrent workers claim different games rather than waiting on each other.
+        """
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                """
+                update games set claimed_by=$1, claim_expires_at=now() + make_interval(secs => $3)
+                where id in (
+                    select id from games
+                    where status='playing' and pink_ai is not null
+                    and created_at > now() - make_interval(secs => $4)
+                    and (claim_expires_at is null or claim_expires_at < now())
+                    order by created_at
+                    limit $2
+                    for update skip locked
+                )
+                returning id
+                """,
+                worker_id,
+                limit,
+                lease,
+                max_age,
+            )
+        return [row['id'] for row in rows]
+
+    async def renew_claims(self, worker_id: str, game_ids: list[UUID], lease: float) -> set[UUID]:
+        """Extend the leases on games still held by `worker_id`, returns the games whose lease was extended."""
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                """
+                update games set claim_expires_at=now() + make_interval(secs => $3)
+                where id=any($2) and claimed_by=$1
+                returning id
+                """,
+                worker_id,
+                game_ids,
+                lease,
+            )
+        return {row['id'] for row in rows}
+
+    async def release_games(self, worker_id: str, game_ids: list[UUID]) -> None:
+        async with self._acquire() as conn:
             await conn.execute(
-                'insert into moves (game_id, player, column_index) values ($1, $2, $3)',
-                game_id,
-                new_move.player,
-                new_move.column,
+                'update games set claimed_by=null, claim_expires_at=null where id=any($2) and claimed_by=$1',
+                worker_id,
+                game_ids,
             )
+
+    async def get_cached_move(self, model: str, key: int) -> Column | None:
+        async with self._acquire() as conn:
+            return await conn.fetchval(
+                'select column_index from move_cache where model=$1 and position_key=$2 and expires_at > now()',
+                model,
+                key,
+            )
+
+    async def set_cached_move(self, model: str, key: int, column: Column, ttl: float) -> None:
+        async with self._acquire() as conn:
+            await conn.execute(
+                """
+                insert into move_cache (model, position_key, column_index, expires_at)
+                values ($1, $2, $3, now() + make_interval(secs => $4))
+                on conflict (model, position_key) do update
+                set column_index = excluded.column_index, expires_at = excluded.expires_at
+                """,
+                model,
+                key,
+                column,
+                ttl,
+            )
+
+
+def _observe(get_value: Callable[[], int], options: CallbackOptions) -> Iterable[Observation]:
+    yield Observation(get_value())
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-from typing import Annotated, Literal
+from collections.abc import Iterable
+from typing import Annotated, Any, Literal
 
 from annotated_types import Ge, Le
 from fastapi import HTTPException
-from pydantic import BaseModel, Field, computed_field
+from pydantic import BaseModel, Field, PrivateAttr, computed_field
 
 type GameStatus = Literal['playing', 'pink-win', 'orange-win', 'draw']
 type Player = Literal['pink', 'orange']
@@ -39,15 +40,18 @@ model_labels: dict[AIModel, str] = {
 }
 
 
-def get_player_icon(player: Player) -> str:
+def get_player_icon(player: Player) -> Literal['X', 'O']:
     return 'X' if player == 'pink' else 'O'
 
 
 FIRST_PLAYER: Player = 'pink'
+SECOND_PLAYER: Player = 'orange'
 N_ROWS = 6
 N_COLUMNS = 7
 
 Column = Annotated[int, Ge(1), Le(N_COLUMNS)]
+# centre first since central pieces take part in the most lines, for move ordering and fallback moves
+COLUMN_PREFERENCE: tuple[Column, ...] = (4, 3, 5, 2, 6, 1, 7)
 
 
 class Move(BaseModel):
@@ -55,11 +59,155 @@ class Move(BaseModel):
     column: Column
 
 
+def moves_from_columns(columns: Iterable[Column]) -> list[Move]:
+    """Build the moves of a game from just its columns, players alternate starting with `FIRST_PLAYER`.
+
+    The columns are trusted (e.g. they've come from the database) so moves are built without validation.
+    """
+    players = (FIRST_PLAYER, SECOND_PLAYER)
+    return [Move.model_construct(player=players[i % 2], column=column) for i, column in enumerate(columns)]
+
+
+# each column takes `N_ROWS` bits plus an empty sentinel bit on top, so shifting a mask by 1, 7, 6 or 8 moves
+# every piece one step vertically, horizontally or diagonally without wrapping into the neighbouring column
+COLUMN_BITS = N_ROWS + 1
+
+
+_COLUMN_KEY_MASK = (1 << COLUMN_BITS) - 1
+
+
+def mirror_column(column: Column) -> Column:
+    return N_COLUMNS + 1 - column
+
+
+def column_bit(column: Column, row: int) -> int:
+    """The bit for the cell at `row` (0 is the bottom) of `column`."""
+    return 1 << ((column - 1) * COLUMN_BITS + row)
+
+
+def has_four(mask: int) -> bool:
+    """Check whether the pieces in `mask` contain four in a row in any direction."""
+    for shift in (1, COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1):  # vertical, horizontal, diagonal \, diagonal /
+        pairs = mask & (mask >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
+    return False
+
+
+class Position:
+    """Compact bitboard representation of a Connect Four position.
+
+    `masks` holds one 64-bit mask per player (index 0 is the first player), `heights` holds the number of pieces
+    in each column, so playing a move, checking a column is full and checking for a win are all O(1).
+    """
+
+    __slots__ = ('masks', 'heights', 'n_moves', '_rendered')
+
+    def __init__(self) -> None:
+        self.masks = [0, 0]
+        self.heights = [0] * N_COLUMNS
+        self.n_moves = 0
+        self._rendered: str | None = None
+
+    @classmethod
+    def from_moves(cls, moves: Iterable[Move]) -> Position:
+        return cls.from_columns(move.column for move in moves)
+
+    @classmethod
+    def from_columns(cls, columns: Iterable[Column]) -> Position:
+        position = cls()
+        for column in columns:
+            position.play(column)
+        return position
+
+    def copy(self) -> Position:
+        position = Position()
+        position.masks = self.masks.copy()
+        position.heights = self.heights.copy()
+        position.n_moves = self.n_moves
+        position._rendered = self._rendered
+        return position
+
+    @property
+    def next_player(self) -> Player:
+        return FIRST_PLAYER if self.n_moves % 2 == 0 else SECOND_PLAYER
+
+    def key(self) -> int:
+        """Unique key of the position: the next player's pieces plus a mask of all pieces.
+
+        Each column's part of the key fits in its own `COLUMN_BITS` bits, so columns never carry into each other.
+        """
+        return self.masks[self.n_moves % 2] + (self.masks[0] | self.masks[1])
+
+    def canonical_key(self) -> tuple[int, bool]:
+        """The smaller of the key of this position and of its left/right mirror image.
+
+        Returns the key and whether it is the mirrored one, in which case columns need mirroring with
+        `mirror_column`.
+        """
+        key = self.key()
+        mirrored = 0
+        for c in range(N_COLUMNS):
+            mirrored |= ((key >> (c * COLUMN_BITS)) & _COLUMN_KEY_MASK) << ((N_COLUMNS - 1 - c) * COLUMN_BITS)
+        return (mirrored, True) if mirrored < key else (key, False)
+
+    def can_play(self, column: Column) -> bool:
+        return self.heights[column - 1] < N_ROWS
+
+    def legal_columns(self) -> tuple[Column, ...]:
+        return tuple(c for c in range(1, N_COLUMNS + 1) if self.heights[c - 1] < N_ROWS)
+
+    def play(self, column: Column) -> bool:
+        """Drop a piece for the next player into `column`, returns `True` if the move wins the game.
+
+        The caller is responsible for checking the column isn't full.
+        """
+        player_index = self.n_moves % 2
+        mask = self.masks[player_index] | column_bit(column, self.heights[column - 1])
+        self.masks[player_index] = mask
+        self.heights[column - 1] += 1
+        self.n_moves += 1
+        self._rendered = None
+        return has_four(mask)
+
+    def render(self) -> str:
+        """Render the board as rows of `X`, `O` and `.`, top row first."""
+        if self._rendered is None:
+            first, second = self.masks
+            self._rendered = '\n'.join(
+                ' '.join(_FIRST_ICON if first & bit else _SECOND_ICON if second & bit else '.' for bit in row)
+                for row in _RENDER_ROWS
+            )
+        return self._rendered
+
+
+_FIRST_ICON = get_player_icon(FIRST_PLAYER)
+_SECOND_ICON = get_player_icon(SECOND_PLAYER)
+_RENDER_ROWS = [[column_bit(c, r) for c in range(1, N_COLUMNS + 1)] for r in reversed(range(N_ROWS))]
+
+
 class GameState(BaseModel, validate_by_name=True):
     pink_ai: AIModel | None = Field(serialization_alias='pinkAI', validation_alias='pinkAI')
     orange_ai: AIModel = Field(serialization_alias='orangeAI', validation_alias='orangeAI')
+    # backup model to hedge slow moves with, see `backend.hedge`
+    hedge_ai: AIModel | None = Field(default=None, serialization_alias='hedgeAI', validation_alias='hedgeAI')
     status: GameStatus = 'playing'
     moves: list[Move] = Field(default_factory=list[Move])
+    _position: Position = PrivateAttr(default_factory=Position)
+
+    def model_post_init(self, context: Any) -> None:
+        self._position = Position.from_moves(self.moves)
+
+    @property
+    def position(self) -> Position:
+        """Bitboard of the current position, kept in sync with `moves` by `handle_move`."""
+        return self._position
+
+    def clone(self) -> GameState:
+        """A copy which moves can be played on without changing this game state."""
+        game_state = self.model_copy(update={'moves': self.moves.copy()})
+        game_state._position = self._position.copy()
+        return game_state
 
     @computed_field(alias='pinkAIDisplay')
     def pink_ai_display(self) -> str | None:
@@ -73,27 +221,37 @@ class GameState(BaseModel, validate_by_name=True):
 
     def validate_move(self, column: Column) -> None:
         """
-        Validate that the provided move is not trying to place a piece in a full column.
+        Validate that the game is still being played and the provided move is not trying to place a piece in a full
+        column.
         """
-        n_pieces_in_column = len([m for m in self.moves if m.column == column])
-        if n_pieces_in_column >= N_ROWS:
+        if self.status != 'playing':
+            raise HTTPException(status_code=400, detail='game is over')
+        if not self._position.can_play(column):
             raise HTTPException(status_code=400, detail=f'Column {column} is full')
 
     def handle_move(self, column: Column) -> Move:
+        self.validate_move(column)
         new_move = Move(player=self.get_next_player(), column=column)
+        won = self._position.play(column)
         self.moves.append(new_move)
-        self.status = _get_status(self.moves)
+        if won:
+            self.status = 'pink-win' if new_move.player == 'pink' else 'orange-win'
+        elif self._position.n_moves == N_ROWS * N_COLUMNS:
+            self.status = 'draw'
         return new_move
 
     def get_next_player(self) -> Player:
-        return _get_next_player(self.moves)
+        return self._position.next_player
+
+    def get_next_ai(self) -> AIModel | None:
+        """The model playing the next move, `None` if it's the human's turn."""
+        return self.orange_ai if self.get_next_player() == 'orange' else self.pink_ai
 
     def render(self) -> str:
         """Render the current game state as a string."""
         board = self.render_board()
         if self.status == 'playing':
-            next_player = _get_next_player(self.moves)
-            return f'{board}\nNext player: {get_player_icon(next_player)}'
+            return f'{board}\nNext player: {get_player_icon(self.get_next_player())}'
         else:
             if self.status == 'pink-win':
                 status_message = 'X wins'
@@ -111,80 +269,4 @@ class GameState(BaseModel, validate_by_name=True):
     @computed_field
     @property
     def board(self) -> str:
-        columns: list[list[Player]] = [[] for _ in range(N_COLUMNS)]
-        for move in self.moves:
-            columns[move.column - 1].append(move.player)
-
-        rows: list[list[str]] = []
-        for r in range(N_ROWS):
-            cells: list[str] = []
-            for c in range(N_COLUMNS):
-                column = columns[c]
-                player = get_player_icon(column[r]) if r < len(column) else '.'
-                cells.append(player)
-            rows.append(cells)
-
-        return '\n'.join(' '.join(row) for row in rows[::-1])
-
-
-def _get_status(moves: list[Move]) -> GameStatus:
-    # Only check from the last move position for efficiency
-    columns: list[list[Player | None]] = [[] for _ in range(N_COLUMNS)]
-    last_row_index: int | None = None
-    last_col_index: int | None = None
-    last_player: Player | None = None
-    for move in moves:
-        last_player = move.player
-        last_col_index = move.column - 1
-        last_col = columns[last_col_index]
-        last_row_index = len(last_col)
-        last_col.append(move.player)
-    if last_row_index is None or last_col_index is None or last_player is None:
-        # No moves have happened yet
-        return 'playing'
-
-    def _player_at_location(row: int, column: int) -> Player | None:
-        if column < 0 or column >= N_COLUMNS:
-            return None
-        if row < 0 or row >= len(columns[column]):
-            return None
-        return columns[column][row]
-
-    directions = [
-        [(0, 1), (0, -1)],  # Horizontal
-        [(1, 0), (-1, 0)],  # Vertical
-        [(1, 1), (-1, -1)],  # Diagonal /
-        [(1, -1), (-1, 1)],  # Diagonal \
-    ]
-
-    for direction_pair in directions:
-        count = 1  # Count the piece at the current position
-
-        # Check in both directions
-        for dr, dc in direction_pair:
-            r, c = last_row_index, last_col_index
-
-            # Count consecutive pieces in this direction
-            for _ in range(3):  # Need 3 more to make 4 in a row
-                r, c = r + dr, c + dc
-                if _player_at_location(r, c) == last_player:
-                    count += 1
-                else:
-                    break
-
-        if count >= 4:
-            if last_player == 'pink':
-                return 'pink-win'
-            else:
-                return 'orange-win'
-    if len(moves) == N_ROWS * N_COLUMNS:
-        return 'draw'
-
-    return 'playing'  # game is not finished yet
-
-
-def _get_next_player(moves: list[Move]) -> Player:
-    if not moves:
-        return FIRST_PLAYER
-    last_move = moves[-1]
-    return 'orange' if last_move.player == 'pink' else 'pink'
+        return self._position.render()
@@ -0,0 +1,89 @@
+"""Per-process cache of game states, so reads of games being played don't load and decode all their moves.
+
+`DB` writes through the cache: games are added by `create_game` and updated by `handle_move` once the move is
+stored. A game only changes by appending moves, so a cached state is always a prefix of the stored game, and
+`DB.get_game` brings it up to date by fetching just the status and any moves after the cached ones, in one query.
+So every read sees every move committed before it, by any process, as it would without the cache.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from collections.abc import Iterable
+from uuid import UUID
+
+import logfire
+from opentelemetry.metrics import CallbackOptions, Observation
+
+from backend.game import GameState
+
+__all__ = ('GameCache',)
+
+# rough memory use of a cached game state, measured with tracemalloc
+GAME_STATE_BYTES = 1000
+MOVE_BYTES = 480
+
+hits_counter = logfire.metric_counter('c4.game_cache.hits', unit='1', description='Game states served from memory')
+misses_counter = logfire.metric_counter('c4.game_cache.misses', unit='1', description='Game state cache misses')
+evictions_counter = logfire.metric_counter(
+    'c4.game_cache.evictions', unit='1', description='Game states evicted from the cache, by reason'
+)
+
+
+class GameCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[UUID, GameState] = OrderedDict()
+        self._moves = 0
+        logfire.metric_gauge_callback(
+            'c4.game_cache.size', [self._observe_size], unit='1', description='Game states in the cache'
+        )
+        logfire.metric_gauge_callback(
+            'c4.game_cache.memory',
+            [self._observe_memory],
+            unit='By',
+            description='Estimated memory used by cached game states',
+        )
+
+    def get(self, game_id: UUID) -> GameState | None:
+        """A copy of the cached game state, so the caller can play moves on it."""
+        if not self.max_size:
+            return None
+        game_state = self._entries.get(game_id)
+        if game_state is None:
+            misses_counter.add(1)
+            return None
+        hits_counter.add(1)
+        self._entries.move_to_end(game_id)
+        return game_state.clone()
+
+    def set(self, game_id: UUID, game_state: GameState) -> None:
+        if not self.max_size:
+            return
+        self._remove(game_id)
+        self._entries[game_id] = game_state.clone()
+        self._moves += len(game_state.moves)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            evictions_counter.add(1, {'reason': 'size'})
+
+    def evict(self, game_id: UUID, reason: str) -> None:
+        if self._remove(game_id):
+            evictions_counter.add(1, {'reason': reason})
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._moves = 0
+
+    def _remove(self, game_id: UUID) -> bool:
+        game_state = self._entries.pop(game_id, None)
+        if game_state is None:
+            return False
+        self._moves -= len(game_state.moves)
+        return True
+
+    def _observe_size(self, options: CallbackOptions) -> Iterable[Observation]:
+        yield Observation(len(self._entries))
+
+    def _observe_memory(self, options: CallbackOptions) -> Iterable[Observation]:
+        yield Observation(len(self._entries) * GAME_STATE_BYTES + self._moves * MOVE_BYTES)
@@ -0,0 +1,122 @@
+"""Hedged requests for models with long tail latencies.
+
+The primary model is asked for a move, if it hasn't answered by a high percentile of its recent latencies a backup
+request is sent to a faster model (or the local solver), the first to return a valid move wins and the other is
+cancelled. Since the backup only starts once the primary is slower than usual, it's only sent for a few percent of
+moves, while those are the moves which make up the tail latency.
+
+Backups are configured per game with `hedge_ai`, or for every game with `C4_HEDGE_MODELS`, e.g.
+`gateway/openai:gpt-5=gateway/openai:gpt-4.1-mini,*=local:c4`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import statistics
+import time
+from collections import deque
+from collections.abc import Callable, Coroutine
+from typing import Any, Literal
+
+import logfire
+from pydantic import TypeAdapter
+
+from backend.game import AIModel, GameState
+
+__all__ = 'LatencyTracker', 'get_hedge_model', 'hedge', 'latencies'
+
+type HedgeWinner = Literal['primary', 'backup']
+
+# backup model for each primary model, `*` for any model without its own backup
+hedge_models = TypeAdapter(dict[str, AIModel]).validate_python(
+    dict(item.split('=', 1) for item in filter(None, (os.getenv('C4_HEDGE_MODELS') or '').split(',')))
+)
+# percentile of the primary model's recent latencies to wait for before sending the backup request
+hedge_percentile = int(os.getenv('C4_HEDGE_PERCENTILE') or 95)
+# delay used until a model has `MIN_SAMPLES` latencies recorded
+hedge_default_delay = float(os.getenv('C4_HEDGE_DELAY') or 10)
+MIN_SAMPLES = 20
+
+hedges_counter = logfire.metric_counter('c4.hedge.hedges', unit='1', description='Backup requests sent')
+wins_counter = logfire.metric_counter(
+    'c4.hedge.wins', unit='1', description='Hedged moves, by whether the primary or backup request won'
+)
+latency_histogram = logfire.metric_histogram(
+    'c4.move.latency', unit='s', description='Time to generate a move with a model, tagged with whether it was hedged'
+)
+
+
+class LatencyTracker:
+    """Recent latencies of each model."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._latencies: dict[str, deque[float]] = {}
+
+    def record(self, model: str, seconds: float) -> None:
+        if (latencies := self._latencies.get(model)) is None:
+            latencies = self._latencies[model] = deque(maxlen=self.window)
+        latencies.append(seconds)
+
+    def percentile(self, model: str, percentile: int) -> float | None:
+        latencies = self._latencies.get(model)
+        if latencies is None or len(latencies) < MIN_SAMPLES:
+            return None
+        return statistics.quantiles(latencies, n=100)[percentile - 1]
+
+
+latencies = LatencyTracker()
+
+
+def get_hedge_model(game_state: GameState, model: AIModel) -> AIModel | None:
+    """The model to hedge `model`'s moves with in this game, if any."""
+    backup = game_state.hedge_ai or hedge_models.get(model) or hedge_models.get('*')
+    return backup if backup != model else None
+
+
+async def hedge[T](
+    model: AIModel,
+    primary: Callable[[], Coroutine[Any, Any, T]],
+    backup_model: AIModel,
+    backup: Callable[[], Coroutine[Any, Any, T]],
+) -> tuple[T, HedgeWinner]:
+    """Run `primary`, and `backup` too if `primary` is slow, returns the first successful result and which won.
+
+    If both fail the primary's error is raised, a primary failing before the hedge delay is raised straight away.
+    Only the latencies of primary requests which complete are recorded for the hedge delay.
+    """
+    delay = latencies.percentile(model, hedge_percentile) or hedge_default_delay
+    attributes = {'model': model, 'backup': backup_model}
+    start = time.perf_counter()
+    primary_task = asyncio.create_task(primary())
+    tasks: dict[asyncio.Task[T], HedgeWinner] = {primary_task: 'primary'}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            hedges_counter.add(1, attributes)
+            logfire.info(
+                'hedging {model} with {backup} after {delay:.1f}s', model=model, backup=backup_model, delay=delay
+            )
+            tasks[asyncio.create_task(backup())] = 'backup'
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = tasks[task]
+                    seconds = time.perf_counter() - start
+                    if winner == 'primary':
+                        # a primary cancelled by the backup winning didn't complete, so its latency is unknown
+                        latencies.record(model, seconds)
+                    if len(tasks) > 1:
+                        wins_counter.add(1, {**attributes, 'winner': winner})
+                    latency_histogram.record(seconds, {'model': model, 'hedged': len(tasks) > 1})
+                    return task.result(), winner
+        error = primary_task.exception()
+        assert error is not None, 'no task succeeded'
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
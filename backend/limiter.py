@@ -0,0 +1,156 @@
+"""Concurrency limits for calls to model providers.
+
+Each provider (openai, anthropic, ...) and each model gets an `AdaptiveLimiter`, a call holds a slot in both while
+it runs. In adaptive mode the limit is managed with AIMD, like TCP congestion control: it's halved when the provider
+pushes back with a 429 (or 503/529 overloaded) and grows back by roughly one slot per round of successful calls, so a
+burst of games queues in the process instead of multiplying rate limit errors with retries.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import logfire
+from pydantic_ai.exceptions import ModelHTTPError
+
+__all__ = 'AdaptiveLimiter', 'get_model_limiters', 'parse_limits', 'provider_name'
+
+# status codes meaning the provider wants us to back off
+BACKPRESSURE_STATUS_CODES = {429, 503, 529}
+# concurrent rate limit errors are usually the same overload, so only halve the limit once in this many seconds
+DECREASE_COOLDOWN = 2.0
+
+wait_histogram = logfire.metric_histogram(
+    'c4.limiter.wait', unit='ms', description='Time spent waiting for a model provider concurrency slot'
+)
+queued_counter = logfire.metric_up_down_counter(
+    'c4.limiter.queued', unit='1', description='Calls waiting for a model provider concurrency slot'
+)
+limit_gauge = logfire.metric_gauge('c4.limiter.limit', unit='1', description='Current concurrency limit')
+backpressure_counter = logfire.metric_counter(
+    'c4.limiter.backpressure', unit='1', description='Rate limit and overloaded responses from model providers'
+)
+
+
+def parse_limits(value: str) -> dict[str, int]:
+    """Parse limits from `name=limit,...`, e.g. `gateway/openai:gpt-5=4,local:c4=100`."""
+    limits: dict[str, int] = {}
+    for item in filter(None, value.split(',')):
+        name, _, limit = item.rpartition('=')
+        limits[name] = int(limit)
+    return limits
+
+
+def provider_name(model: str) -> str:
+    """The provider of a model, e.g. `openai` for `gateway/openai:gpt-4.1`."""
+    return model.removeprefix('gateway/').partition(':')[0]
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, max_limit: int, *, adaptive: bool = True, min_limit: int = 1):
+        self.name = name
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.adaptive = adaptive
+        self.limit: float = max_limit
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._last_decrease = 0.0
+        self._attributes = {'limiter': name}
+        limit_gauge.set(max_limit, self._attributes)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """Hold a slot while the body runs, reporting backpressure errors raised in it."""
+        start = time.perf_counter()
+        if self._waiters or self.in_flight >= int(self.limit):
+            # the slot is taken for us by `_wake`
+            await self._wait()
+        else:
+            self.in_flight += 1
+        wait_histogram.record((time.perf_counter() - start) * 1000, self._attributes)
+        try:
+            yield
+        except ModelHTTPError as e:
+            if e.status_code in BACKPRESSURE_STATUS_CODES:
+                self.on_backpressure()
+            raise
+        else:
+            self.on_success()
+        finally:
+            self.in_flight -= 1
+            self._wake()
+
+    def on_success(self) -> None:
+        if self.adaptive and self.limit < self.max_limit:
+            # additive increase, about one slot per `limit` successful calls
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            limit_gauge.set(int(self.limit), self._attributes)
+            self._wake()
+
+    def on_backpressure(self) -> None:
+        backpressure_counter.add(1, self._attributes)
+        now = time.monotonic()
+        if self.adaptive and now - self._last_decrease > DECREASE_COOLDOWN:
+            self._last_decrease = now
+            self.limit = max(self.min_limit, self.limit / 2)
+            limit_gauge.set(int(self.limit), self._attributes)
+            logfire.warn('{limiter} concurrency reduced to {limit}', limiter=self.name, limit=int(self.limit))
+
+    async def _wait(self) -> None:
+        queued_counter.add(1, self._attributes)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # we were handed a slot but won't use it, pass it on
+                self.in_flight -= 1
+                self._wake()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            queued_counter.add(-1, self._attributes)
+
+    def _wake(self) -> None:
+        """Hand free slots to waiters in order, taking each slot for the waiter before it runs.
+
+        Otherwise a new call could take the slot between the waiter being woken and running, and the waiter would
+        have to queue again at the back.
+        """
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+provider_concurrency = int(os.getenv('C4_PROVIDER_CONCURRENCY') or 32)
+provider_limits = parse_limits(os.getenv('C4_PROVIDER_LIMITS') or '')
+model_concurrency = int(os.getenv('C4_MODEL_CONCURRENCY') or 16)
+model_limits = parse_limits(os.getenv('C4_MODEL_LIMITS') or '')
+adaptive = (os.getenv('C4_ADAPTIVE_CONCURRENCY') or '1') != '0'
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+
+
+def _get_limiter(name: str, limit: int) -> AdaptiveLimiter:
+    if (limiter := _limiters.get(name)) is None:
+        limiter = _limiters[name] = AdaptiveLimiter(name, limit, adaptive=adaptive)
+    return limiter
+
+
+def get_model_limiters(model: str) -> tuple[AdaptiveLimiter, AdaptiveLimiter]:
+    """The limiters for a model and for its provider, in the order they should be acquired."""
+    provider = provider_name(model)
+    return (
+        _get_limiter(model, model_limits.get(model, model_concurrency)),
+        _get_limiter(provider, provider_limits.get(provider, provider_concurrency)),
+    )
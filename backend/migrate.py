@@ -0,0 +1,117 @@
+"""Versioned database migrations.
+
+Migrations are the `NNNN_name.sql` files in `migrations/`, applied in order of their version number and recorded in
+the `schema_migrations` table. A session level advisory lock means only one process applies migrations at a time,
+the others wait for it and then find nothing left to do.
+
+Each migration runs in a transaction unless its first line is `-- migrate: no-transaction`, which is needed for
+e.g. `create index concurrently`, such migrations must contain a single statement.
+
+Run pending migrations without starting the server with:
+
+    uv run python -m backend.migrate
+"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import logfire
+
+if TYPE_CHECKING:
+    from .db import DbConn, PoolConn
+
+__all__ = 'Migration', 'load_migrations', 'migrate'
+
+MIGRATIONS_DIR = Path(__file__).parent / 'migrations'
+# arbitrary key for `pg_advisory_lock`, shared by every process migrating the same database
+_LOCK_KEY = 0x0C4_0C4
+_LOCK_POLL_INTERVAL = 0.5
+_NO_TRANSACTION = '-- migrate: no-transaction'
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    sql: str
+
+    @property
+    def transaction(self) -> bool:
+        return not self.sql.startswith(_NO_TRANSACTION)
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> list[Migration]:
+    migrations: list[Migration] = []
+    for path in directory.glob('*.sql'):
+        m = re.fullmatch(r'(\d+)_(\w+)\.sql', path.name)
+        if not m:
+            raise ValueError(f'invalid migration file name {path.name!r}, expected "NNNN_name.sql"')
+        migrations.append(Migration(version=int(m.group(1)), name=m.group(2), sql=path.read_text()))
+
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f'duplicate migration versions in {directory}')
+    return migrations
+
+
+async def migrate(conn: DbConn | PoolConn) -> list[Migration]:
+    """Apply pending migrations, returns the migrations applied."""
+    with logfire.span('migrate database') as span:
+        # poll rather than blocking in `pg_advisory_lock`: `create index concurrently` waits for every open
+        # transaction to finish, including a blocked lock call in another process, so that would deadlock
+        while not await conn.fetchval('select pg_try_advisory_lock($1)', _LOCK_KEY):
+            await asyncio.sleep(_LOCK_POLL_INTERVAL)
+        try:
+            await conn.execute(
+                """
+                create table if not exists schema_migrations(
+                    version integer primary key,
+                    name text not null,
+                    applied_at timestamp not null default now()
+                )
+                """
+            )
+            applied_versions = {r['version'] for r in await conn.fetch('select version from schema_migrations')}
+            applied: list[Migration] = []
+            for migration in load_migrations():
+                if migration.version not in applied_versions:
+                    await _apply(conn, migration)
+                    applied.append(migration)
+        finally:
+            await conn.execute('select pg_advisory_unlock($1)', _LOCK_KEY)
+        span.set_attribute('applied', [m.version for m in applied])
+        return applied
+
+
+async def _apply(conn: DbConn | PoolConn, migration: Migration) -> None:
+    with logfire.span('apply migration {version} {name}', version=migration.version, name=migration.name):
+        if migration.transaction:
+            async with conn.transaction():
+                await conn.execute(migration.sql)
+                await _record(conn, migration)
+        else:
+            await conn.execute(migration.sql)
+            await _record(conn, migration)
+
+
+async def _record(conn: DbConn | PoolConn, migration: Migration) -> None:
+    await conn.execute(
+        'insert into schema_migrations (version, name) values ($1, $2)', migration.version, migration.name
+    )
+
+
+if __name__ == '__main__':
+    from .db import DB
+
+    async def main():
+        # `DB.connect` runs the migrations
+        async with DB.connect():
+            pass
+
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+-- the schema as it was when `schema.sql` was run on every boot, written to be a no-op on databases created by it
+create table if not exists games(
+    id uuid primary key default gen_random_uuid(),
+    status text not null default 'playing',
+    orange_ai text not null,
+    -- note pink_ai is nullable
+    pink_ai text,
+    created_at timestamp not null default now(),
+    -- columns of every move in order, denormalised from `moves` so a game can be loaded from one row
+    move_columns smallint[] not null default '{}'
+);
+
+create table if not exists moves(
+    id serial primary key,
+    game_id uuid not null references games(id),
+    player text not null,
+    column_index integer not null,
+    created_at timestamp not null default now()
+);
+
+-- add `move_columns` to games created before it existed, and fill it from their moves
+do $$
+begin
+    if not exists (
+        select 1 from information_schema.columns where table_name = 'games' and column_name = 'move_columns'
+    ) then
+        alter table games add column move_columns smallint[] not null default '{}';
+        update games set move_columns = m.columns
+        from (select game_id, array_agg(column_index order by id) as columns from moves group by game_id) m
+        where games.id = m.game_id;
+    end if;
+end
+$$;
+
+-- moves already chosen by a model for a position, shared between workers by `backend.move_cache`
+create table if not exists move_cache(
+    model text not null,
+    -- `Position.canonical_key()` of the position
+    position_key bigint not null,
+    column_index smallint not null,
+    expires_at timestamp not null,
+    primary key (model, position_key)
+);
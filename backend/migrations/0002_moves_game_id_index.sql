@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- looking up the moves of a game otherwise scans the whole moves table
+create index concurrently if not exists moves_game_id_id_idx on moves (game_id, id);
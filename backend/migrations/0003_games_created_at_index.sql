@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- for retention queries
+create index concurrently if not exists games_created_at_idx on games (created_at);
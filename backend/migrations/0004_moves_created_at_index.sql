@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- for retention queries
+create index concurrently if not exists moves_created_at_idx on moves (created_at);
@@ -0,0 +1,4 @@
+-- leases for `backend.runner`, the worker playing an ai-vs-ai game holds it until `claim_expires_at`,
+-- after which the game can be claimed by another worker, e.g. if the first crashed
+alter table games add column if not exists claimed_by text;
+alter table games add column if not exists claim_expires_at timestamp;
@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- for `DB.claim_games`, only ai-vs-ai games still being played can be claimed
+create index concurrently if not exists games_claimable_idx on games (created_at)
+where status = 'playing' and pink_ai is not null;
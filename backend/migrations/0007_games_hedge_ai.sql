@@ -0,0 +1,2 @@
+-- backup model for hedged requests, see `backend.hedge`
+alter table games add column if not exists hedge_ai text;
@@ -0,0 +1,11 @@
+-- notify every process's game state cache when a game changes, see `backend.game_cache`
+-- the payload is `<game id>:<number of moves>:<status>`, the version of the game after the change
+create or replace function notify_game_changed() returns trigger as $$
+begin
+    perform pg_notify('game_changed', new.id::text || ':' || cardinality(new.move_columns) || ':' || new.status::text);
+    return null;
+end;
+$$ language plpgsql;
+
+create trigger games_changed after update of move_columns, status on games
+for each row execute function notify_game_changed();
@@ -0,0 +1,3 @@
+-- game state caches now fetch any newer moves when they're read, see `backend.game_cache`, so don't need notifying
+drop trigger if exists games_changed on games;
+drop function if exists notify_game_changed();
@@ -0,0 +1,83 @@
+"""Cache of moves already chosen by a model for a position.
+
+Positions are keyed by `Position.canonical_key`, so a board and its left/right mirror image share an entry, columns
+are stored in the canonical orientation and mirrored back on the way out.
+
+The in-process tier is an LRU with a TTL, misses can fall through to an optional shared tier (Postgres via `DB`)
+so moves are shared between workers.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+from typing import Protocol
+
+import logfire
+
+from backend.game import Column, Position, mirror_column
+
+__all__ = 'MoveCache', 'SharedMoveCache', 'move_cache'
+
+hits_counter = logfire.metric_counter('c4.move_cache.hits', unit='1', description='Moves served from the move cache')
+misses_counter = logfire.metric_counter('c4.move_cache.misses', unit='1', description='Move cache misses')
+
+
+class SharedMoveCache(Protocol):
+    async def get_cached_move(self, model: str, key: int) -> Column | None: ...
+
+    async def set_cached_move(self, model: str, key: int, column: Column, ttl: float) -> None: ...
+
+
+class MoveCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared: SharedMoveCache | None = None
+        self._entries: OrderedDict[tuple[str, int], tuple[Column, float]] = OrderedDict()
+
+    async def get(self, model: str, position: Position) -> Column | None:
+        key, mirrored = position.canonical_key()
+        column = self._get_local(model, key)
+        if column is None and self.shared is not None:
+            column = await self.shared.get_cached_move(model, key)
+            if column is not None:
+                self._set_local(model, key, column)
+
+        if column is None:
+            misses_counter.add(1, {'model': model})
+            return None
+        hits_counter.add(1, {'model': model})
+        return mirror_column(column) if mirrored else column
+
+    async def set(self, model: str, position: Position, column: Column) -> None:
+        key, mirrored = position.canonical_key()
+        if mirrored:
+            column = mirror_column(column)
+        self._set_local(model, key, column)
+        if self.shared is not None:
+            await self.shared.set_cached_move(model, key, column, self.ttl)
+
+    def _get_local(self, model: str, key: int) -> Column | None:
+        entry = self._entries.get((model, key))
+        if entry is None:
+            return None
+        column, expires = entry
+        if expires < time.monotonic():
+            del self._entries[(model, key)]
+            return None
+        self._entries.move_to_end((model, key))
+        return column
+
+    def _set_local(self, model: str, key: int, column: Column) -> None:
+        self._entries[(model, key)] = column, time.monotonic() + self.ttl
+        self._entries.move_to_end((model, key))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+move_cache = MoveCache(
+    max_size=int(os.getenv('C4_MOVE_CACHE_SIZE') or 10_000),
+    ttl=float(os.getenv('C4_MOVE_CACHE_TTL') or 3600),
+)
@@ -0,0 +1,160 @@
+"""Background runner playing ai-vs-ai games.
+
+A `GameRunner` claims `playing` ai-vs-ai games from Postgres, plays them to the end and persists each move as it's
+made, so a game's progress doesn't depend on a client staying connected, clients only read the game state, e.g. via
+`/api/games/{id}/events`.
+
+Claims are leases renewed while the game is being played, if a worker dies its games can be claimed by another
+worker once their leases expire. Moves are appended with the same ply guard as the API, so a worker which has lost
+its lease can't overwrite another worker's moves. Any number of processes can run a `GameRunner`.
+
+Enable in the server with `C4_GAME_RUNNER=1`, or run standalone workers with:
+
+    uv run python -m backend.runner
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+from contextlib import suppress
+from dataclasses import dataclass, field
+from uuid import UUID, uuid4
+
+import logfire
+from fastapi import HTTPException
+
+from backend.agent import generate_next_move
+from backend.db import DB
+from backend.limiter import parse_limits
+
+__all__ = 'GameRunner', 'RunnerSettings', 'game_runner_enabled'
+
+# when set, ai-vs-ai games are played by a `GameRunner` rather than by the requests watching them
+game_runner_enabled = bool(os.getenv('C4_GAME_RUNNER'))
+
+games_counter = logfire.metric_counter('c4.runner.games', unit='1', description='Games finished by the game runner')
+active_counter = logfire.metric_up_down_counter(
+    'c4.runner.active_games', unit='1', description='Games currently being played by the game runner'
+)
+
+
+@dataclass
+class RunnerSettings:
+    max_games: int = int(os.getenv('C4_RUNNER_MAX_GAMES') or 100)
+    """Games played at once by this worker."""
+    model_concurrency: int = int(os.getenv('C4_RUNNER_MODEL_CONCURRENCY') or 8)
+    """Moves generated at once by each model, unless overridden in `model_limits`."""
+    model_limits: dict[str, int] = field(
+        default_factory=lambda: parse_limits(os.getenv('C4_RUNNER_MODEL_LIMITS') or '')
+    )
+    lease: float = float(os.getenv('C4_RUNNER_LEASE') or 30)
+    """Seconds a claim lasts without being renewed, renewed every `lease / 3`."""
+    poll_interval: float = float(os.getenv('C4_RUNNER_POLL_INTERVAL') or 1)
+    max_age: float = float(os.getenv('C4_RUNNER_MAX_AGE') or 3600)
+    """Games older than this are assumed abandoned and never claimed."""
+
+
+class GameRunner:
+    def __init__(self, db: DB, settings: RunnerSettings | None = None, worker_id: str | None = None):
+        self.db = db
+        self.settings = settings or RunnerSettings()
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+        self._games: dict[UUID, asyncio.Task[None]] = {}
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._wakeup = asyncio.Event()
+
+    async def run(self) -> None:
+        """Claim and play games until cancelled, on cancellation the claimed games are released."""
+        renew_task = asyncio.create_task(self._renew_leases())
+        try:
+            while True:
+                if free := self.settings.max_games - len(self._games):
+                    for game_id in await self._claim(free):
+                        task = asyncio.create_task(self._play(game_id))
+                        task.add_done_callback(lambda _, game_id=game_id: self._done(game_id))
+                        self._games[game_id] = task
+
+                self._wakeup.clear()
+                with suppress(TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), self.settings.poll_interval)
+        finally:
+            renew_task.cancel()
+            game_ids, tasks = list(self._games), list(self._games.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(renew_task, *tasks, return_exceptions=True)
+            if game_ids:
+                await self.db.release_games(self.worker_id, game_ids)
+
+    async def _claim(self, limit: int) -> list[UUID]:
+        s = self.settings
+        try:
+            return await self.db.claim_games(self.worker_id, limit, s.lease, s.max_age)
+        except Exception:
+            logfire.exception('Error claiming games')
+            return []
+
+    def _done(self, game_id: UUID) -> None:
+        self._games.pop(game_id, None)
+        # a slot is free, claim another game without waiting for the poll interval
+        self._wakeup.set()
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if (semaphore := self._semaphores.get(model)) is None:
+            limit = self.settings.model_limits.get(model, self.settings.model_concurrency)
+            semaphore = self._semaphores[model] = asyncio.Semaphore(limit)
+        return semaphore
+
+    async def _renew_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings.lease / 3)
+            if not (game_ids := list(self._games)):
+                continue
+            try:
+                held = await self.db.renew_claims(self.worker_id, game_ids, self.settings.lease)
+            except Exception:
+                logfire.exception('Error renewing game leases')
+                continue
+            for game_id in game_ids:
+                # the lease expired and another worker claimed the game
+                if game_id not in held and (task := self._games.get(game_id)):
+                    logfire.warn('Lost lease on game {game_id}', game_id=game_id)
+                    task.cancel()
+
+    async def _play(self, game_id: UUID) -> None:
+        active_counter.add(1)
+        try:
+            with logfire.span('run game {game_id}', game_id=game_id, worker_id=self.worker_id):
+                game_state = await self.db.get_game(game_id)
+                while game_state is not None and game_state.status == 'playing':
+                    model = game_state.get_next_ai()
+                    assert model is not None, 'only ai-vs-ai games are claimed'
+                    async with self._semaphore(model):
+                        column = await generate_next_move(game_state)
+                    try:
+                        await self.db.handle_move(game_id, game_state, column)
+                    except HTTPException as e:
+                        if e.status_code != 409:
+                            raise
+                        game_state = await self.db.get_game(game_id)
+            await self.db.release_games(self.worker_id, [game_id])
+            games_counter.add(1)
+        except Exception:
+            # keep the claim, so the game is retried once the lease expires rather than straight away
+            logfire.exception('Error running game {game_id}', game_id=game_id)
+        finally:
+            active_counter.add(-1)
+
+
+if __name__ == '__main__':
+
+    async def main():
+        logfire.configure(service_name='connect4-runner', distributed_tracing=True)
+        logfire.instrument_pydantic_ai()
+        logfire.instrument_asyncpg()
+        async with DB.connect() as db:
+            await GameRunner(db).run()
+
+    asyncio.run(main())
@@ -1,9 +1,10 @@
 from __future__ import annotations as _annotations
 
+import asyncio
 import os
 import sys
 import time
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
 from typing import Annotated
 
@@ -15,6 +16,8 @@ from fastapi.staticfiles import StaticFiles
 
 from .api import api_router
 from .db import DB
+from .move_cache import move_cache
+from .runner import GameRunner, game_runner_enabled
 
 THIS_DIR = Path(__file__).parent
 
@@ -38,12 +41,21 @@ logfire.configure(
 @asynccontextmanager
 async def lifespan(app: fastapi.FastAPI):
     async with DB.connect() as db:
+        if os.getenv('C4_MOVE_CACHE_SHARED'):
+            move_cache.shared = db
         logfire_base_url = os.getenv('LOGFIRE_BASE_URL', 'https://logfire-us.pydantic.dev/')
         headers = {'Authorization': os.environ['LOGFIRE_TOKEN']}
         async with httpx.AsyncClient(base_url=logfire_base_url, headers=headers) as httpx_client:
             app.state.db = db
             app.state.httpx_client = httpx_client
-            yield
+            if game_runner_enabled:
+                runner_task = asyncio.create_task(GameRunner(db).run())
+                yield
+                runner_task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await runner_task
+            else:
+                yield
 
 
 app = fastapi.FastAPI(lifespan=lifespan)
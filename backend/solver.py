@@ -0,0 +1,213 @@
+"""In-process Connect Four solver used for the `local:c4` model.
+
+Negamax with alpha-beta pruning over the bitboard from `backend.game`, searched with iterative deepening so the
+best move from the deepest completed iteration is returned when the time or node budget runs out.
+
+Scores are from the point of view of the player to move: a win is worth more the sooner it happens,
+draws and unfinished lines at the depth limit get a small heuristic score based on open threats.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from backend.game import COLUMN_BITS, COLUMN_PREFERENCE, N_COLUMNS, N_ROWS, Column, Position, has_four
+from backend.transposition import EXACT, LOWER, UPPER, TranspositionTable, get_transposition_table
+
+__all__ = ('SearchBudget', 'SearchResult', 'solve')
+
+N_CELLS = N_ROWS * N_COLUMNS
+BOTTOM_MASK = sum(1 << (c * COLUMN_BITS) for c in range(N_COLUMNS))
+BOARD_MASK = BOTTOM_MASK * ((1 << N_ROWS) - 1)
+COLUMN_MASKS = [((1 << N_ROWS) - 1) << (c * COLUMN_BITS) for c in range(N_COLUMNS)]
+# column indexes (0 based) of `COLUMN_PREFERENCE`
+COLUMN_ORDER = [c - 1 for c in COLUMN_PREFERENCE]
+# win scores are scaled so they always dominate the heuristic score of an unfinished position
+WIN_SCALE = 100
+
+
+@dataclass
+class SearchBudget:
+    max_depth: int = int(os.getenv('C4_SOLVER_DEPTH') or N_CELLS)
+    """Maximum depth in plies of the iterative deepening."""
+    max_seconds: float = float(os.getenv('C4_SOLVER_TIME_MS') or 500) / 1000
+    """Wall clock budget for a single move."""
+    max_nodes: int = int(os.getenv('C4_SOLVER_NODES') or 1_000_000)
+    """Node budget for a single move, applies across all iterations."""
+
+
+@dataclass
+class SearchResult:
+    column: Column
+    score: int
+    """Score of the move for the player making it, positive is good."""
+    depth: int
+    """Depth of the deepest completed iteration."""
+    nodes: int
+    elapsed: float
+
+    @property
+    def nodes_per_second(self) -> float:
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+
+def solve(
+    position: Position,
+    budget: SearchBudget | None = None,
+    table: TranspositionTable | None = None,
+    cancel: threading.Event | None = None,
+) -> SearchResult:
+    """Find the best move for the next player in `position` within `budget`.
+
+    `table` defaults to the transposition table shared by the whole process. Setting `cancel`, e.g. from the event
+    loop when the search is run in a thread, stops the search as if it had run out of budget.
+    """
+    budget = budget or SearchBudget()
+    table = table or get_transposition_table()
+    current = position.masks[position.n_moves % 2]
+    mask = position.masks[0] | position.masks[1]
+    search = _Search(budget, table, cancel)
+    legal = [c for c in COLUMN_ORDER if (mask + BOTTOM_MASK) & COLUMN_MASKS[c]]
+    assert legal, 'no legal moves'
+
+    for c in legal:
+        if has_four(current | ((mask + BOTTOM_MASK) & COLUMN_MASKS[c])):
+            score = WIN_SCALE * ((N_CELLS + 1 - position.n_moves) // 2)
+            return SearchResult(column=c + 1, score=score, depth=1, nodes=1, elapsed=search.elapsed())
+
+    table.new_search()
+    best_column, best_score, depth_reached = legal[0], 0, 0
+    max_depth = min(budget.max_depth, N_CELLS - position.n_moves)
+    try:
+        for depth in range(1, max_depth + 1):
+            # search the best move from the previous iteration first, it's the most likely to cause cut-offs
+            order = [best_column] + [c for c in legal if c != best_column]
+            best_column, best_score = search.root(current, mask, position.n_moves, depth, order)
+            depth_reached = depth
+            if abs(best_score) >= WIN_SCALE:
+                # the result is proven, searching deeper won't change it
+                break
+    except _BudgetExceeded:
+        pass
+    finally:
+        table.flush_metrics()
+
+    return SearchResult(
+        column=best_column + 1, score=best_score, depth=depth_reached, nodes=search.nodes, elapsed=search.elapsed()
+    )
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+class _Search:
+    __slots__ = ('table', 'cancel', 'nodes', 'max_nodes', 'start', 'deadline')
+
+    def __init__(self, budget: SearchBudget, table: TranspositionTable, cancel: threading.Event | None):
+        self.table = table
+        self.cancel = cancel
+        self.nodes = 0
+        self.max_nodes = budget.max_nodes
+        self.start = time.perf_counter()
+        self.deadline = self.start + budget.max_seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def root(self, current: int, mask: int, n_moves: int, depth: int, order: list[int]) -> tuple[int, int]:
+        alpha, beta = -WIN_SCALE * N_CELLS, WIN_SCALE * N_CELLS
+        best_column = order[0]
+        for c in order:
+            move = (mask + BOTTOM_MASK) & COLUMN_MASKS[c]
+            score = -self.negamax(current ^ mask, mask | move, n_moves + 1, depth - 1, -beta, -alpha)
+            if score > alpha:
+                alpha, best_column = score, c
+        return best_column, alpha
+
+    def negamax(self, current: int, mask: int, n_moves: int, depth: int, alpha: int, beta: int) -> int:
+        """Score of the position for the player to move, `current` is their pieces and `mask` all pieces."""
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and (
+            self.nodes >= self.max_nodes
+            or time.perf_counter() > self.deadline
+            or (self.cancel is not None and self.cancel.is_set())
+        ):
+            raise _BudgetExceeded
+
+        possible = (mask + BOTTOM_MASK) & BOARD_MASK
+        if not possible:
+            return 0
+
+        if winning_cells(current, mask) & possible:
+            return WIN_SCALE * ((N_CELLS + 1 - n_moves) // 2)
+
+        opponent_wins = winning_cells(current ^ mask, mask)
+        loss_score = -WIN_SCALE * ((N_CELLS - n_moves) // 2)
+        if forced := possible & opponent_wins:
+            if forced & (forced - 1):
+                # more than one threat, we can only block one of them
+                return loss_score
+            possible = forced
+        # never play directly below a cell where the opponent would win
+        possible &= ~(opponent_wins >> 1)
+        if not possible:
+            return loss_score
+
+        if depth <= 0:
+            return heuristic(current, mask)
+
+        key = current + mask
+        order = COLUMN_ORDER
+        if entry := self.table.probe(key):
+            entry_depth, bound, value, best_move = entry
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return value
+                elif bound == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+            order = [best_move] + [c for c in COLUMN_ORDER if c != best_move]
+
+        original_alpha = alpha
+        best_score, best_move = loss_score, order[0]
+        for c in order:
+            if move := possible & COLUMN_MASKS[c]:
+                score = -self.negamax(current ^ mask, mask | move, n_moves + 1, depth - 1, -beta, -alpha)
+                if score > best_score:
+                    best_score, best_move = score, c
+                    if score > alpha:
+                        alpha = score
+                        if alpha >= beta:
+                            break
+
+        bound = UPPER if best_score <= original_alpha else LOWER if best_score >= beta else EXACT
+        self.table.store(key, depth, bound, best_score, best_move)
+        return best_score
+
+
+def winning_cells(pieces: int, mask: int) -> int:
+    """Empty cells where `pieces` would complete four in a row, whether or not they can be played yet."""
+    # vertical
+    cells = (pieces << 1) & (pieces << 2) & (pieces << 3)
+
+    for shift in (COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1):  # horizontal and both diagonals
+        pair = (pieces << shift) & (pieces << 2 * shift)
+        cells |= pair & (pieces << 3 * shift)
+        cells |= pair & (pieces >> shift)
+        pair = (pieces >> shift) & (pieces >> 2 * shift)
+        cells |= pair & (pieces << shift)
+        cells |= pair & (pieces >> 3 * shift)
+
+    return cells & (BOARD_MASK ^ mask)
+
+
+def heuristic(current: int, mask: int) -> int:
+    """Score an unfinished position by the number of open threats each player has."""
+    return winning_cells(current, mask).bit_count() - winning_cells(current ^ mask, mask).bit_count()
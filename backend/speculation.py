@@ -0,0 +1,224 @@
+"""Speculative AI replies, generated while the human is thinking.
+
+In human-vs-ai games the AI's reply is on the critical path after every human move. With speculation on, once the
+AI has moved the AI's replies to the human's most likely moves are generated in the background: a win or forced
+block if there is one, then the center-most columns. When the human moves, a reply to that column is used straight
+away, or awaited if it's still being generated, and the other replies are cancelled. A reply is only used for the
+position it was generated for, replies for any other ply are stale and cancelled too. Cancelling a reply which is
+being searched by the solver stops the search in its thread too, so wasted replies don't slow down real moves.
+
+Speculation is off by default, `C4_SPECULATION_COLUMNS` sets the number of human moves to speculate on. Only models
+in `C4_SPECULATION_MODELS` are speculated for, by default just `local:c4`, models which make requests to a provider
+are limited to `C4_SPECULATION_REQUESTS` speculative requests per game. A request is charged when each reply is
+started, since a reply which is cancelled has usually already made it, and any retries once the reply finishes.
+Replies stop being started once the budget is used up.
+
+The hit rate is the share of human moves which had a reply ready, the wasted compute ratio is the share of the time
+spent on speculative replies which was spent on replies that weren't used.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Literal
+from uuid import UUID
+
+import logfire
+
+from backend.agent import MoveCosts, generate_next_move, move_costs, tactical_move
+from backend.game import COLUMN_PREFERENCE, Column, GameState, Position
+
+__all__ = 'Speculator', 'likely_columns', 'speculator'
+
+type Outcome = Literal['used', 'wasted']
+
+lookups_counter = logfire.metric_counter(
+    'c4.speculation.lookups', unit='1', description='Human moves in speculated positions, by whether a reply was ready'
+)
+replies_counter = logfire.metric_counter(
+    'c4.speculation.replies', unit='1', description='Speculative replies, by whether they were used or wasted'
+)
+compute_counter = logfire.metric_counter(
+    'c4.speculation.compute',
+    unit='s',
+    description='Time spent generating speculative replies, by whether they were used or wasted',
+)
+
+
+def likely_columns(position: Position) -> list[Column]:
+    """The legal moves for the player to move, most likely first: any win or block, then center columns first."""
+    legal = position.legal_columns()
+    columns = [c for c in COLUMN_PREFERENCE if c in legal]
+    if tactical := tactical_move(position):
+        columns.remove(tactical[0])
+        columns.insert(0, tactical[0])
+    return columns
+
+
+@dataclass
+class Reply:
+    task: asyncio.Task[Column]
+    start: float = field(default_factory=time.perf_counter)
+    seconds: float | None = None
+    """Set once the task is done, including if it's cancelled."""
+    outcome: Outcome | None = None
+    """Set when the human moves, or the reply is cancelled."""
+
+
+@dataclass
+class Speculation:
+    ply: int
+    """Moves played when the replies were started, the human's move is the next one."""
+    replies: dict[Column, Reply]
+
+
+class Speculator:
+    def __init__(self, columns: int, models: set[str], max_requests: int, max_games: int = 1000):
+        self.columns = columns
+        self.models = models
+        self.max_requests = max_requests
+        self.max_games = max_games
+        self._games: OrderedDict[UUID, Speculation] = OrderedDict()
+        # speculative model requests made for each game, for the most recently speculated games
+        self._requests: OrderedDict[UUID, int] = OrderedDict()
+        # totals since the process started, for `hit_rate` and `wasted_ratio`
+        self._lookups: defaultdict[bool, int] = defaultdict(int)
+        self._compute: defaultdict[Outcome, float] = defaultdict(float)
+
+    @property
+    def hit_rate(self) -> float | None:
+        """The share of human moves in speculated positions which had a reply ready."""
+        lookups = self._lookups[True] + self._lookups[False]
+        return self._lookups[True] / lookups if lookups else None
+
+    @property
+    def wasted_ratio(self) -> float | None:
+        """The share of time spent on speculative replies which was spent on replies that weren't used."""
+        total = self._compute['used'] + self._compute['wasted']
+        return self._compute['wasted'] / total if total else None
+
+    def speculate(self, game_id: UUID, game_state: GameState) -> None:
+        """Start generating the AI's replies to the human's most likely moves, cancelling any stale replies."""
+        speculation = self._games.get(game_id)
+        if speculation is not None and speculation.ply == len(game_state.moves):
+            # already speculating on this position
+            return
+        self.cancel(game_id)
+        model = game_state.orange_ai
+        if (
+            not self.columns
+            or model not in self.models
+            or game_state.pink_ai is not None
+            or game_state.status != 'playing'
+            or game_state.get_next_player() != 'pink'
+            or self._requests.get(game_id, 0) >= self.max_requests
+        ):
+            return
+
+        # `local:c4` is played in-process or by the c4ai service, neither costs anything
+        metered = model != 'local:c4'
+        replies: dict[Column, Reply] = {}
+        for column in likely_columns(game_state.position)[: self.columns]:
+            if metered and self._requests.get(game_id, 0) >= self.max_requests:
+                break
+            after = game_state.clone()
+            after.handle_move(column)
+            if after.status == 'playing':
+                if metered:
+                    self._charge(game_id, 1)
+                reply = replies[column] = Reply(asyncio.create_task(self._generate(game_id, after, metered)))
+                reply.task.add_done_callback(partial(self._on_done, reply))
+        self._games[game_id] = Speculation(len(game_state.moves), replies)
+        while len(self._games) > self.max_games:
+            self.cancel(next(iter(self._games)))
+
+    def take(self, game_id: UUID, ply: int, column: Column) -> asyncio.Task[Column] | None:
+        """The reply to the human playing `column` after `ply` moves, if it was speculated, cancelling the others."""
+        speculation = self._games.pop(game_id, None)
+        if speculation is None:
+            return None
+        if speculation.ply != ply:
+            # the game has moved on since, e.g. the human played in another tab
+            self._cancel_replies(speculation)
+            return None
+
+        reply = speculation.replies.pop(column, None)
+        self._cancel_replies(speculation)
+        self._lookups[reply is not None] += 1
+        lookups_counter.add(1, {'result': 'hit' if reply else 'miss'})
+        if reply is None:
+            return None
+        self._decide(reply, 'used')
+        return reply.task
+
+    async def reply(self, speculated: asyncio.Task[Column] | None, game_state: GameState) -> Column:
+        """The speculated reply if there is one and it was generated, otherwise the AI's move generated now."""
+        if speculated is not None and (column := await self.result(speculated)) is not None:
+            return column
+        return await generate_next_move(game_state)
+
+    async def result(self, speculated: asyncio.Task[Column]) -> Column | None:
+        """The speculated reply, `None` if generating it failed so it should be generated again."""
+        try:
+            return await speculated
+        except Exception:
+            logfire.exception('Speculative reply failed')
+            return None
+
+    def cancel(self, game_id: UUID) -> None:
+        if speculation := self._games.pop(game_id, None):
+            self._cancel_replies(speculation)
+
+    async def _generate(self, game_id: UUID, game_state: GameState, metered: bool) -> Column:
+        costs = MoveCosts()
+        move_costs.set(costs)
+        try:
+            with logfire.span('speculative reply to {column}', column=game_state.moves[-1].column):
+                return await generate_next_move(game_state)
+        finally:
+            # the first request was charged when the reply was started
+            if metered and costs.usage.requests > 1:
+                self._charge(game_id, costs.usage.requests - 1)
+
+    def _charge(self, game_id: UUID, requests: int) -> None:
+        self._requests[game_id] = self._requests.get(game_id, 0) + requests
+        self._requests.move_to_end(game_id)
+        while len(self._requests) > self.max_games:
+            self._requests.popitem(last=False)
+
+    def _cancel_replies(self, speculation: Speculation) -> None:
+        for reply in speculation.replies.values():
+            reply.task.cancel()
+            self._decide(reply, 'wasted')
+
+    def _on_done(self, reply: Reply, task: asyncio.Task[Column]) -> None:
+        reply.seconds = time.perf_counter() - reply.start
+        if not task.cancelled():
+            # retrieved here so unused replies which failed aren't reported as never retrieved
+            task.exception()
+        self._record(reply)
+
+    def _decide(self, reply: Reply, outcome: Outcome) -> None:
+        if reply.outcome is None:
+            reply.outcome = outcome
+            self._record(reply)
+
+    def _record(self, reply: Reply) -> None:
+        # once the reply is both done and used or wasted, which can happen in either order
+        if reply.seconds is None or reply.outcome is None:
+            return
+        self._compute[reply.outcome] += reply.seconds
+        replies_counter.add(1, {'outcome': reply.outcome})
+        compute_counter.add(reply.seconds, {'outcome': reply.outcome})
+
+
+speculator = Speculator(
+    columns=int(os.getenv('C4_SPECULATION_COLUMNS') or 0),
+    models=set((os.getenv('C4_SPECULATION_MODELS') or 'local:c4').split(',')),
+    max_requests=int(os.getenv('C4_SPECULATION_REQUESTS') or 20),
+)
@@ -1,75 +1,267 @@
+"""Synthetic traffic for the app.
+
+With no arguments this is a liveness probe, running one task every 15-60s forever:
+
+    uv run -m backend.spider
+
+`load` runs a load test instead, then prints the latency percentiles and error rate of each endpoint, e.g. 50
+virtual users ramped up over 30s, each running tasks back to back for 2 minutes:
+
+    uv run -m backend.spider load --users 50 --ramp-up 30 --duration 120
+
+or an open loop of 20 new tasks per second, regardless of how quickly earlier tasks finish, to find the rate at which
+latency climbs:
+
+    uv run -m backend.spider load --rate 20 --ramp-up 30 --duration 120 --mix status=1,play=1
+
+Games are played by `local:c4` by default, run the server with `C4_LOCAL_ENGINE=solver` so no model provider is
+involved and the test measures the FastAPI + asyncpg stack.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
 import os
 import random
 import re
-from asyncio import sleep
+import time
+from collections import Counter, defaultdict
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
 
 import httpx
 
-from backend.api import StartGame
-from backend.game import AIModel, GameState
+from backend.api import MoveEvent, StartGame
+from backend.game import AIModel
+from backend.limiter import parse_limits
+
+type Task = Callable[[httpx.AsyncClient, str, 'Stats', AIModel], Awaitable[None]]
+
+DEFAULT_MIX = 'status=2,load_page=3,play=1'
+
+
+@dataclass
+class Stats:
+    """Latencies and errors of each endpoint, printed as they happen when `verbose`."""
+
+    verbose: bool = False
+    latencies: defaultdict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: defaultdict[str, Counter[str]] = field(default_factory=lambda: defaultdict(Counter))
+
+    @asynccontextmanager
+    async def timed(self, name: str) -> AsyncIterator[None]:
+        """Time the body as a request to `name`, counting any exception as an error."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.error(name, e.response.status_code if isinstance(e, httpx.HTTPStatusError) else type(e).__name__)
+            raise
+        else:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.latencies[name].append(seconds)
+        if self.verbose:
+            print(f'{name} in {seconds * 1000:.0f}ms', flush=True)
+
+    def error(self, name: str, error: str | int) -> None:
+        self.errors[name][str(error)] += 1
+        if self.verbose:
+            print(f'{name} failed: {error}', flush=True)
+
+    def report(self, elapsed: float) -> None:
+        print(f'{"endpoint":>40} {"count":>7} {"req/s":>7} {"errors":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+        for name in sorted(self.latencies.keys() | self.errors.keys()):
+            latencies = sorted(self.latencies.get(name, []))
+            n_errors = sum(self.errors.get(name, Counter[str]()).values())
+            count = len(latencies) + n_errors
+            error_rate = f'{n_errors / count:.1%}'
+            if latencies:
+                p50, p95, p99 = (latencies[int(p * (len(latencies) - 1))] * 1000 for p in (0.5, 0.95, 0.99))
+                timings = f'{p50:>8.1f} {p95:>8.1f} {p99:>8.1f}'
+            else:
+                timings = f'{"-":>8} {"-":>8} {"-":>8}'
+            print(f'{name:>40} {count:>7} {count / elapsed:>7.1f} {error_rate:>7} {timings}')
+        for name, errors in sorted(self.errors.items()):
+            if errors:
+                print(f'{name} errors: {", ".join(f"{error} x{n}" for error, n in errors.most_common())}')
 
 
 async def main():
-    await sleep(2)
+    await asyncio.sleep(2)
     app_base_url = os.environ['APP_BASE_URL']
+    stats = Stats(verbose=True)
     async with httpx.AsyncClient() as client:
         while True:
             delay = 15 + random.random() * 45
             print(f'Waiting {delay:.0f}s...', flush=True)
-            await sleep(delay)
+            await asyncio.sleep(delay)
             task = random.choice(['status'] * 2 + ['load_page'] * 3 + ['play'])
-            if task == 'status':
-                await status(client, app_base_url)
-            elif task == 'load_page':
-                await load_page(client, app_base_url)
-            else:
-                assert task == 'play', f'Unknown task: {task}'
-                await play(client, app_base_url)
+            try:
+                await TASKS[task](client, app_base_url, stats, 'local:c4')
+            except Exception:
+                # already reported by `Stats`
+                pass
 
 
-async def status(client: httpx.AsyncClient, app_base_url: str):
-    print(f'checking status HEAD {app_base_url}...', flush=True)
-    r = await client.head(app_base_url)
-    r.raise_for_status()
-    print(f'HEAD {app_base_url} -> {r.status_code}', flush=True)
+async def status(client: httpx.AsyncClient, app_base_url: str, stats: Stats, model: AIModel):
+    async with stats.timed('HEAD /'):
+        r = await client.head(app_base_url)
+        r.raise_for_status()
 
 
-async def load_page(client: httpx.AsyncClient, app_base_url: str):
-    print(f'loading page GET {app_base_url}...', flush=True)
-    r = await client.get(app_base_url)
-    r.raise_for_status()
-    print(f'GET {app_base_url} -> {r.status_code}', flush=True)
+async def load_page(client: httpx.AsyncClient, app_base_url: str, stats: Stats, model: AIModel):
+    async with stats.timed('GET /'):
+        r = await client.get(app_base_url)
+        r.raise_for_status()
     for match in re.finditer(r'href="([^"]+)"', r.text):
         url = match.group(1)
         if url.startswith('/'):
             url = f'{app_base_url}{url}'
-        print(f'Getting: {url}...')
-        r = await client.get(url)
-        print(f'GET {match.group(1)} -> {r.status_code}', flush=True)
-
-
-async def play(client: httpx.AsyncClient, app_base_url: str):
-    url = f'{app_base_url}/api/games/start'
-    print(f'starting game POST {url}...', flush=True)
-    params: dict[str, AIModel] = {'orange_ai': 'local:c4', 'pink_ai': 'local:c4'}
-    r = await client.get(url, params=params)
-    if not r.is_success:
-        print(f'Failed to start game: {r.status_code}:\n  {r.text}')
-        return
+        # group assets by extension, their names have content hashes in them
+        async with stats.timed(f'GET asset {os.path.splitext(match.group(1))[1] or match.group(1)}'):
+            r = await client.get(url)
+            r.raise_for_status()
+
+
+async def play(client: httpx.AsyncClient, app_base_url: str, stats: Stats, model: AIModel):
+    async with stats.timed('GET /api/games/start'):
+        r = await client.get(f'{app_base_url}/api/games/start', params={'orange_ai': model, 'pink_ai': model})
+        r.raise_for_status()
     game = StartGame.model_validate_json(r.content)
-    while True:
-        await sleep(1 + random.random() * 4)
-        r = await client.post(f'{app_base_url}/api/games/{game.game_id}/move')
-        if not r.is_success:
-            print(f'Failed to make move: {r.status_code}:\n  {r.text}')
-            return
-        state = GameState.model_validate_json(r.content)
-        print(f'Game {game.game_id} {len(state.moves)} moves, {state.status}', flush=True)
-        if state.status != 'playing':
-            break
+    # the server plays the game, streaming each move as a server-sent event
+    async with stats.timed('SSE /api/games/{id}/events whole game'):
+        start = last_event = time.perf_counter()
+        async with client.stream('GET', f'{app_base_url}/api/games/{game.game_id}/events', timeout=None) as r:
+            r.raise_for_status()
+            event_type = 'message'
+            async for line in r.aiter_lines():
+                if line.startswith('event: '):
+                    event_type = line.removeprefix('event: ')
+                    if event_type == 'error':
+                        raise RuntimeError(f'Failed to make move in game {game.game_id}')
+                elif not line:
+                    event_type = 'message'
+                elif line.startswith('data: ') and event_type == 'message':
+                    event = MoveEvent.model_validate_json(line.removeprefix('data: '))
+                    now = time.perf_counter()
+                    if event.ply == 1:
+                        stats.record('SSE /api/games/{id}/events first move', now - start)
+                    else:
+                        stats.record('SSE /api/games/{id}/events move', now - last_event)
+                    last_event = now
+
+
+TASKS: dict[str, Task] = {'status': status, 'load_page': load_page, 'play': play}
+
+
+@dataclass
+class LoadTest:
+    app_base_url: str
+    users: int
+    """Concurrent virtual users, or with `rate` the most tasks in flight at once."""
+    duration: float
+    ramp_up: float
+    mix: dict[str, int]
+    rate: float | None = None
+    """Tasks started per second in an open loop, rather than each user starting a task when its last one finishes."""
+    think_time: float = 0
+    drain: float = 30
+    """Seconds to wait for tasks still running at the end of `duration`, before cancelling them."""
+    model: AIModel = 'local:c4'
+    stats: Stats = field(default_factory=Stats)
+
+    def _choose_task(self) -> Task:
+        return TASKS[random.choices(list(self.mix), weights=list(self.mix.values()))[0]]
+
+    async def _run_task(self, client: httpx.AsyncClient, task: Task) -> None:
+        try:
+            await task(client, self.app_base_url, self.stats, self.model)
+        except Exception:
+            # already counted by `Stats`
+            pass
+
+    async def run(self) -> None:
+        limits = httpx.Limits(max_connections=self.users, max_keepalive_connections=self.users)
+        async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30, pool=None)) as client:
+            start = time.perf_counter()
+            deadline = start + self.duration
+            # cancelled tasks aren't counted, they'd only measure how long was left of the drain
+            with suppress(TimeoutError):
+                async with asyncio.timeout(self.duration + self.drain):
+                    if self.rate is None:
+                        await asyncio.gather(*(self._user(client, i, start, deadline) for i in range(self.users)))
+                    else:
+                        await self._open_loop(client, start, deadline)
+            elapsed = time.perf_counter() - start
+        self.stats.report(elapsed)
+
+    async def _user(self, client: httpx.AsyncClient, index: int, start: float, deadline: float) -> None:
+        # users start evenly spread over the ramp up
+        await asyncio.sleep(self.ramp_up * index / self.users)
+        while time.perf_counter() < deadline:
+            await self._run_task(client, self._choose_task())
+            if self.think_time:
+                await asyncio.sleep(random.expovariate(1 / self.think_time))
+
+    async def _open_loop(self, client: httpx.AsyncClient, start: float, deadline: float) -> None:
+        assert self.rate is not None
+        in_flight: set[asyncio.Task[None]] = set()
+        try:
+            while True:
+                # Poisson arrivals at the full rate, during the ramp up each is kept with probability proportional to
+                # the elapsed time, which thins them to a rate rising linearly
+                await asyncio.sleep(random.expovariate(self.rate))
+                if (now := time.perf_counter()) >= deadline:
+                    break
+                if self.ramp_up and random.random() > (now - start) / self.ramp_up:
+                    continue
+                if len(in_flight) >= self.users:
+                    # the server can't keep up with the arrival rate, count the task as dropped rather than queueing
+                    self.stats.error('arrivals', 'dropped: too many tasks in flight')
+                    continue
+                task = asyncio.create_task(self._run_task(client, self._choose_task()))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            await asyncio.gather(*in_flight)
+        finally:
+            for task in in_flight:
+                task.cancel()
 
 
 if __name__ == '__main__':
-    import asyncio
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='mode')
+    load_parser = subparsers.add_parser('load', help='run a load test and report latencies')
+    load_parser.add_argument('--base-url', default=os.getenv('APP_BASE_URL') or 'http://localhost:8000')
+    load_parser.add_argument('--users', type=int, default=10, help='virtual users, or max tasks in flight with --rate')
+    load_parser.add_argument('--duration', type=float, default=60, help='seconds to run for')
+    load_parser.add_argument('--ramp-up', type=float, default=0, help='seconds to ramp up users or the rate over')
+    load_parser.add_argument('--rate', type=float, help='open loop: tasks started per second')
+    load_parser.add_argument('--think-time', type=float, default=0, help='mean seconds each user waits between tasks')
+    load_parser.add_argument('--drain', type=float, default=30, help='seconds to let running tasks finish at the end')
+    load_parser.add_argument('--mix', default=DEFAULT_MIX, help=f'task weights, default {DEFAULT_MIX}')
+    load_parser.add_argument('--model', default='local:c4', help='model playing both sides of games')
+    args = parser.parse_args()
 
-    asyncio.run(main())
+    if args.mode == 'load':
+        mix = parse_limits(args.mix)
+        if unknown := mix.keys() - TASKS.keys():
+            parser.error(f'unknown tasks in --mix: {", ".join(unknown)}, choose from {", ".join(TASKS)}')
+        load_test = LoadTest(
+            app_base_url=args.base_url.rstrip('/'),
+            users=args.users,
+            duration=args.duration,
+            ramp_up=args.ramp_up,
+            mix=mix,
+            rate=args.rate,
+            think_time=args.think_time,
+            drain=args.drain,
+            model=args.model,
+        )
+        asyncio.run(load_test.run())
+    else:
+        asyncio.run(main())
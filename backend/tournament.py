@@ -0,0 +1,259 @@
+"""Round-robin tournaments between models, to rank them with Elo ratings rather than by gut feeling.
+
+Games are played in-process with `GameState`, not through the API or database. Every move is generated by the model
+with `generate_model_move`, skipping the opening book, tactical pre-pass, move cache and hedging of real games, which
+would otherwise replay moves from earlier games and make the latency and cost tables measure the cache rather than
+the model. Every pair of players plays `rounds` games as each colour, at most `concurrency` games at once.
+
+Each finished game is appended to a JSON lines checkpoint, running again with the same checkpoint skips the games
+already played, so an interrupted tournament can be resumed and games can be added by adding players or rounds.
+
+Besides the models in `AIModel`, `random` and `greedy` baselines play without a model: `random` plays a random legal
+column, `greedy` takes wins and blocks and otherwise plays the center-most legal column. With `local:c4` they run
+fully offline, e.g. to benchmark the scheduler:
+
+    uv run python -m backend.tournament local:c4 random greedy --rounds 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import random
+import statistics
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from decimal import Decimal
+from pathlib import Path
+from typing import Literal, get_args
+
+import logfire
+from pydantic import BaseModel, TypeAdapter
+
+from backend.agent import MoveCosts, generate_model_move, move_costs, tactical_move
+from backend.game import COLUMN_PREFERENCE, AIModel, Column, GameState, GameStatus, Player
+
+__all__ = 'GameResult', 'PlayerStats', 'Tournament', 'elo_ratings'
+
+type Baseline = Literal['random', 'greedy']
+type Contestant = AIModel | Baseline
+
+BASELINES: tuple[Baseline, ...] = get_args(Baseline.__value__)
+INITIAL_ELO = 1500
+ELO_K = 16
+
+contestant_schema = TypeAdapter[Contestant](Contestant)
+games_counter = logfire.metric_counter('c4.tournament.games', unit='1', description='Tournament games finished')
+
+
+class GameResult(BaseModel):
+    """A finished game, one line of the checkpoint file."""
+
+    round: int
+    pink: Contestant
+    orange: Contestant
+    status: GameStatus
+    columns: list[Column]
+    move_seconds: dict[Player, list[float]]
+    input_tokens: dict[Player, int]
+    output_tokens: dict[Player, int]
+    cost: dict[Player, Decimal]
+
+    @property
+    def key(self) -> tuple[int, Contestant, Contestant]:
+        return self.round, self.pink, self.orange
+
+    def score(self, player: Player) -> float:
+        """1 for a win, 0.5 for a draw, 0 for a loss."""
+        if self.status == 'draw':
+            return 0.5
+        return 1.0 if self.status == f'{player}-win' else 0.0
+
+
+@dataclass
+class PlayerStats:
+    contestant: Contestant
+    elo: float = INITIAL_ELO
+    wins: int = 0
+    draws: int = 0
+    losses: int = 0
+    move_seconds: list[float] = field(default_factory=list[float])
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: Decimal = Decimal(0)
+
+    @property
+    def games(self) -> int:
+        return self.wins + self.draws + self.losses
+
+
+def elo_ratings(results: Iterable[GameResult]) -> dict[Contestant, PlayerStats]:
+    """Elo ratings and totals for each player, results are applied in round order so the ratings are reproducible."""
+    stats: dict[Contestant, PlayerStats] = {}
+    for result in sorted(results, key=lambda r: (r.round, r.pink, r.orange)):
+        pink = stats.setdefault(result.pink, PlayerStats(result.pink))
+        orange = stats.setdefault(result.orange, PlayerStats(result.orange))
+        expected = 1 / (1 + 10 ** ((orange.elo - pink.elo) / 400))
+        change = ELO_K * (result.score('pink') - expected)
+        pink.elo += change
+        orange.elo -= change
+
+        sides: tuple[tuple[Player, PlayerStats], ...] = (('pink', pink), ('orange', orange))
+        for player, player_stats in sides:
+            score = result.score(player)
+            if score == 1:
+                player_stats.wins += 1
+            elif score == 0:
+                player_stats.losses += 1
+            else:
+                player_stats.draws += 1
+            player_stats.move_seconds.extend(result.move_seconds[player])
+            player_stats.input_tokens += result.input_tokens[player]
+            player_stats.output_tokens += result.output_tokens[player]
+            player_stats.cost += result.cost[player]
+    return stats
+
+
+class Tournament:
+    def __init__(
+        self,
+        contestants: list[Contestant],
+        rounds: int = 1,
+        concurrency: int = 10,
+        checkpoint: Path | None = None,
+        seed: int = 0,
+    ):
+        self.contestants = contestants
+        self.rounds = rounds
+        self.concurrency = concurrency
+        self.checkpoint = checkpoint
+        self.seed = seed
+        self.results: dict[tuple[int, Contestant, Contestant], GameResult] = {}
+        if checkpoint and checkpoint.exists():
+            for line in checkpoint.read_text().splitlines():
+                result = GameResult.model_validate_json(line)
+                self.results[result.key] = result
+
+    def schedule(self) -> list[tuple[int, Contestant, Contestant]]:
+        """Games still to play: every ordered pair of players, so each plays each colour, in each round."""
+        return [
+            (round_, pink, orange)
+            for round_ in range(self.rounds)
+            for pink, orange in itertools.permutations(self.contestants, 2)
+            if (round_, pink, orange) not in self.results
+        ]
+
+    async def run(self) -> dict[Contestant, PlayerStats]:
+        """Play the games not in the checkpoint, returns the stats for every game played including earlier runs."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def play(round_: int, pink: Contestant, orange: Contestant) -> None:
+            async with semaphore:
+                try:
+                    result = await self.play_game(round_, pink, orange)
+                except Exception:
+                    # not checkpointed, so the game is retried next time
+                    logfire.exception('Error playing {pink} vs {orange}', pink=pink, orange=orange, round=round_)
+                    return
+            self.results[result.key] = result
+            games_counter.add(1)
+            if self.checkpoint:
+                with self.checkpoint.open('a') as f:
+                    f.write(result.model_dump_json() + '\n')
+
+        async with asyncio.TaskGroup() as tg:
+            for game in self.schedule():
+                tg.create_task(play(*game))
+        return elo_ratings(self.results.values())
+
+    async def play_game(self, round_: int, pink: Contestant, orange: Contestant) -> GameResult:
+        # baselines never use the model set in the game state, any model will do
+        game_state = GameState(pink_ai=_model_or_default(pink), orange_ai=_model_or_default(orange))
+        players: dict[Player, Contestant] = {'pink': pink, 'orange': orange}
+        # seeded per game, so the random baseline plays the same moves when a game is replayed
+        rng = random.Random(f'{self.seed}:{round_}:{pink}:{orange}')
+        move_seconds: dict[Player, list[float]] = {'pink': [], 'orange': []}
+        costs: dict[Player, MoveCosts] = {'pink': MoveCosts(), 'orange': MoveCosts()}
+
+        with logfire.span('tournament game {pink} vs {orange}', pink=pink, orange=orange, round=round_):
+            while game_state.status == 'playing':
+                player = game_state.get_next_player()
+                contestant = players[player]
+                start = time.perf_counter()
+                if contestant == 'random':
+                    column = rng.choice(game_state.position.legal_columns())
+                elif contestant == 'greedy':
+                    column = greedy_move(game_state)
+                else:
+                    token = move_costs.set(costs[player])
+                    try:
+                        column, _ = await generate_model_move(game_state, contestant)
+                    finally:
+                        move_costs.reset(token)
+                move_seconds[player].append(time.perf_counter() - start)
+                game_state.handle_move(column)
+
+        return GameResult(
+            round=round_,
+            pink=pink,
+            orange=orange,
+            status=game_state.status,
+            columns=[m.column for m in game_state.moves],
+            move_seconds=move_seconds,
+            input_tokens={p: c.usage.input_tokens for p, c in costs.items()},
+            output_tokens={p: c.usage.output_tokens for p, c in costs.items()},
+            cost={p: c.cost for p, c in costs.items()},
+        )
+
+
+def greedy_move(game_state: GameState) -> Column:
+    position = game_state.position
+    if tactical := tactical_move(position):
+        return tactical[0]
+    return next(c for c in COLUMN_PREFERENCE if position.can_play(c))
+
+
+def _model_or_default(contestant: Contestant) -> AIModel:
+    return 'local:c4' if contestant == 'random' or contestant == 'greedy' else contestant
+
+
+def print_standings(stats: dict[Contestant, PlayerStats]) -> None:
+    print(
+        f'{"player":>40} {"elo":>6} {"games":>6} {"W-D-L":>11} {"p50 ms":>8} {"p95 ms":>8} {"tokens":>10} {"cost $":>8}'
+    )
+    for s in sorted(stats.values(), key=lambda s: s.elo, reverse=True):
+        latencies = sorted(s.move_seconds) or [0.0]
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] * 1000
+        wdl = f'{s.wins}-{s.draws}-{s.losses}'
+        tokens = s.input_tokens + s.output_tokens
+        print(
+            f'{s.contestant:>40} {s.elo:>6.0f} {s.games:>6} {wdl:>11} {p50:>8.1f} {p95:>8.1f} {tokens:>10,} '
+            f'{s.cost:>8.4f}'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('contestants', nargs='+', help=f'models to play, or the baselines {", ".join(BASELINES)}')
+    parser.add_argument('--rounds', type=int, default=1, help='games each pair plays as each colour')
+    parser.add_argument('--concurrency', type=int, default=10, help='games played at once')
+    parser.add_argument('--checkpoint', type=Path, help='JSON lines file of results, to resume from and append to')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the random baseline')
+    args = parser.parse_args()
+
+    async def main():
+        logfire.configure(service_name='connect4-tournament', send_to_logfire='if-token-present', console=False)
+        logfire.instrument_pydantic_ai()
+        contestants: list[Contestant] = [contestant_schema.validate_python(c) for c in args.contestants]
+        tournament = Tournament(contestants, args.rounds, args.concurrency, args.checkpoint, args.seed)
+        games = len(tournament.schedule())
+        start = time.perf_counter()
+        stats = await tournament.run()
+        elapsed = time.perf_counter() - start
+        print(f'played {games} games in {elapsed:.1f}s, {games / elapsed:.1f} games/s')
+        print_standings(stats)
+
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+"""Fixed size transposition table for the local solver.
+
+Entries are keyed by the bitboard key of a position (`current + mask`, which is unique for every position) and
+live in two preallocated arrays of 64-bit ints, so the memory used is fixed by `C4_TT_MB` regardless of how many
+positions are searched. The table is shared by every search in the process, so later moves of a game reuse the
+results from searching earlier ones.
+
+Each slot stores `key ^ data` alongside `data`, a torn write from another thread then just looks like a miss.
+"""
+
+from __future__ import annotations
+
+import os
+from array import array
+from functools import cache
+
+import logfire
+
+__all__ = 'EXACT', 'LOWER', 'UPPER', 'TranspositionTable', 'get_transposition_table'
+
+# bound types, never 0 so an empty slot can't be mistaken for an entry
+EXACT = 1
+LOWER = 2
+UPPER = 3
+
+_VALUE_OFFSET = 1 << 15
+_ENTRY_BYTES = 16
+
+hits_counter = logfire.metric_counter(
+    'c4.tt.hits', unit='1', description='Transposition table probes that found the position'
+)
+misses_counter = logfire.metric_counter(
+    'c4.tt.misses', unit='1', description='Transposition table probes on empty slots'
+)
+collisions_counter = logfire.metric_counter(
+    'c4.tt.collisions', unit='1', description='Transposition table probes on slots holding another position'
+)
+
+
+class TranspositionTable:
+    """Depth preferred transposition table, entries from older searches are always replaced."""
+
+    def __init__(self, size_mb: float):
+        self.size = max(int(size_mb * 2**20) // _ENTRY_BYTES, 1)
+        self.keys = array('Q', [0]) * self.size
+        self.data = array('Q', [0]) * self.size
+        self.generation = 0
+        self.hits = self.misses = self.collisions = 0
+
+    def new_search(self) -> None:
+        """Start a new search, entries from previous searches can still be used but are replaced first."""
+        self.generation = (self.generation + 1) & 0xFF
+
+    def probe(self, key: int) -> tuple[int, int, int, int] | None:
+        """Look up `key`, returns `(depth, bound, value, move)` if the position is in the table."""
+        index = key % self.size
+        data = self.data[index]
+        if not data:
+            self.misses += 1
+            return None
+        if self.keys[index] ^ data != key:
+            self.collisions += 1
+            return None
+        self.hits += 1
+        return (data >> 16) & 0x3F, (data >> 22) & 0x3, (data & 0xFFFF) - _VALUE_OFFSET, (data >> 24) & 0xF
+
+    def store(self, key: int, depth: int, bound: int, value: int, move: int) -> None:
+        index = key % self.size
+        existing = self.data[index]
+        if (
+            existing
+            and depth < (existing >> 16) & 0x3F
+            and (existing >> 28) == self.generation
+            and self.keys[index] ^ existing != key
+        ):
+            # keep the deeper entry from this search
+            return
+        data = (value + _VALUE_OFFSET) | depth << 16 | bound << 22 | move << 24 | self.generation << 28
+        self.data[index] = data
+        self.keys[index] = key ^ data
+
+    def clear(self) -> None:
+        self.keys = array('Q', [0]) * self.size
+        self.data = array('Q', [0]) * self.size
+
+    def flush_metrics(self) -> None:
+        """Add the counts since the last flush to the logfire counters, called once per search to keep probes fast."""
+        hits, misses, collisions = self.hits, self.misses, self.collisions
+        self.hits = self.misses = self.collisions = 0
+        hits_counter.add(hits)
+        misses_counter.add(misses)
+        collisions_counter.add(collisions)
+
+
+@cache
+def get_transposition_table() -> TranspositionTable:
+    """The table shared by all searches in this process."""
+    return TranspositionTable(float(os.getenv('C4_TT_MB') or 16))
@@ -0,0 +1,41 @@
+"""Time opening book lookups.
+
+Run with:
+
+    uv run python -m benchmarks.book
+"""
+
+from __future__ import annotations
+
+import random
+import timeit
+
+from backend.book import book_positions, get_opening_book
+from backend.game import Position
+
+
+def random_position(rng: random.Random, plies: int) -> Position:
+    position = Position()
+    for _ in range(plies):
+        position.play(rng.choice([c for c in range(1, 8) if position.can_play(c)]))
+    return position
+
+
+def main(number: int = 100_000) -> None:
+    book = get_opening_book()
+    assert book is not None, 'no opening book, generate one with `python -m backend.book`'
+    rng = random.Random(0)
+    positions = [Position.from_columns(moves) for _, moves in book_positions(4)]
+    # and their mirror images, so both orientations of the canonical key are exercised
+    positions += [Position.from_columns([8 - c for c in moves]) for _, moves in book_positions(4)]
+    misses = [random_position(rng, 12) for _ in range(100)]
+
+    assert all(book.lookup(p) is not None for p in positions)
+    for label, sample in (('hit', positions), ('miss', misses)):
+        picks = iter([rng.choice(sample) for _ in range(number)])
+        seconds = timeit.timeit(lambda: book.lookup(next(picks)), number=number)
+        print(f'{label}: {seconds / number * 1e6:.2f}µs per lookup ({len(book)} entries)')
+
+
+if __name__ == '__main__':
+    main()
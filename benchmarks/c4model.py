@@ -0,0 +1,64 @@
+"""CPU time `C4Model` spends getting the position for each request.
+
+`legacy` is the old approach, rendering the moves into the prompt and parsing them back out with a regex, for
+comparison with passing them in `C4ModelSettings`. Run with:
+
+    uv run python -m benchmarks.c4model
+"""
+
+from __future__ import annotations
+
+import re
+import time
+
+from pydantic import BaseModel, TypeAdapter
+
+from backend.agent import build_move_prompt
+from backend.c4model import Move, c4_model_settings
+from backend.game import GameState, moves_from_columns
+
+COLUMNS = [c for _ in range(6) for c in range(1, 8)]
+REPEAT = 200
+
+
+class LegacyMove(BaseModel):
+    column: int
+    player: str
+
+
+legacy_moves_schema = TypeAdapter(list[LegacyMove])
+
+
+def legacy(game_state: GameState) -> list[LegacyMove]:
+    # the prompt used to be rendered for every request too
+    prompt = build_move_prompt(game_state, 'moves')
+    moves_match = re.search('^```(.+)```$', prompt, flags=re.DOTALL | re.MULTILINE)
+    assert moves_match is not None, 'Expected moves data'
+    lines = [line.strip().split(',', 1) for line in moves_match.group(1).strip().splitlines()]
+    return legacy_moves_schema.validate_python([{'player': player, 'column': column} for player, column in lines])
+
+
+def settings(game_state: GameState) -> list[Move]:
+    return c4_model_settings(game_state)['c4_moves']
+
+
+def main() -> None:
+    games = [
+        GameState(pink_ai='local:c4', orange_ai='local:c4', moves=moves_from_columns(COLUMNS[:ply]))
+        for ply in range(42)
+    ]
+    for game_state in games:
+        assert [m.model_dump() for m in legacy(game_state)] == settings(game_state)
+
+    print(f'{"approach":>8} {"µs per request":>15}')
+    for label, get_moves in (('legacy', legacy), ('settings', settings)):
+        start = time.process_time()
+        for _ in range(REPEAT):
+            for game_state in games:
+                get_moves(game_state)
+        elapsed = time.process_time() - start
+        print(f'{label:>8} {elapsed / (REPEAT * len(games)) * 1e6:>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
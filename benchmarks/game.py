@@ -0,0 +1,110 @@
+"""Micro-benchmark of the bitboard `GameState` against the old list-of-moves replay.
+
+Run with:
+
+    uv run python -m benchmarks.game
+"""
+
+from __future__ import annotations
+
+import random
+import timeit
+
+from backend.game import FIRST_PLAYER, N_COLUMNS, N_ROWS, GameState, Move, Player, get_player_icon
+
+
+def legacy_status(moves: list[Move]) -> str:
+    """`_get_status` as it was before the bitboard, replaying every move into per-column lists."""
+    columns: list[list[Player]] = [[] for _ in range(N_COLUMNS)]
+    last_row, last_col, last_player = -1, -1, None
+    for move in moves:
+        last_player = move.player
+        last_col = move.column - 1
+        last_row = len(columns[last_col])
+        columns[last_col].append(move.player)
+    if last_player is None:
+        return 'playing'
+
+    def player_at(row: int, column: int) -> Player | None:
+        if 0 <= column < N_COLUMNS and 0 <= row < len(columns[column]):
+            return columns[column][row]
+
+    for direction_pair in [((0, 1), (0, -1)), ((1, 0), (-1, 0)), ((1, 1), (-1, -1)), ((1, -1), (-1, 1))]:
+        count = 1
+        for dr, dc in direction_pair:
+            r, c = last_row, last_col
+            for _ in range(3):
+                r, c = r + dr, c + dc
+                if player_at(r, c) == last_player:
+                    count += 1
+                else:
+                    break
+        if count >= 4:
+            return f'{last_player}-win'
+    return 'draw' if len(moves) == N_ROWS * N_COLUMNS else 'playing'
+
+
+def legacy_board(moves: list[Move]) -> str:
+    columns: list[list[Player]] = [[] for _ in range(N_COLUMNS)]
+    for move in moves:
+        columns[move.column - 1].append(move.player)
+    rows = [
+        ' '.join(get_player_icon(columns[c][r]) if r < len(columns[c]) else '.' for c in range(N_COLUMNS))
+        for r in range(N_ROWS)
+    ]
+    return '\n'.join(rows[::-1])
+
+
+def legacy_column_full(moves: list[Move], column: int) -> bool:
+    return len([m for m in moves if m.column == column]) >= N_ROWS
+
+
+def legacy_next_player(moves: list[Move]) -> Player:
+    if not moves:
+        return FIRST_PLAYER
+    return 'orange' if moves[-1].player == 'pink' else 'pink'
+
+
+def random_game(seed: int) -> GameState:
+    rng = random.Random(seed)
+    game_state = GameState(pink_ai='local:c4', orange_ai='local:c4')
+    while game_state.status == 'playing':
+        game_state.handle_move(rng.choice([c for c in range(1, N_COLUMNS + 1) if game_state.position.can_play(c)]))
+    return game_state
+
+
+def check_equivalent(n_games: int = 500) -> None:
+    for seed in range(n_games):
+        game_state = random_game(seed)
+        for ply in range(1, len(game_state.moves) + 1):
+            replayed = GameState(pink_ai='local:c4', orange_ai='local:c4', moves=game_state.moves[:ply])
+            assert legacy_board(replayed.moves) == replayed.board
+        assert legacy_status(game_state.moves) == game_state.status, seed
+
+
+def main(number: int = 20_000) -> None:
+    check_equivalent()
+    # a long game, so there's a position at every ply we want to measure
+    game = max((random_game(seed) for seed in range(200)), key=lambda g: len(g.moves))
+
+    print(f'{"operation":<14} {"ply":>4} {"legacy µs":>10} {"bitboard µs":>12} {"speedup":>8}')
+    for ply in (0, 10, 20, 30, len(game.moves) - 1):
+        moves = game.moves[: ply + 1]
+        column = moves[-1].column
+        position = GameState(pink_ai='local:c4', orange_ai='local:c4', moves=moves[:-1]).position
+        after = GameState(pink_ai='local:c4', orange_ai='local:c4', moves=moves).position
+        cases = [
+            # the bitboard side includes copying the position so each run plays the move on a fresh board
+            ('status', lambda: legacy_status(moves), lambda: position.copy().play(column)),
+            ('board', lambda: legacy_board(moves), lambda: after.copy().render()),
+            ('column full', lambda: legacy_column_full(moves, column), lambda: not after.can_play(column)),
+            ('next player', lambda: legacy_next_player(moves), lambda: after.next_player),
+        ]
+        for name, legacy_op, bitboard_op in cases:
+            legacy = timeit.timeit(legacy_op, number=number) / number * 1e6
+            bitboard = timeit.timeit(bitboard_op, number=number) / number * 1e6
+            print(f'{name:<14} {ply:>4} {legacy:>10.2f} {bitboard:>12.2f} {legacy / bitboard:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
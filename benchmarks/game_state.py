@@ -0,0 +1,74 @@
+"""Bytes transferred and server CPU time per poll of `/api/games/{id}/state` at mid-game.
+
+Compares a full response, a 304 from `If-None-Match` and a `?since=<ply>` delta with the last move, with the game
+state cache on and off. The API runs in-process so CPU time is the server's (plus the client's, which is the same
+in every case). Needs a database:
+
+    DATABASE_URL=postgresql://postgres@localhost:5432/connect4_bench uv run python -m benchmarks.game_state
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+import fastapi
+import httpx
+
+from backend.api import api_router
+from backend.db import DB
+from backend.game import moves_from_columns
+
+# 21 moves, half way through a game
+COLUMNS = [4, 4, 3, 5, 3, 3, 5, 2, 2, 6, 4, 1, 6, 7, 7, 1, 1, 2, 5, 6, 7]
+NUMBER = 500
+REPEAT = 5
+
+
+async def measure(client: httpx.AsyncClient, url: str, headers: dict[str, str], expected_status: int) -> str:
+    r = await client.get(url, headers=headers)
+    assert r.status_code == expected_status, r.status_code
+    # status line and headers as sent by uvicorn, plus the body
+    size = len(f'HTTP/1.1 {r.status_code}\r\n') + sum(len(f'{k}: {v}\r\n') for k, v in r.headers.items()) + 2
+    size += len(r.content)
+    timings: list[float] = []
+    for _ in range(REPEAT):
+        start = time.process_time()
+        for _ in range(NUMBER):
+            await client.get(url, headers=headers)
+        timings.append((time.process_time() - start) / NUMBER * 1e6)
+    # the fastest run is the least disturbed by anything else running
+    cpu = min(timings)
+    return f'{size:>8} {cpu:>10.0f}'
+
+
+async def main() -> None:
+    app = fastapi.FastAPI()
+    app.include_router(api_router, prefix='/api')
+    async with DB.connect() as db:
+        app.state.db = db
+        game_id = await db.create_game('local:c4', 'local:c4')
+        game_state = await db.get_game(game_id)
+        assert game_state is not None
+        for move in moves_from_columns(COLUMNS):
+            await db.handle_move(game_id, game_state, move.column)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            url = f'/api/games/{game_id}/state'
+            etag = (await client.get(url)).headers['etag']
+            cases = {
+                'full': (url, {}, 200),
+                '304 not modified': (url, {'If-None-Match': etag}, 304),
+                'since last move': (f'{url}?since={len(COLUMNS) - 1}', {}, 200),
+            }
+            print(f'{"poll":>18} {"cache":>6} {"bytes":>8} {"cpu µs":>10}')
+            for cache in ('on', 'off'):
+                if cache == 'off':
+                    db._games.max_size = 0  # pyright: ignore[reportPrivateUsage]
+                for name, (case_url, headers, status) in cases.items():
+                    print(f'{name:>18} {cache:>6} {await measure(client, case_url, headers, status)}', flush=True)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
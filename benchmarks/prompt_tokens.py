@@ -0,0 +1,121 @@
+"""Input tokens and latency of the move prompt across a full 42 ply game, for each prompt encoding.
+
+`legacy` is the old layout, with the position in the system prompt, for comparison.
+
+By default token counts are estimated offline with a `FunctionModel`, which counts words so is only good for
+comparing encodings, pass models to measure real token counts, cached tokens and latency with each provider:
+
+    uv run python -m benchmarks.prompt_tokens gateway/anthropic:claude-haiku-4-5 gateway/openai:gpt-4.1-mini
+
+(this makes 42 requests per model per encoding, so needs `PYDANTIC_AI_GATEWAY_API_KEY` and costs money).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import get_args
+
+from pydantic_ai import Agent, RunContext, ToolOutput
+from pydantic_ai.messages import ModelMessage, ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from pydantic_ai.usage import RunUsage
+
+from backend.agent import (
+    CONNECT4_INSTRUCTIONS,
+    AIMove,
+    Connect4Deps,
+    PromptEncoding,
+    build_move_prompt,
+    connect4_agent,
+    offer_legal_columns,
+    run_agent,
+)
+from backend.game import AIModel, GameState, get_player_icon, moves_from_columns
+
+# every column filled bottom to top in turn, the position doesn't need to be a realistic game to measure the prompt
+COLUMNS = [c for _ in range(6) for c in range(1, 8)]
+ENCODINGS: list[PromptEncoding | str] = ['legacy', *get_args(PromptEncoding.__value__)]
+
+legacy_agent = Agent[Connect4Deps, AIMove](
+    deps_type=Connect4Deps,
+    output_type=ToolOutput(type_=AIMove, name='move'),
+    prepare_output_tools=offer_legal_columns,
+)
+
+
+@legacy_agent.system_prompt
+def legacy_instructions(ctx: RunContext[Connect4Deps]) -> str:
+    player = ctx.deps.game_state.get_next_player()
+    moves = '\n'.join(f'{get_player_icon(m.player)},{m.column}' for m in ctx.deps.game_state.moves)
+    return f"""\
+You are playing as **{get_player_icon(player)}**.
+{CONNECT4_INSTRUCTIONS}
+moves (as player,column pairs):
+
+```
+{moves}
+```
+"""
+
+
+def play_legal_move(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+    tool = info.output_tools[0]
+    column = tool.parameters_json_schema['properties']['column']['enum'][0]
+    return ModelResponse(parts=[ToolCallPart(tool.name, {'column': column})])
+
+
+@dataclass
+class Totals:
+    input_tokens: int = 0
+    cache_read_tokens: int = 0
+    latencies: list[float] = field(default_factory=list[float])
+
+    def add(self, usage: RunUsage, seconds: float) -> None:
+        self.input_tokens += usage.input_tokens
+        self.cache_read_tokens += usage.cache_read_tokens
+        self.latencies.append(seconds)
+
+
+async def measure(model: AIModel | None, encoding: PromptEncoding | str) -> Totals:
+    totals = Totals()
+    for ply in range(len(COLUMNS)):
+        game_state = GameState(pink_ai='local:c4', orange_ai='local:c4', moves=moves_from_columns(COLUMNS[:ply]))
+        deps = Connect4Deps(game_state=game_state)
+        start = time.perf_counter()
+        if encoding == 'legacy':
+            result = await legacy_agent.run(
+                'Please generate the next move', deps=deps, model=model or FunctionModel(play_legal_move)
+            )
+        elif model is None:
+            result = await connect4_agent.run(
+                build_move_prompt(game_state, encoding), deps=deps, model=FunctionModel(play_legal_move)
+            )
+        else:
+            result = await run_agent(game_state, model, encoding)
+        totals.add(result.usage(), time.perf_counter() - start)
+    return totals
+
+
+async def main(models: list[AIModel]) -> None:
+    print(f'{"model":>40} {"encoding":>8} {"input tokens":>12} {"cached":>8} {"p50 ms":>8} {"p95 ms":>8}')
+    for model in models or [None]:
+        for encoding in ENCODINGS:
+            totals = await measure(model, encoding)
+            p50 = statistics.median(totals.latencies) * 1000
+            p95 = statistics.quantiles(totals.latencies, n=20)[18] * 1000
+            print(
+                f'{model or "offline estimate":>40} {encoding:>8} {totals.input_tokens:>12,} '
+                f'{totals.cache_read_tokens:>8,} {p50:>8.0f} {p95:>8.0f}',
+                flush=True,
+            )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('models', nargs='*', help='models to measure, omit for an offline estimate')
+    args = parser.parse_args()
+    asyncio.run(main(args.models))
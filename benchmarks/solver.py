@@ -0,0 +1,163 @@
+"""Benchmark the in-process solver at several depths, and the c4ai HTTP path for comparison.
+
+Run with:
+
+    uv run python -m benchmarks.solver
+
+The HTTP path uses the c4ai service if it's reachable at `C4AI_URL` (default `http://localhost:9000`), e.g. after
+`docker compose up -d c4ai`, otherwise an in-process stand-in for it. Concurrent throughput is measured with one
+request per position and with positions batched into `/batch` requests.
+
+The stand-in plays the first legal column after waiting `STANDIN_REQUEST_SECONDS` per request, so against it the
+HTTP numbers measure the connection pool and batching rather than c4ai's search. It runs on the benchmark's event
+loop, so the server's share of the cost of each request is included too.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import socket
+import statistics
+import time
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from backend.c4model import (
+    ROWS,
+    C4AIBatcher,
+    C4Columns,
+    C4Move,
+    Move,
+    c4ai_url,
+    get_c4ai_client,
+    request_column,
+)
+from backend.game import COLUMN_PREFERENCE, GameState, get_player_icon
+from backend.solver import SearchBudget, solve
+from backend.transposition import TranspositionTable
+
+OPENINGS = [[], [4], [4, 4], [4, 3, 4, 4], [3, 4, 5, 4, 4, 3], [4, 4, 4, 4, 3, 5, 2, 3]]
+DEPTHS = [2, 4, 6, 8, 10]
+
+
+def game(columns: list[int]) -> GameState:
+    game_state = GameState(pink_ai='local:c4', orange_ai='local:c4')
+    for column in columns:
+        game_state.handle_move(column)
+    return game_state
+
+
+def bench_solver() -> None:
+    print(f'{"depth":>5} {"nodes":>9} {"nodes/s":>9} {"p50 ms":>8} {"max ms":>8}')
+    for depth in DEPTHS:
+        budget = SearchBudget(max_depth=depth, max_seconds=60, max_nodes=10**9)
+        # a fresh table for every search so each depth is measured cold
+        results = [solve(game(opening).position, budget, TranspositionTable(16)) for opening in OPENINGS]
+        latencies = [r.elapsed * 1000 for r in results]
+        nodes = sum(r.nodes for r in results)
+        nps = nodes / sum(r.elapsed for r in results)
+        print(f'{depth:>5} {nodes:>9} {nps:>9.0f} {statistics.median(latencies):>8.2f} {max(latencies):>8.2f}')
+
+    for label, warm in (('cold', False), ('warm', True)):
+        # a warm table has already searched the earlier positions of the same game, like a worker mid-game
+        table = TranspositionTable(16)
+        results = [
+            solve(game(opening).position, table=table if warm else TranspositionTable(16)) for opening in OPENINGS
+        ]
+        latencies = [r.elapsed * 1000 for r in results]
+        print(
+            f'default budget, {label} table: depths {[r.depth for r in results]}, '
+            f'p50 {statistics.median(latencies):.2f}ms, max {max(latencies):.2f}ms'
+        )
+
+
+# time the stand-in takes to answer each request, whatever the number of positions in it
+STANDIN_REQUEST_SECONDS = 0.002
+
+standin_app = FastAPI()
+
+
+def standin_column(moves: list[Move]) -> int:
+    counts = Counter(m['column'] for m in moves)
+    return next(c for c in COLUMN_PREFERENCE if counts[c] < ROWS)
+
+
+@standin_app.post('/')
+async def standin_move(moves: list[Move]) -> C4Move:
+    await asyncio.sleep(STANDIN_REQUEST_SECONDS)
+    return C4Move(column=standin_column(moves))
+
+
+@standin_app.post('/batch')
+async def standin_batch(positions: list[list[Move]]) -> C4Columns:
+    await asyncio.sleep(STANDIN_REQUEST_SECONDS)
+    return C4Columns(columns=[standin_column(moves) for moves in positions])
+
+
+@asynccontextmanager
+async def c4ai_server() -> AsyncIterator[str]:
+    """The URL of c4ai if it's reachable, otherwise of the stand-in, served on a free port until exit."""
+    try:
+        async with httpx.AsyncClient() as client:
+            (await client.head(c4ai_url)).raise_for_status()
+    except httpx.HTTPError as e:
+        print(f'c4ai not reachable at {c4ai_url} ({e!r}), using an in-process stand-in')
+    else:
+        yield c4ai_url
+        return
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    # inherited by accepted connections, without it small responses wait ~40ms for a delayed ACK
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    server = uvicorn.Server(uvicorn.Config(standin_app, log_level='warning'))
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    try:
+        while not server.started:
+            await asyncio.sleep(0.01)
+        host, port = sock.getsockname()
+        yield f'http://{host}:{port}'
+    finally:
+        server.should_exit = True
+        await task
+
+
+async def bench_http(repeat: int = 5) -> None:
+    async with c4ai_server() as url:
+        async with httpx.AsyncClient() as client:
+            latencies: list[float] = []
+            for _ in range(repeat):
+                for opening in OPENINGS:
+                    game_state = game(opening)
+                    moves = [{'player': get_player_icon(m.player), 'column': m.column} for m in game_state.moves]
+                    start = time.perf_counter()
+                    r = await client.post(url, json=moves)
+                    r.raise_for_status()
+                    latencies.append((time.perf_counter() - start) * 1000)
+        print(f'c4ai HTTP: p50 {statistics.median(latencies):.2f}ms, max {max(latencies):.2f}ms')
+        # `request_column` and the batcher use the shared client, pointed at the stand-in if that's what's running
+        get_c4ai_client().base_url = url
+        await bench_http_concurrent()
+
+
+async def bench_http_concurrent(concurrency: int = 200) -> None:
+    positions = [
+        [Move(column=m.column, player=get_player_icon(m.player)) for m in game(opening).moves] for opening in OPENINGS
+    ]
+    positions = [positions[i % len(positions)] for i in range(concurrency)]
+    batcher = C4AIBatcher(window=0.005, max_size=32)
+    for label, get_column in (('one request per position', request_column), ('batched', batcher.get_column)):
+        start = time.perf_counter()
+        await asyncio.gather(*(get_column(moves) for moves in positions))
+        elapsed = time.perf_counter() - start
+        print(f'c4ai {label}, {concurrency} concurrent: {concurrency / elapsed:.0f} positions/s')
+
+
+if __name__ == '__main__':
+    bench_solver()
+    asyncio.run(bench_http())
@@ -0,0 +1,65 @@
+"""AI reply latency in human-vs-ai games with and without speculation, with speculation's hit rate and wasted compute.
+
+A simulated human thinks for `THINK_SECONDS`, then plays the n-th most likely column, as ranked by `likely_columns`,
+with probability proportional to `HUMAN_SKEW ** n`. The AI is `local:c4`, run with the solver engine and without the
+move cache, so every reply is searched:
+
+    C4_LOCAL_ENGINE=solver uv run python -m benchmarks.speculation
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import statistics
+import time
+from uuid import uuid4
+
+from backend.game import GameState
+from backend.move_cache import move_cache
+from backend.speculation import Speculator, likely_columns
+
+GAMES = 3
+THINK_SECONDS = 0.6
+HUMAN_SKEW = 0.5
+
+
+async def play(speculator: Speculator, rng: random.Random) -> list[float]:
+    """Play a game, returns the latency of each AI reply."""
+    game_id = uuid4()
+    game_state = GameState(pink_ai=None, orange_ai='local:c4')
+    latencies: list[float] = []
+    while True:
+        await asyncio.sleep(THINK_SECONDS)
+        columns = likely_columns(game_state.position)
+        column = rng.choices(columns, weights=[HUMAN_SKEW**n for n in range(len(columns))])[0]
+        game_state.handle_move(column)
+        speculated = speculator.take(game_id, len(game_state.moves) - 1, column)
+        if game_state.status != 'playing':
+            break
+        start = time.perf_counter()
+        game_state.handle_move(await speculator.reply(speculated, game_state))
+        latencies.append(time.perf_counter() - start)
+        if game_state.status != 'playing':
+            break
+        speculator.speculate(game_id, game_state)
+    speculator.cancel(game_id)
+    return latencies
+
+
+async def main() -> None:
+    # nothing is kept, so replies to positions seen in earlier games are searched again
+    move_cache.max_size = 0
+    print(f'{"columns":>8} {"replies":>8} {"p50 ms":>8} {"p95 ms":>8} {"hit rate":>9} {"wasted":>7}')
+    for columns in (0, 1, 3):
+        speculator = Speculator(columns=columns, models={'local:c4'}, max_requests=20)
+        rng = random.Random(0)
+        latencies = sorted([latency for _ in range(GAMES) for latency in await play(speculator, rng)])
+        p50, p95 = statistics.median(latencies) * 1000, latencies[int(0.95 * (len(latencies) - 1))] * 1000
+        hit_rate = f'{speculator.hit_rate:.0%}' if speculator.hit_rate is not None else '-'
+        wasted = f'{speculator.wasted_ratio:.0%}' if speculator.wasted_ratio is not None else '-'
+        print(f'{columns:>8} {len(latencies):>8} {p50:>8.1f} {p95:>8.1f} {hit_rate:>9} {wasted:>7}', flush=True)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
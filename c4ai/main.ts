@@ -14,14 +14,30 @@ const move = z.object({
 
 const movesSchema = z.array(move)
 type Moves = z.infer<typeof movesSchema>
+// positions sent to `/batch` in one request
+const MAX_BATCH_SIZE = Number.parseInt(process.env.MAX_BATCH_SIZE || '256')
+const batchSchema = z.array(movesSchema).max(MAX_BATCH_SIZE)
 
 interface Response {
   column: number
 }
 
+interface BatchResponse {
+  columns: number[]
+}
+
+// the players hold no per-game state, so are shared by every request
+const player1 = new PlayerAi(BoardPiece.PLAYER_1, 'X')
+const player2 = new PlayerAi(BoardPiece.PLAYER_2, 'O')
+
+function nextPlayer(moves: Moves): Player {
+  if (moves.length === 0) {
+    return 'X'
+  }
+  return moves[moves.length - 1].player === 'X' ? 'O' : 'X'
+}
+
 async function play(moves: Moves, nextPlayerColor: Player): Promise<number> {
-  const player1 = new PlayerAi(BoardPiece.PLAYER_1, 'X')
-  const player2 = new PlayerAi(BoardPiece.PLAYER_2, 'O')
   const board = new BoardBase()
   for (const move of moves) {
     const player = move.player === 'X' ? player1 : player2
@@ -34,7 +50,8 @@ async function play(moves: Moves, nextPlayerColor: Player): Promise<number> {
 const app = express()
 
 // Middleware for parsing JSON
-app.use(express.json())
+// batches of positions are bigger than express' default 100kb limit
+app.use(express.json({ limit: '1mb' }))
 
 // Health check endpoint
 app.head('/', (_req, res) => {
@@ -62,13 +79,7 @@ app.post('/', async (req, res) => {
     }
 
     const moves = data ?? []
-
-    let next_player: Player
-    if (moves.length === 0) {
-      next_player = 'X'
-    } else {
-      next_player = moves[moves.length - 1].player === 'X' ? 'O' : 'X'
-    }
+    const next_player = nextPlayer(moves)
 
     const column = await logfire.span(
       'calculating next move for {next_player}',
@@ -90,6 +101,33 @@ app.post('/', async (req, res) => {
   }
 })
 
+// Next move for each of a list of positions, saves a round trip per position when many games are playing at once
+app.post('/batch', async (req, res) => {
+  const { success, error, data } = batchSchema.safeParse(req.body)
+  if (!success) {
+    logfire.warning('Invalid batch request data', { error })
+    res.status(422).type('text/plain').send(`Invalid request data: ${error}`)
+    return
+  }
+
+  const columns = await logfire.span(
+    'calculating next moves for {size} positions',
+    { size: data.length },
+    {},
+    async (batchSpan) => {
+      const result: number[] = []
+      for (const moves of data) {
+        result.push(await play(moves, nextPlayer(moves)))
+      }
+      batchSpan.end()
+      return result
+    }
+  )
+
+  const responseData: BatchResponse = { columns }
+  res.json(responseData)
+})
+
 // Handle 404 for other routes
 app.all('{*splat}', (_req, res) => {
   res.status(404).end()
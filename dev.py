@@ -5,7 +5,7 @@ import logfire
 from pydantic import BaseModel, ConfigDict
 from pydantic_ai import Agent, ModelRetry, RunContext, ToolOutput
 
-from backend.c4model import C4Model
+from backend.c4model import C4Model, c4_model_settings
 from backend.game import FIRST_PLAYER, Column, GameState, Move, get_player_icon
 
 
@@ -78,12 +78,14 @@ async def generate_next_move(game_state: GameState) -> Column:
         assert game_state.pink_ai is not None, 'Pink AI is not set'
         model = game_state.pink_ai
 
+    settings = None
     if model == 'local:c4':
         model = C4Model()
+        settings = c4_model_settings(game_state)
 
     logfire.info('playing', board=game_state.render_board())
     result = await connect4_agent.run(
-        'Please generate the next move', deps=Connect4Deps(game_state=game_state), model=model
+        'Please generate the next move', deps=Connect4Deps(game_state=game_state), model=model, model_settings=settings
     )
     return result.output.column
 
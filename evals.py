@@ -1,135 +1,225 @@
+"""Evals of each model's move choice on generated tactical positions.
+
+Positions are sampled from seeded random games and labelled with the engine's win detection:
+
+- `must-win`: a move wins straight away, only winning moves are correct
+- `must-block`: the opponent can win on exactly one playable cell, only blocking it is correct
+- `avoid-loss`: some moves let the opponent win by playing on top of them, any other move is correct
+
+Models are evaluated concurrently, each with at most `--concurrency` moves in flight, and a summary of accuracy,
+latency and tokens is printed for each model. `stand-in` is a deterministic local model playing the center-most
+legal column through the real agent and `local:c4` is the in-process solver, so the harness runs offline with:
+
+    uv run python evals.py stand-in local:c4
+
+`--min-accuracy` exits with an error if any model scores lower, to catch regressions.
+"""
+
+import argparse
 import asyncio
+import random
+import statistics
+import sys
 from dataclasses import dataclass
 from functools import partial
+from typing import Literal, get_args
 
 import logfire
+from pydantic_ai.messages import ModelMessage, ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
 from pydantic_evals import Case, Dataset
+from pydantic_evals.dataset import increment_eval_metric
 from pydantic_evals.evaluators import EvaluationReason, Evaluator, EvaluatorContext, LLMJudge
+from pydantic_evals.reporting import EvaluationReport
+
+from backend.agent import (
+    Connect4Deps,
+    build_move_prompt,
+    connect4_agent,
+    generate_solver_move,
+    local_engine,
+    run_agent,
+)
+from backend.game import COLUMN_PREFERENCE, N_ROWS, AIModel, Column, GameState, Position, column_bit, moves_from_columns
+from backend.solver import winning_cells
 
-from backend.game import AIModel
-from dev import Column, GameState, Move, generate_next_move
+type Tactic = Literal['must-win', 'must-block', 'avoid-loss']
+type EvalModel = AIModel | Literal['stand-in']
 
-logfire.configure(console=False, environment='evals')
-logfire.instrument_pydantic_ai()
+STAND_IN = 'stand-in'
 
 
 @dataclass
-class ChoiceQuality(Evaluator[list[Move], Column]):
-    async def evaluate(self, ctx: EvaluatorContext[list[Move], Column]) -> dict[str, EvaluationReason]:
-        match ctx.name:
-            case 'first-move':
-                return {
-                    'score': EvaluationReason(value=5 - abs(4 - ctx.output), reason='middle is best'),
-                    'ok': EvaluationReason(value=True, reason='valid'),
-                }
-            case 'second-move':
-                if ctx.output == 4:
-                    return {
-                        'score': EvaluationReason(value=1, reason="shouldn't go on top of other user"),
-                        'ok': EvaluationReason(value=True, reason='valid'),
-                    }
-                else:
-                    return {
-                        'score': EvaluationReason(value=5 - abs(ctx.output - 4), reason='near the middle is best'),
-                        'ok': EvaluationReason(value=True, reason='valid'),
-                    }
-            case 'must-block':
-                if ctx.output in (2, 5):
-                    return {
-                        'score': EvaluationReason(value=10, reason='correctly blocked other player win'),
-                        'ok': EvaluationReason(value=True, reason='valid'),
-                    }
-                else:
-                    return {
-                        'score': EvaluationReason(value=0, reason='allow other user to win immediate'),
-                        'ok': EvaluationReason(value=False, reason='allow other user to win immediate'),
-                    }
-            case 'can-win':
-                if ctx.output in (2, 5):
-                    return {
-                        'score': EvaluationReason(value=10, reason='correctly won'),
-                        'ok': EvaluationReason(value=True, reason='correctly won the game'),
-                    }
-                else:
-                    return {
-                        'score': EvaluationReason(value=0, reason='missed chance to win immediately'),
-                        'ok': EvaluationReason(value=False, reason='missed chance to win immediately'),
-                    }
-            case _:
-                return {
-                    'score': EvaluationReason(value=0, reason='unknown state'),
-                    'ok': EvaluationReason(value=False, reason='unknown state'),
-                }
+class TacticalPosition:
+    tactic: Tactic
+    correct: tuple[Column, ...]
+    """The columns which are correct moves."""
+
+
+def classify(position: Position) -> TacticalPosition | None:
+    """The tactic in `position` and its correct moves, `None` if there's no tactic or every move is equally good."""
+    legal = position.legal_columns()
+    player = position.n_moves % 2
+    mask = position.masks[0] | position.masks[1]
+    playable = {c: column_bit(c, position.heights[c - 1]) for c in legal}
+
+    wins = winning_cells(position.masks[player], mask)
+    if winning := tuple(c for c, bit in playable.items() if bit & wins):
+        return TacticalPosition('must-win', winning) if len(winning) < len(legal) else None
+
+    threats = winning_cells(position.masks[1 - player], mask)
+    blocks = tuple(c for c, bit in playable.items() if bit & threats)
+    # the cell above each move becomes playable for the opponent
+    safe = tuple(c for c, bit in playable.items() if position.heights[c - 1] + 1 >= N_ROWS or not (bit << 1) & threats)
+    if len(blocks) == 1:
+        # a block which lets the opponent win on top of it loses anyway
+        return TacticalPosition('must-block', blocks) if len(legal) > 1 and blocks[0] in safe else None
+    elif blocks:
+        # the game is lost whatever we play
+        return None
+
+    return TacticalPosition('avoid-loss', safe) if 0 < len(safe) < len(legal) else None
+
+
+def generate_cases(per_tactic: int, seed: int) -> list[Case[list[Column], Column, TacticalPosition]]:
+    """Sample `per_tactic` distinct positions for each tactic from random games."""
+    rng = random.Random(seed)
+    cases: dict[Tactic, list[Case[list[Column], Column, TacticalPosition]]] = {
+        t: [] for t in get_args(Tactic.__value__)
+    }
+    seen: set[int] = set()
+    while any(len(c) < per_tactic for c in cases.values()):
+        position = Position()
+        columns: list[Column] = []
+        while legal := position.legal_columns():
+            tactical = classify(position)
+            if tactical and len(cases[tactical.tactic]) < per_tactic and position.key() not in seen:
+                seen.add(position.key())
+                tactic_cases = cases[tactical.tactic]
+                name = f'{tactical.tactic}-{len(tactic_cases) + 1}'
+                tactic_cases.append(Case(name=name, inputs=columns.copy(), metadata=tactical))
+            column = rng.choice(legal)
+            columns.append(column)
+            if position.play(column):
+                break
+    return [case for tactic_cases in cases.values() for case in tactic_cases]
 
 
-rubric = """\
-Your job is to judge the move of a Connect 4 player playing as "orange", the opponent is "pink".
+@dataclass
+class CorrectMove(Evaluator[list[Column], Column, TacticalPosition]):
+    def evaluate(self, ctx: EvaluatorContext[list[Column], Column, TacticalPosition]) -> EvaluationReason:
+        assert ctx.metadata is not None, 'generated cases always have metadata'
+        correct = ctx.output in ctx.metadata.correct
+        reason = f'{ctx.metadata.tactic}: played {ctx.output}, correct moves are {ctx.metadata.correct}'
+        return EvaluationReason(value=correct, reason=reason)
 
-"orange"'s move is the "output" value.
 
-The board is made up of 7 columns numbered 1 to 7, so 4 is the middle column. "pink" plays first.
+rubric = """\
+Your job is to judge the move of a Connect 4 player, the "output" value.
 
-You should judge their move and the rationale for their choice to assess how good their move is -
-how much it helps them to win and stops the other player from winning.
+The input is the list of columns played so far, the first player played first. The board is made up of
+7 columns numbered 1 to 7, so 4 is the middle column.
 
 You should judge the user very harshly if they make a move that allows the other player to win immediately,
 or misses the opportunity to win themselves.
-
-Remember, if a player get's three in a row, and has the option of adding a token at either end of the row,
-they will definitely win on the following turn.
-
-If you receive no input about existing moves, it's because you're evaluating the user's first move of the game.
 """
 
 
-dataset: Dataset[list[Move], Column] = Dataset(
-    cases=[
-        Case(name='first-move', inputs=[]),
-        Case(name='second-move', inputs=[Move(player='pink', column=4)]),
-        Case(
-            name='must-block',
-            inputs=[Move(player='pink', column=4), Move(player='orange', column=4), Move(player='pink', column=3)],
-        ),
-        Case(
-            name='can-win',
-            inputs=[
-                Move(player='pink', column=1),
-                Move(player='orange', column=4),
-                Move(player='pink', column=1),
-                Move(player='orange', column=3),
-                Move(player='pink', column=4),
-            ],
-        ),
-    ],
-    evaluators=[
-        ChoiceQuality(),
-        LLMJudge(rubric=rubric, include_input=True, model='gateway/anthropic:claude-opus-4-5'),
-    ],
-    name='Connect 4',
-)
+def play_stand_in_move(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+    tool = info.output_tools[0]
+    legal = tool.parameters_json_schema['properties']['column']['enum']
+    column = next(c for c in COLUMN_PREFERENCE if c in legal)
+    return ModelResponse(parts=[ToolCallPart(tool.name, {'column': column, 'reasoning': 'center-most legal column'})])
+
+
+stand_in_model = FunctionModel(play_stand_in_move, model_name=STAND_IN)
+
+
+async def play(columns: list[Column], model: EvalModel) -> Column:
+    ai: AIModel = 'local:c4' if model == STAND_IN else model
+    game_state = GameState(pink_ai=ai, orange_ai=ai, moves=moves_from_columns(columns))
+    if model == STAND_IN:
+        result = await connect4_agent.run(
+            build_move_prompt(game_state), deps=Connect4Deps(game_state=game_state), model=stand_in_model
+        )
+    elif model == 'local:c4' and local_engine == 'solver':
+        return await generate_solver_move(game_state)
+    else:
+        result = await run_agent(game_state, model)
+
+    usage = result.usage()
+    increment_eval_metric('input_tokens', usage.input_tokens)
+    increment_eval_metric('output_tokens', usage.output_tokens)
+    increment_eval_metric('requests', usage.requests)
+    return result.output.column
+
+
+def summarize(model: EvalModel, report: EvaluationReport[list[Column], Column, TacticalPosition]) -> float:
+    """Print a row of the summary table for `model`, returns its accuracy."""
+    correct: dict[Tactic, list[bool]] = {t: [] for t in get_args(Tactic.__value__)}
+    for case in report.cases:
+        assert case.metadata is not None, 'generated cases always have metadata'
+        correct[case.metadata.tactic].append(case.assertions['CorrectMove'].value)
+    for failure in report.failures:
+        assert failure.metadata is not None, 'generated cases always have metadata'
+        correct[failure.metadata.tactic].append(False)
+
+    results = [c for tactic in correct.values() for c in tactic]
+    accuracy = sum(results) / len(results)
+    by_tactic = ' '.join(f'{sum(c) / len(c):>10.0%}' for c in correct.values())
+    durations = sorted(case.task_duration * 1000 for case in report.cases) or [0.0]
+    p50, p95 = statistics.median(durations), durations[int(0.95 * (len(durations) - 1))]
+    tokens = sum(case.metrics.get('input_tokens', 0) + case.metrics.get('output_tokens', 0) for case in report.cases)
+    print(
+        f'{model:>40} {accuracy:>8.0%} {by_tactic} {len(report.failures):>6} {p50:>8.0f} {p95:>8.0f} {tokens:>10,}',
+        flush=True,
+    )
+    return accuracy
 
 
-async def generate_next_move_evals(moves: list[Move], model: AIModel) -> Column:
-    game_state = GameState(
-        pink_ai='gateway/openai:gpt-4.1',
-        orange_ai=model,
-        moves=moves,
+async def run_evals(
+    models: list[EvalModel], per_tactic: int, seed: int, concurrency: int, judge: bool, verbose: bool
+) -> dict[EvalModel, float]:
+    evaluators: list[Evaluator[list[Column], Column, TacticalPosition]] = [CorrectMove()]
+    if judge:
+        evaluators.append(LLMJudge(rubric=rubric, include_input=True, model='gateway/anthropic:claude-opus-4-5'))
+    dataset = Dataset[list[Column], Column, TacticalPosition](
+        cases=generate_cases(per_tactic, seed), evaluators=evaluators, name='Connect 4 tactics'
     )
-    return await generate_next_move(game_state)
 
+    tactics = ' '.join(f'{t:>10}' for t in get_args(Tactic.__value__))
+    print(f'{"model":>40} {"accuracy":>8} {tactics} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"tokens":>10}')
+
+    async def evaluate(model: EvalModel) -> float:
+        report = await dataset.evaluate(
+            partial(play, model=model),
+            name=f'Connect 4 {model}',
+            max_concurrency=concurrency,
+            progress=False,
+        )
+        if verbose:
+            report.print(include_input=False, include_output=True)
+        return summarize(model, report)
 
-async def run_evals():
-    models: list[AIModel] = [
-        'gateway/openai:gpt-4.1',
-        'gateway/google-vertex:gemini-2.5-flash',
-        'gateway/anthropic:claude-haiku-4-5',
-        'gateway/openai:gpt-5',
-        'gateway/anthropic:claude-opus-4-5',
-    ]
-    for model in models:
-        report = await dataset.evaluate(partial(generate_next_move_evals, model=model), name=f'Connect 4 {model}')
-        report.print(include_input=False, include_output=False)
+    accuracies = await asyncio.gather(*(evaluate(model) for model in models))
+    return dict(zip(models, accuracies))
 
 
 if __name__ == '__main__':
-    asyncio.run(run_evals())
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('models', nargs='+', help=f'models to evaluate, `{STAND_IN}` for the local stand-in')
+    parser.add_argument('--cases', type=int, default=100, help='positions per tactic')
+    parser.add_argument('--seed', type=int, default=0, help='seed for generating positions')
+    parser.add_argument('--concurrency', type=int, default=10, help='moves in flight per model')
+    parser.add_argument('--min-accuracy', type=float, help='fail if any model scores lower, e.g. 0.9')
+    parser.add_argument('--judge', action='store_true', help='also score moves with an LLM judge')
+    parser.add_argument('--verbose', action='store_true', help='print the full report for each model')
+    args = parser.parse_args()
+
+    # only send traces when there's a token, so evals can run offline
+    logfire.configure(console=False, environment='evals', send_to_logfire='if-token-present')
+    logfire.instrument_pydantic_ai()
+
+    accuracies = asyncio.run(run_evals(args.models, args.cases, args.seed, args.concurrency, args.judge, args.verbose))
+    if args.min_accuracy is not None and (failed := [m for m, a in accuracies.items() if a < args.min_accuracy]):
+        sys.exit(f'accuracy below {args.min_accuracy:.0%}: {", ".join(failed)}')
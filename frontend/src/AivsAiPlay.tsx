@@ -1,8 +1,9 @@
-import { Component, createSignal, Show, onMount } from 'solid-js'
+import { Component, createSignal, Show, onCleanup, onMount } from 'solid-js'
 import styles from './App.module.css'
-import { getGameState, makeMove, GameState } from './ai-service'
+import { getGameState, subscribeToGame, GameState, MoveEvent } from './ai-service'
 import { PlayerColor, Board, createEmptyBoard } from './game-types'
 import GameBoard from './GameBoard'
+import MoveReasoning, { createMoveReasoning } from './MoveReasoning'
 import { A, useParams } from '@solidjs/router'
 
 const AiVsAiPlay: Component = () => {
@@ -17,13 +18,17 @@ const AiVsAiPlay: Component = () => {
   const [gameStatus, setGameStatus] = createSignal<'playing' | 'pink-win' | 'orange-win' | 'draw'>('playing')
   const [PinkAI, setPinkAI] = createSignal<string>('')
   const [OrangeAI, setOrangeAI] = createSignal<string>('')
+  // the reasoning of the model making the next move
+  const reasoning = createMoveReasoning()
+  let gameState: GameState | null = null
+  let unsubscribe: (() => void) | null = null
 
   // Load game state from server
   const loadGameState = async () => {
     setIsLoading(true)
     setErrorMessage(null) // Clear any previous errors
     try {
-      const gameState = await getGameState(gameId!)
+      gameState = await getGameState(gameId!)
       console.log('Received game state:', gameState)
 
       if (gameState.pinkAI === null) {
@@ -38,12 +43,16 @@ const AiVsAiPlay: Component = () => {
       // Apply the state
       applyGameState(gameState)
 
-      // If the game is still going, start autoplay
+      // If the game is still going, the server plays it and streams us the moves
       if (gameState.status === 'playing') {
-        // Use a small delay to let the UI update first
-        setTimeout(() => {
-          autoPlayAIvsAI()
-        }, 500)
+        unsubscribe = subscribeToGame(
+          gameId!,
+          handleMoveEvent,
+          (message) => {
+            setErrorMessage(`Error in AI autoplay: ${message}`)
+          },
+          reasoning.onReasoning,
+        )
       }
     } catch (error) {
       console.error('Error loading game state:', error)
@@ -93,24 +102,16 @@ const AiVsAiPlay: Component = () => {
     setCurrentPlayer(nextPlayer)
   }
 
-  // Function to handle AI vs AI autoplay
-  const autoPlayAIvsAI = async () => {
-    setErrorMessage(null)
-
-    try {
-      const newState = await makeMove(gameId!)
-      applyGameState(newState)
-
-      // If the game is still going, schedule the next move
-      if (newState.status === 'playing') {
-        setTimeout(() => {
-          autoPlayAIvsAI()
-        }, 1000)
-      }
-    } catch (error) {
-      console.error('Error in AI vs AI autoplay:', error)
-      setErrorMessage(`Error in AI autoplay: ${error instanceof Error ? error.message : 'Unknown error'}`)
+  // Apply a move streamed from the server
+  const handleMoveEvent = (event: MoveEvent) => {
+    // the stream starts from the first move, skip the moves we already have from the initial state
+    if (gameState === null || event.ply <= gameState.moves.length) {
+      return
     }
+    gameState.moves.push({ player: event.player, column: event.column })
+    gameState.status = event.status
+    applyGameState(gameState)
+    reasoning.reset()
   }
 
   // Load game state on mount
@@ -118,6 +119,10 @@ const AiVsAiPlay: Component = () => {
     loadGameState()
   })
 
+  onCleanup(() => {
+    unsubscribe?.()
+  })
+
   // Render the current player status or game result
   const renderGameStatus = () => {
     if (isLoading()) {
@@ -185,6 +190,7 @@ const AiVsAiPlay: Component = () => {
       </div>
 
       <GameBoard board={board()} />
+      <MoveReasoning state={reasoning} />
       <section class={styles.playerInfo}>
         <section class={styles.player}>
           <div classList={{ [styles.gamePiece]: true, [styles.player1]: true }} />
@@ -1,8 +1,9 @@
-import { Component, createSignal, createEffect, Show, onMount } from 'solid-js'
+import { Component, createSignal, createEffect, Show, onMount, onCleanup } from 'solid-js'
 import styles from './App.module.css'
-import { getGameState, makeMove, GameState } from './ai-service'
+import { getGameState, connectToGame, GameConnection, GameState, MoveEvent } from './ai-service'
 import { PlayerColor, Board, createEmptyBoard } from './game-types'
 import GameBoard, { GameBoardControls, isColumnAvailable } from './GameBoard'
+import MoveReasoning, { createMoveReasoning } from './MoveReasoning'
 import { A, useParams } from '@solidjs/router'
 
 const HumanAIPlay: Component = () => {
@@ -16,6 +17,10 @@ const HumanAIPlay: Component = () => {
   const [errorMessage, setErrorMessage] = createSignal<string | null>(null)
   const [gameStatus, setGameStatus] = createSignal<'playing' | 'pink-win' | 'orange-win' | 'draw'>('playing')
   const [OrangeAI, setOrangeAI] = createSignal<string>('')
+  const reasoning = createMoveReasoning()
+  // moves on the board, so moves echoed back by the server aren't placed twice
+  let ply = 0
+  let connection: GameConnection | null = null
 
   // Load game state from server
   const loadGameState = async () => {
@@ -76,6 +81,7 @@ const HumanAIPlay: Component = () => {
 
     // Set the board state
     setBoard(newBoard)
+    ply = gameState.moves.length
 
     // Set the current player to the opposite of the last player
     const nextPlayer = lastPlayer === PlayerColor.PINK ? PlayerColor.ORANGE : PlayerColor.PINK
@@ -87,6 +93,45 @@ const HumanAIPlay: Component = () => {
     return gameStatus() !== 'playing'
   }
 
+  // Connect to the server's game session, moves are sent over the connection rather than one request each
+  const connect = () => {
+    connection = connectToGame(gameId!, handleMoveEvent, handleMoveRejected, (reason) => {
+      console.error('Game connection closed:', reason)
+      connection = null
+      setIsAIThinking(false)
+      setErrorMessage(`Connection closed: ${reason}`)
+      // the connection is reopened on the next move
+      loadGameState()
+    }, reasoning.onReasoning)
+  }
+
+  // A move from the server, either the acknowledgement of our move or the AI's move
+  const handleMoveEvent = (event: MoveEvent) => {
+    if (event.ply > ply) {
+      const newBoard = board().map((row) => [...row])
+      const columnIndex = event.column - 1
+      const rowIndex = newBoard.findLastIndex((row) => row[columnIndex] === null)
+      newBoard[rowIndex][columnIndex] = event.player === 'pink' ? PlayerColor.PINK : PlayerColor.ORANGE
+      setBoard(newBoard)
+      ply = event.ply
+    }
+    setGameStatus(event.status)
+    if (event.player === 'orange' || event.status !== 'playing') {
+      setCurrentPlayer(PlayerColor.PINK)
+      setIsAIThinking(false)
+    } else {
+      setCurrentPlayer(PlayerColor.ORANGE)
+    }
+  }
+
+  const handleMoveRejected = (message: string) => {
+    console.error('Move rejected:', message)
+    setIsAIThinking(false)
+    setErrorMessage(`Failed to make move: ${message}`)
+    // undo the move we placed optimistically
+    loadGameState()
+  }
+
   // Place a token in the selected column
   const placeToken = async (columnIndex: number) => {
     if (isAIThinking() || isGameOver()) return false // Don't allow moves after game end
@@ -109,6 +154,7 @@ const HumanAIPlay: Component = () => {
         placed = true
         // Update the board state immediately
         setBoard(newBoard)
+        ply++
         break
       }
     }
@@ -118,35 +164,26 @@ const HumanAIPlay: Component = () => {
       return false
     }
 
-    setIsAIThinking(true) // Show loading state while making the API move
+    setIsAIThinking(true) // Show loading state until the AI's move arrives
     setErrorMessage(null) // Clear any previous errors
+    reasoning.reset() // The AI's reasoning for its last move stays up until we move
 
-    try {
-      console.log(`Making move in column ${columnIndex} for game ${gameId}`)
-      // Call the API to make the move and get updated game state (including AI's response move)
-      const gameState = await makeMove(gameId!, columnIndex)
-      console.log('Received updated game state after move:', gameState)
-
-      // Apply the server-returned game state (overwrites our local changes)
-      applyGameState(gameState)
-
-      return true // Move was successful
-    } catch (error) {
-      console.error('Error making move:', error)
-      loadGameState()
-
-      setErrorMessage(`Failed to make move: ${error instanceof Error ? error.message : 'Unknown error'}`)
-      return false
-    } finally {
-      setIsAIThinking(false)
+    console.log(`Making move in column ${columnIndex} for game ${gameId}`)
+    if (connection === null) {
+      connect()
     }
+    connection!.sendMove(columnIndex)
+    return true
   }
 
   // Load game state on mount
-  onMount(() => {
-    loadGameState()
+  onMount(async () => {
+    await loadGameState()
+    connect()
   })
 
+  onCleanup(() => connection?.close())
+
   // Render the current player status or game result
   const renderGameStatus = () => {
     if (isLoading()) {
@@ -212,6 +249,8 @@ const HumanAIPlay: Component = () => {
 
       <GameBoard board={board()} />
 
+      <MoveReasoning state={reasoning} />
+
       <section class={styles.playerInfo}>
         <section class={styles.player}>
           <div classList={{ [styles.gamePiece]: true, [styles.player1]: true }} />
@@ -0,0 +1,51 @@
+import { Component, Show, createSignal } from 'solid-js'
+import styles from './App.module.css'
+import type { ReasoningEvent } from './ai-service'
+
+// The reasoning of the model generating a move, built up from the events streamed while it runs
+export function createMoveReasoning() {
+  const [thinking, setThinking] = createSignal('')
+  const [reasoning, setReasoning] = createSignal('')
+  const [column, setColumn] = createSignal<number | null>(null)
+  let model: string | null = null
+
+  const onReasoning = (event: ReasoningEvent) => {
+    // a hedged move streams the reasoning of both models, only show the first
+    model ??= event.model
+    if (event.model !== model) return
+    if (event.thinking) setThinking(thinking() + event.thinking)
+    if (event.reasoning) setReasoning(reasoning() + event.reasoning)
+    if (event.column) setColumn(event.column)
+  }
+
+  const reset = () => {
+    model = null
+    setThinking('')
+    setReasoning('')
+    setColumn(null)
+  }
+
+  return { thinking, reasoning, column, onReasoning, reset }
+}
+
+export type MoveReasoningState = ReturnType<typeof createMoveReasoning>
+
+const MoveReasoning: Component<{ state: MoveReasoningState }> = (props) => {
+  return (
+    <Show when={props.state.thinking() || props.state.reasoning() || props.state.column()}>
+      <div class={styles.moveReasoning}>
+        <Show when={props.state.thinking()}>
+          <p class={styles.thinkingText}>{props.state.thinking()}</p>
+        </Show>
+        <Show when={props.state.reasoning()}>
+          <p>{props.state.reasoning()}</p>
+        </Show>
+        <Show when={props.state.column()}>
+          <p class={styles.chosenColumn}>Column {props.state.column()}</p>
+        </Show>
+      </div>
+    </Show>
+  )
+}
+
+export default MoveReasoning
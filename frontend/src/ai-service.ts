@@ -38,7 +38,7 @@ export async function initializeGame(orangeAI: string, pinkAI: string | null): P
   return data.gameID
 }
 
-interface Move {
+export interface Move {
   player: 'pink' | 'orange'
   column: number // 1-7 representing columns
 }
@@ -89,3 +89,117 @@ export async function makeMove(gameId: string, columnIndex?: number): Promise<Ga
   const data: GameState = await response.json()
   return data
 }
+
+// A move streamed from `/api/games/{id}/events`, `ply` is the 1-based index of the move in the game
+export interface MoveEvent extends Move {
+  ply: number
+  status: GameState['status']
+}
+
+// Streamed while a model generates a move: text to add to its thinking or reasoning, then the column it chose as soon
+// as the server has parsed and validated it, before the move itself
+export interface ReasoningEvent {
+  model: string
+  thinking?: string
+  reasoning?: string
+  column?: number
+}
+
+// Subscribe to the moves of an AI vs AI game, the server plays the game and pushes each move as it's made.
+// Returns a function to close the stream.
+export function subscribeToGame(
+  gameId: string,
+  onMove: (event: MoveEvent) => void,
+  onError: (message: string) => void,
+  onReasoning?: (event: ReasoningEvent) => void,
+): () => void {
+  const source = new EventSource(`/api/games/${gameId}/events`)
+
+  source.addEventListener('reasoning', (message) => {
+    onReasoning?.(JSON.parse(message.data))
+  })
+
+  source.onmessage = (message) => {
+    const event: MoveEvent = JSON.parse(message.data)
+    onMove(event)
+    if (event.status !== 'playing') {
+      source.close()
+    }
+  }
+
+  // sent by the server when generating a move fails
+  source.addEventListener('error', (message) => {
+    if (message instanceof MessageEvent) {
+      source.close()
+      const error: { error: string } = JSON.parse(message.data)
+      onError(error.error)
+    } else if (source.readyState === EventSource.CLOSED) {
+      onError('Connection to the server was lost')
+    }
+    // otherwise the browser reconnects, sending `Last-Event-ID` so the stream resumes after the last move
+  })
+
+  return () => source.close()
+}
+
+// A connection to `/api/games/{id}/ws`, which plays a human vs AI game held in memory by the server
+export interface GameConnection {
+  // Send the human's move, `columnIndex` is 0-6
+  sendMove: (columnIndex: number) => void
+  close: () => void
+}
+
+// Connect to a human vs AI game, each move is acknowledged with a `MoveEvent` as soon as the server has validated it,
+// followed by the AI's reasoning as it's streamed and its move once it's ready. `onClose` is called with the reason
+// if the server closes the connection.
+export function connectToGame(
+  gameId: string,
+  onMove: (event: MoveEvent) => void,
+  onError: (message: string) => void,
+  onClose: (reason: string) => void,
+  onReasoning?: (event: ReasoningEvent) => void,
+): GameConnection {
+  const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
+  const socket = new WebSocket(`${protocol}//${window.location.host}/api/games/${gameId}/ws`)
+  // moves made before the connection opens are sent once it's open
+  const pending: string[] = []
+  let closedByClient = false
+
+  socket.onopen = () => {
+    pending.forEach((message) => socket.send(message))
+    pending.length = 0
+  }
+
+  socket.onmessage = (message) => {
+    const data: MoveEvent | ReasoningEvent | { error: string } = JSON.parse(message.data)
+    if ('error' in data) {
+      onError(data.error)
+    } else if ('model' in data) {
+      onReasoning?.(data)
+    } else {
+      onMove(data)
+    }
+  }
+
+  socket.onclose = (event) => {
+    if (!closedByClient) {
+      onClose(event.reason || 'Connection to the server was lost')
+    }
+  }
+
+  return {
+    sendMove: (columnIndex: number) => {
+      // Convert column index (0-6) to column number (1-7)
+      const message = JSON.stringify({ column: columnIndex + 1 })
+      if (socket.readyState === WebSocket.CONNECTING) {
+        pending.push(message)
+      } else {
+        socket.send(message)
+      }
+    },
+    close: () => {
+      closedByClient = true
+      socket.close()
+    },
+  }
+}
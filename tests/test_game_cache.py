@@ -0,0 +1,49 @@
+import os
+import unittest
+
+from backend.db import DB
+
+
+@unittest.skipUnless(os.getenv('DATABASE_URL'), 'needs a database, set DATABASE_URL')
+class GameCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        # two processes sharing the database, each with its own game cache
+        self.a = await self.enterAsyncContext(DB.connect())
+        self.b = await self.enterAsyncContext(DB.connect())
+
+    async def test_read_after_write_in_another_process(self):
+        game_id = await self.a.create_game('local:c4')
+        game_state = await self.a.get_game(game_id)
+        assert game_state is not None
+        # cached by `b` before the moves
+        self.assertIsNotNone(await self.b.get_game(game_id))
+
+        for column in (4, 3, 4):
+            await self.a.handle_move(game_id, game_state, column)
+        moved = await self.b.get_game(game_id)
+
+        assert moved is not None
+        self.assertEqual([m.column for m in moved.moves], [4, 3, 4])
+        self.assertEqual(moved.board, game_state.board)
+        self.assertEqual(await self.b.get_game_version(game_id), (3, 'playing'))
+        # and `b` can carry on from the refreshed state
+        await self.b.handle_move(game_id, moved, 3)
+        self.assertEqual([m.column for m in (await self.a.get_game(game_id) or game_state).moves], [4, 3, 4, 3])
+
+    async def test_finished_elsewhere(self):
+        game_id = await self.a.create_game('local:c4')
+        game_state = await self.a.get_game(game_id)
+        assert game_state is not None
+        self.assertIsNotNone(await self.b.get_game(game_id))
+
+        for column in (1, 2, 1, 2, 1, 2, 1):
+            await self.a.handle_move(game_id, game_state, column)
+        finished = await self.b.get_game(game_id)
+
+        assert finished is not None
+        self.assertEqual(finished.status, 'pink-win')
+        self.assertEqual(len(finished.moves), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
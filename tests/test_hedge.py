@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from backend import hedge as hedge_module
+from backend.hedge import LatencyTracker, hedge
+
+
+class HedgeTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.latencies = LatencyTracker()
+        self.histogram = mock.Mock()
+        for patcher in (
+            mock.patch.object(hedge_module, 'latencies', self.latencies),
+            mock.patch.object(hedge_module, 'latency_histogram', self.histogram),
+            mock.patch.object(hedge_module, 'hedge_default_delay', 0.05),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_fast_primary_is_not_hedged(self):
+        backup = mock.AsyncMock(return_value=2)
+
+        result = await hedge('primary', mock.AsyncMock(return_value=4), 'backup', backup)
+
+        self.assertEqual(result, (4, 'primary'))
+        backup.assert_not_called()
+        (_, attributes), _ = self.histogram.record.call_args
+        self.assertEqual(attributes, {'model': 'primary', 'hedged': False})
+        self.assertEqual(len(self.latencies._latencies['primary']), 1)
+
+    async def test_cancelled_primary_latency_is_not_recorded(self):
+        async def slow_primary() -> int:
+            await asyncio.sleep(10)
+            return 4
+
+        result = await hedge('primary', slow_primary, 'backup', mock.AsyncMock(return_value=2))
+
+        self.assertEqual(result, (2, 'backup'))
+        (_, attributes), _ = self.histogram.record.call_args
+        self.assertEqual(attributes, {'model': 'primary', 'hedged': True})
+        self.assertNotIn('primary', self.latencies._latencies)
+
+
+if __name__ == '__main__':
+    unittest.main()
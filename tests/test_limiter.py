@@ -0,0 +1,45 @@
+import asyncio
+import unittest
+
+from backend.limiter import AdaptiveLimiter
+
+
+class AdaptiveLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_waiters_acquire_in_order(self):
+        limiter = AdaptiveLimiter('test', 2, adaptive=False)
+        order: list[str] = []
+
+        async def play(name: str, moves: int) -> None:
+            for move in range(moves):
+                # released and acquired again straight away, so it competes with the waiters being woken
+                async with limiter.acquire():
+                    order.append(f'{name}{move}')
+                    await asyncio.sleep(0.001)
+
+        await asyncio.gather(*(play(name, 3) for name in 'abcd'))
+
+        # each release hands the slot to the longest waiter, so players take turns rather than cutting in
+        self.assertEqual(order, ['a0', 'b0', 'c0', 'd0', 'a1', 'b1', 'c1', 'd1', 'a2', 'b2', 'c2', 'd2'])
+        self.assertEqual(limiter.in_flight, 0)
+
+    async def test_cancelled_waiter_passes_its_slot_on(self):
+        limiter = AdaptiveLimiter('test', 1, adaptive=False)
+        acquired: list[str] = []
+
+        async def acquire(name: str) -> None:
+            async with limiter.acquire():
+                acquired.append(name)
+
+        async with limiter.acquire():
+            first, second = asyncio.create_task(acquire('first')), asyncio.create_task(acquire('second'))
+            await asyncio.sleep(0)
+        # woken with the slot, but cancelled before it runs
+        first.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+
+        self.assertEqual(acquired, ['second'])
+        self.assertEqual(limiter.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import threading
+import unittest
+
+from backend.game import GameState
+from backend.solver import SearchBudget, solve
+from backend.transposition import TranspositionTable
+
+
+class SolverTest(unittest.TestCase):
+    def test_cancel_stops_the_search(self):
+        position = GameState(pink_ai='local:c4', orange_ai='local:c4').position
+        cancel = threading.Event()
+        timer = threading.Timer(0.05, cancel.set)
+        timer.start()
+        result = solve(position, SearchBudget(max_seconds=60, max_nodes=10**12), TranspositionTable(16), cancel)
+        timer.join()
+
+        self.assertLess(result.elapsed, 1)
+        self.assertIn(result.column, position.legal_columns())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import asyncio
+import unittest
+from uuid import uuid4
+
+from pydantic_ai.messages import ModelMessage, ModelResponse
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from backend.agent import connect4_agent
+from backend.game import GameState
+from backend.speculation import Speculator
+
+
+class SpeculatorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_request_budget_holds_when_replies_are_cancelled(self):
+        requests = 0
+
+        async def slow_model(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+            nonlocal requests
+            requests += 1
+            await asyncio.sleep(60)
+            raise AssertionError('cancelled before replying')
+
+        speculator = Speculator(columns=3, models={'gateway/openai:gpt-4.1'}, max_requests=4)
+        game_id = uuid4()
+        game_state = GameState(pink_ai=None, orange_ai='gateway/openai:gpt-4.1')
+        started: list[int] = []
+        with connect4_agent.override(model=FunctionModel(slow_model)):
+            for human, ai in ((4, 4), (3, 3), (5, 5)):
+                speculator.speculate(game_id, game_state)
+                speculation = speculator._games.get(game_id)
+                started.append(len(speculation.replies) if speculation else 0)
+                await asyncio.sleep(0.2)
+                # the human plays before any reply is ready, the used reply is abandoned too
+                game_state.handle_move(human)
+                if speculated := speculator.take(game_id, len(game_state.moves) - 1, human):
+                    speculated.cancel()
+                game_state.handle_move(ai)
+            await asyncio.sleep(0.2)
+
+        self.assertEqual(started, [3, 1, 0])
+        self.assertEqual(requests, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from pydantic_ai.messages import ModelMessage, ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from backend.agent import connect4_agent
+from backend.game import COLUMN_PREFERENCE
+from backend.tournament import Tournament
+
+
+class TournamentTest(unittest.IsolatedAsyncioTestCase):
+    async def test_repeated_games_call_the_model(self):
+        calls = 0
+
+        def play_center(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+            nonlocal calls
+            calls += 1
+            tool = info.output_tools[0]
+            legal = tool.parameters_json_schema['properties']['column']['enum']
+            column = next(c for c in COLUMN_PREFERENCE if c in legal)
+            return ModelResponse(parts=[ToolCallPart(tool.name, {'column': column, 'reasoning': 'center'})])
+
+        tournament = Tournament(['gateway/openai:gpt-4.1', 'greedy'], rounds=2)
+        with connect4_agent.override(model=FunctionModel(play_center)):
+            await tournament.run()
+
+        results = sorted(tournament.results.values(), key=lambda r: r.key)
+        self.assertEqual(len(results), 4)
+        # both players are deterministic, so the second round replays the first move for move
+        self.assertEqual([r.columns for r in results[:2]], [r.columns for r in results[2:]])
+        model_moves = sum(
+            len(r.move_seconds[p]) for r in results for p in ('pink', 'orange') if getattr(r, p) != 'greedy'
+        )
+        self.assertEqual(calls, model_moves)
+
+
+if __name__ == '__main__':
+    unittest.main()